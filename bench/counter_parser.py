@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro benchmark for the protocol parser in nflogipacd.Counter. A synthetic
+snapshot of UPDATE or BULK_UPDATE messages is written to one end of a
+socketpair by a feeder thread and collected into an AccountBatch by a
+ReportingCounter on the other end. No counter process is spawned.
+"""
+
+import asyncore
+import optparse
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import nflogipacd
+
+
+def make_address(index, addrlen):
+	return struct.pack("!I", index).rjust(addrlen, "\0")
+
+
+def make_stream(records, addrlen, bulk):
+	"""
+	@type records: int
+	@type addrlen: int
+	@type bulk: bool
+	@param bulk: whether to use BULK_UPDATE instead of UPDATE messages
+	@rtype: str
+	@returns: a protocol.txt response to one request
+	"""
+	parts = []
+	if bulk:
+		chunk = 16384
+		for first in xrange(0, records, chunk):
+			indices = xrange(first, min(records, first + chunk))
+			parts.append(struct.pack("!HHIHH", 12, 4, len(indices), addrlen, 0))
+			parts.extend(struct.pack("!Q", 64 + i % 1500) for i in indices)
+			parts.extend(make_address(i, addrlen) for i in indices)
+	else:
+		update = struct.Struct("!HHQ%ds" % addrlen)
+		for i in xrange(records):
+			parts.append(update.pack(update.size, 1, 64 + i % 1500,
+									 make_address(i, addrlen)))
+	parts.append(struct.pack("!HH", 4, 2))
+	return "".join(parts)
+
+
+class BenchCounter(nflogipacd.ReportingCounter):
+	def __init__(self, sock, mapping):
+		self.sock = sock
+		nflogipacd.ReportingCounter.__init__(self, 0, "bench", (),
+											 self.count_batch, self.finish,
+											 None, mapping)
+		self.records = 0
+		self.finished = None
+
+	def spawn(self):
+		return 0, self.sock
+
+	def count_batch(self, timestamp, group, batch):
+		self.records += len(batch)
+
+	def finish(self, group):
+		self.finished = time.time()
+		self.close()
+
+
+def feed(sock, data):
+	sock.sendall(data)
+	sock.close()
+
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("-n", "--records", type="int", default=1000000,
+					  help="number of records in the snapshot")
+	parser.add_option("-6", "--ipv6", action="store_true", default=False,
+					  help="use 16 byte addresses instead of 4 byte ones")
+	parser.add_option("-b", "--bulk", action="store_true", default=False,
+					  help="use BULK_UPDATE instead of UPDATE messages")
+	options, _ = parser.parse_args()
+
+	data = make_stream(options.records, 16 if options.ipv6 else 4,
+					   options.bulk)
+	parentsock, childsock = socket.socketpair()
+	mapping = {}
+	counter = BenchCounter(parentsock, mapping)
+	feeder = threading.Thread(target=feed, args=(childsock, data))
+	start = time.time()
+	feeder.start()
+	asyncore.loop(map=mapping)
+	feeder.join()
+	if counter.finished is None or counter.records != options.records:
+		sys.exit("parser failed after %d records" % counter.records)
+	duration = counter.finished - start
+	print("parsed %d records (%d bytes) in %.3fs: %.0f records/s" %
+		  (counter.records, len(data), duration, counter.records / duration))
+
+
+if __name__ == '__main__':
+	main()
+
+# vim:ts=4 sw=4
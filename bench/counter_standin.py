@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the nflogipacd counter program. It takes the same arguments and
+answers snapshot requests on stdin as described in protocol.txt, but instead
+of counting NFLOG packets it returns the same reproducible snapshot for every
+request. Select it with the counter_path setting of nflogipacd.py to test
+plugins or measure the Python side without NFLOG traffic.
+
+The snapshots are configured by environment variables:
+ - NFLOGIPAC_STANDIN_RECORDS: number of addresses per group (default 100000)
+ - NFLOGIPAC_STANDIN_SEED: seed of the addresses and values (default 0)
+"""
+
+import getopt
+import os
+import random
+import struct
+import sys
+
+# options of nflogipacd, all of which are ignored
+counter_optstring = "r:b:m:q:t:n:S:c:H:T:N:CM:E:k:P:R:G:L:"
+
+update_header = struct.Struct("!HHQ")
+bulk_header = struct.Struct("!HHIHH")
+group_message = struct.Struct("!HHH")
+end_message = struct.pack("!HH", 4, 2)
+# maximum number of records in one BULK_UPDATE message
+bulk_records = 16384
+
+
+def parse_groups(args):
+	"""Extract the groups from the arguments of nflogipacd.
+	@type args: [str]
+	@rtype: [(int, str)]
+	@returns: (group, kind) pairs
+	@raises getopt.GetoptError:
+	@raises ValueError:
+	"""
+	groups = []
+	while args:
+		_, args = getopt.getopt(args, counter_optstring)
+		if len(args) < 2:
+			raise ValueError("missing group or counter")
+		groups.append((int(args[0]), args[1]))
+		args = args[2:]
+	return groups
+
+
+def make_snapshot(group, kind, records, seed):
+	"""Generate the addresses and values of a group.
+	@type group: int
+	@type kind: str
+	@type records: int
+	@type seed: int
+	@rtype: (int, [str], [int])
+	@returns: the address length, the addresses and the values
+	"""
+	rng = random.Random("%d/%d" % (seed, group))
+	if kind.startswith("ipv6"):
+		prefix = struct.pack("!I", 0x20010db8)
+		addresses = [prefix + struct.pack("!QI", rng.getrandbits(64), i)
+					 for i in xrange(records)]
+		addrlen = 16
+	else:
+		addresses = [struct.pack("!I", address) for address in
+					 rng.sample(xrange(1 << 32), records)]
+		addrlen = 4
+	values = [rng.randint(64, 1 << 20) for _ in xrange(records)]
+	return addrlen, addresses, values
+
+
+def encode(addrlen, addresses, values, bulk):
+	"""
+	@type bulk: bool
+	@param bulk: whether to use BULK_UPDATE instead of UPDATE messages
+	@rtype: str
+	"""
+	parts = []
+	if bulk:
+		for first in xrange(0, len(values), bulk_records):
+			chunk = values[first:first + bulk_records]
+			parts.append(bulk_header.pack(12, 4, len(chunk), addrlen, 0))
+			parts.append(struct.pack("!%dQ" % len(chunk), *chunk))
+			parts.extend(addresses[first:first + bulk_records])
+	else:
+		for address, value in zip(addresses, values):
+			parts.append(update_header.pack(12 + addrlen, 1, value))
+			parts.append(address)
+	return "".join(parts)
+
+
+def main():
+	try:
+		groups = parse_groups(sys.argv[1:])
+	except (getopt.GetoptError, ValueError) as err:
+		sys.exit("usage: %s [options] group counter ...: %s" %
+				 (sys.argv[0], err))
+	records = int(os.environ.get("NFLOGIPAC_STANDIN_RECORDS", "100000"))
+	seed = int(os.environ.get("NFLOGIPAC_STANDIN_SEED", "0"))
+	snapshots = [make_snapshot(group, kind, records, seed)
+				 for group, kind in groups]
+	encoded = {}  # bulk -> messages of all groups
+	out = os.fdopen(1, "wb")
+	while True:
+		request = os.read(0, 1)
+		if not request:
+			return
+		level = int(request) if request.isdigit() else 0
+		bulk = level >= 1
+		if bulk not in encoded:
+			encoded[bulk] = [encode(addrlen, addresses, values, bulk)
+							 for addrlen, addresses, values in snapshots]
+		for (group, _), messages in zip(groups, encoded[bulk]):
+			if level >= 3:
+				out.write(group_message.pack(6, 6, group))
+			out.write(messages)
+		out.write(end_message)
+		out.flush()
+
+
+if __name__ == '__main__':
+	main()
+
+# vim:ts=4 sw=4
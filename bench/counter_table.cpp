@@ -0,0 +1,265 @@
+/*
+ * Benchmark for the per packet counting path of nflogipacd. Synthetic IP
+ * headers with random addresses are counted by the counters of nflogipacd and
+ * by the former mutex protected std::string keyed maps (tr1::unordered_map and
+ * the USE_STANDARD_MAP fallback std::map) for comparison. Each counter is run
+ * once on its own and once while another thread takes a snapshot every 10ms.
+ * Finally the packets are spread over 1 up to the given number of receiving
+ * threads (default: number of online CPUs) each counting into its own shard
+ * pinned to a CPU to show how sharding scales.
+ *
+ * Usage: counter_table [packets [addresses [threads]]]
+ */
+
+#define NFLOGIPAC_NO_MAIN
+#include "../nflogipacd.cpp"
+
+#include <fcntl.h>
+#include <sys/time.h>
+
+#include <map>
+#include <tr1/unordered_map>
+
+#include <boost/thread/mutex.hpp>
+
+/**
+ * The counting path of nflogipacd before the introduction of counter_table.
+ */
+template<typename Map, size_t offset, size_t addrlen>
+class string_counter : public nflogipac_counter {
+	private:
+		boost::mutex lock;
+		Map counters;
+		Map retired;
+	public:
+		string_counter() : nflogipac_counter(offset + addrlen) {}
+		void count(const char *payload) {
+			const uint64_t totlen(readuint16(payload+2u));
+			std::string addr(payload+offset, addrlen);
+			applynetmask(addr, 8u * addrlen);
+			boost::lock_guard<boost::mutex> lock(this->lock);
+			this->counters[addr] += totlen;
+		}
+		bool attach(nflogipac_counter *) {
+			return false;
+		}
+		void limit_entries(size_t) {}
+		void filter_entries(uint64_t, size_t, bool) {}
+		void share(const std::string &, uint16_t, size_t) {}
+		void publish() {}
+		uint64_t checkpoint(const std::string &, uint16_t) {
+			return 0u;
+		}
+		void retire() {
+			boost::lock_guard<boost::mutex> lg(this->lock);
+			this->retired.swap(this->counters);
+		}
+		bool writedata(frame_writer &, unsigned int) {
+			this->retired.clear();
+			return true;
+		}
+};
+
+struct string_hash : public std::unary_function<std::string, size_t> {
+	size_t operator()(const std::string &s) const {
+		size_t ret(0u);
+		std::memcpy(&ret, s.data(), std::min(sizeof(ret), s.size()));
+		for(size_t i(sizeof(ret)); i + sizeof(ret) <= s.size();
+				i += sizeof(ret)) {
+			size_t tmp;
+			std::memcpy(&tmp, s.data() + i, sizeof(tmp));
+			ret ^= tmp;
+		}
+		return ret;
+	}
+};
+
+double now() {
+	struct timeval tv;
+	gettimeofday(&tv, 0);
+	return tv.tv_sec + tv.tv_usec / 1e6;
+}
+
+/**
+ * Generate packets IP headers of the given length with random addresses.
+ * The addresses are confined to the given number of distinct values.
+ */
+std::vector<char> make_packets(unsigned int packets, unsigned int addresses,
+		size_t headerlen) {
+	std::vector<char> buf(packets * headerlen);
+	std::srand(1);
+	for(unsigned int i(0u); i < packets; ++i) {
+		char *header(&buf[i * headerlen]);
+		writeuint16(header+2u, 64u + std::rand() % 1400u);
+		writeuint16(header+4u, 24u + std::rand() % 1400u);
+		const uint64_t addr(std::rand() % addresses);
+		for(size_t j(8u); j + 4u <= headerlen; j += 4u)
+			writeuint32(header+j, mix64(addr << 8 | j));
+	}
+	return buf;
+}
+
+void snapshot_loop(nflogipac_counter *counter, volatile bool *stop,
+		unsigned int *snapshots) {
+	const int fd(open("/dev/null", O_WRONLY));
+	frame_writer out(fd);
+	while(!*stop) {
+		counter->retire();
+		counter->writedata(out, PROTOCOL_LEVEL);
+		++*snapshots;
+		usleep(10000);
+	}
+	close(fd);
+}
+
+void run(const char *name, nflogipac_counter *counter,
+		const std::vector<char> &packets, size_t headerlen,
+		bool snapshot) {
+	/* Roughly the number of packets in one netlink datagram. */
+	static const size_t batchsize(32u);
+	const size_t count(packets.size() / headerlen);
+	volatile bool stop(false);
+	unsigned int snapshots(0u);
+	boost::thread *snapshotter(0);
+	if(snapshot)
+		snapshotter = new boost::thread(boost::bind(&snapshot_loop,
+					counter, &stop, &snapshots));
+	const double start(now());
+	for(size_t i(0u); i < count; i += batchsize) {
+		counter->begin_batch();
+		for(size_t j(i); j < std::min(count, i + batchsize); ++j)
+			counter->count(&packets[j * headerlen]);
+		counter->end_batch();
+	}
+	const double duration(now() - start);
+	if(snapshotter) {
+		stop = true;
+		snapshotter->join();
+		delete snapshotter;
+	}
+	std::cout << name << ": " << (unsigned long)(count / duration)
+		<< " packets/s";
+	if(snapshot)
+		std::cout << " with " << snapshots << " snapshots";
+	std::cout << std::endl;
+}
+
+void count_slice(nflogipac_counter *counter, const std::vector<char> &packets,
+		size_t headerlen, size_t first, size_t last,
+		volatile unsigned int *finished) {
+	static const size_t batchsize(32u);
+	for(size_t i(first); i < last; i += batchsize) {
+		counter->begin_batch();
+		for(size_t j(i); j < std::min(last, i + batchsize); ++j)
+			counter->count(&packets[j * headerlen]);
+		counter->end_batch();
+	}
+	__sync_fetch_and_add(finished, 1u);
+}
+
+/**
+ * Count the packets with the given number of shards, each fed by its own
+ * thread, while the main thread takes a snapshot every 10ms.
+ * @returns packets per second
+ */
+template<typename Counter>
+double run_sharded(unsigned int threads, const std::vector<char> &packets,
+		size_t headerlen) {
+	const size_t count(packets.size() / headerlen);
+	const unsigned int cpus(std::max(1L, sysconf(_SC_NPROCESSORS_ONLN)));
+	std::vector<Counter*> shards;
+	for(unsigned int i(0u); i < threads; ++i) {
+		shards.push_back(new Counter());
+		if(i > 0u)
+			shards[0]->attach(shards[i]);
+	}
+	const int fd(open("/dev/null", O_WRONLY));
+	frame_writer out(fd);
+	volatile unsigned int finished(0u);
+	const double start(now());
+	boost::thread_group group;
+	for(unsigned int i(0u); i < threads; ++i)
+		pin_thread(*group.create_thread(boost::bind(&count_slice,
+						shards[i], boost::cref(packets),
+						headerlen, count * i / threads,
+						count * (i + 1u) / threads,
+						&finished)),
+				i % cpus);
+	while(finished < threads) {
+		shards[0]->retire();
+		shards[0]->writedata(out, PROTOCOL_LEVEL);
+		usleep(10000);
+	}
+	const double duration(now() - start);
+	group.join_all();
+	shards[0]->retire();
+	shards[0]->writedata(out, PROTOCOL_LEVEL);
+	close(fd);
+	for(unsigned int i(0u); i < threads; ++i)
+		delete shards[i];
+	return count / duration;
+}
+
+template<typename Counter>
+void run_both(const char *name, const std::vector<char> &packets,
+		size_t headerlen) {
+	for(int snapshot(0); snapshot < 2; ++snapshot) {
+		Counter counter;
+		run(name, &counter, packets, headerlen, snapshot);
+	}
+}
+
+int main(int argc, char **argv) {
+	unsigned int packets(10000000u), addresses(100000u),
+		     threads(std::max(1L, sysconf(_SC_NPROCESSORS_ONLN)));
+	try {
+		if(argc > 1)
+			packets = str2int(argv[1]);
+		if(argc > 2)
+			addresses = str2int(argv[2]);
+		if(argc > 3)
+			threads = str2int(argv[3]);
+	} catch(nflogipac_error &) {
+		std::cerr << "usage: " << argv[0]
+			<< " [packets [addresses [threads]]]" << std::endl;
+		return 1;
+	}
+	if(0u == addresses)
+		addresses = 1u;
+	if(!seed_table_hash()) {
+		std::cerr << "cannot read /dev/urandom" << std::endl;
+		return 1;
+	}
+	std::cout << packets << " packets, " << addresses << " addresses"
+		<< std::endl;
+
+	const std::vector<char> ipv4(make_packets(packets, addresses, 20u));
+	run_both<nflogipac_counter_ipv4src>("ipv4src counter_table",
+			ipv4, 20u);
+	run_both<string_counter<std::tr1::unordered_map<std::string, uint64_t,
+		string_hash>, 12u, 4u> >("ipv4src tr1::unordered_map",
+				ipv4, 20u);
+	run_both<string_counter<std::map<std::string, uint64_t>, 12u, 4u> >(
+			"ipv4src std::map", ipv4, 20u);
+
+	const std::vector<char> ipv6(make_packets(packets, addresses, 40u));
+	run_both<nflogipac_counter_ipv6src>("ipv6src counter_table",
+			ipv6, 40u);
+	run_both<string_counter<std::tr1::unordered_map<std::string, uint64_t,
+		string_hash>, 8u, 16u> >("ipv6src tr1::unordered_map",
+				ipv6, 40u);
+	run_both<string_counter<std::map<std::string, uint64_t>, 8u, 16u> >(
+			"ipv6src std::map", ipv6, 40u);
+
+	double single(0.0);
+	for(unsigned int i(1u); i <= threads; ++i) {
+		const double rate(run_sharded<nflogipac_counter_ipv4src>(i,
+					ipv4, 20u));
+		if(1u == i)
+			single = rate;
+		std::cout << "ipv4src " << i << " shards: "
+			<< (unsigned long)rate << " packets/s, speedup "
+			<< rate / single << std::endl;
+	}
+	return 0;
+}
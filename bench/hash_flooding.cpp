@@ -0,0 +1,159 @@
+/*
+ * Benchmark for counting addresses chosen to collide in the counter tables.
+ * Every address set is counted into a counter_table using the keyed hash of
+ * nflogipacd and using the former unkeyed MurmurHash3 finalizer, whose hash
+ * values anybody can compute and invert. The sets are:
+ *  - random: addresses without any structure
+ *  - sequential: consecutive addresses like from a scan of a network
+ *  - low-slots: IPv4 addresses whose unkeyed hash values agree in the low 12
+ *    bits, so that they crowd into a few regions of the table
+ *  - collisions: IPv6 addresses that all have the same unkeyed hash value
+ * Each address is counted rounds times in a random order.
+ *
+ * Usage: hash_flooding [addresses [rounds]]
+ */
+
+#define NFLOGIPAC_NO_MAIN
+#include "../nflogipacd.cpp"
+
+#include <sys/time.h>
+
+double now() {
+	struct timeval tv;
+	gettimeofday(&tv, 0);
+	return tv.tv_sec + tv.tv_usec / 1e6;
+}
+
+/**
+ * The hash functions of the keys before they were keyed.
+ */
+struct unkeyed_ipv4_key : public ipv4_key {
+	unkeyed_ipv4_key() {}
+	unkeyed_ipv4_key(const ipv4_key &key) : ipv4_key(key) {}
+	size_t hash() const {
+		return mix64(this->address);
+	}
+};
+
+struct unkeyed_ipv6_key : public ipv6_key {
+	unkeyed_ipv6_key() {}
+	unkeyed_ipv6_key(const ipv6_key &key) : ipv6_key(key) {}
+	size_t hash() const {
+		return mix64(this->words[0] ^ mix64(this->words[1]));
+	}
+};
+
+std::vector<ipv4_key> random_ipv4(unsigned int addresses) {
+	std::vector<ipv4_key> ret(addresses);
+	for(unsigned int i(0u); i < addresses; ++i)
+		ret[i].address = mix64(i);
+	return ret;
+}
+
+std::vector<ipv4_key> sequential_ipv4(unsigned int addresses) {
+	std::vector<ipv4_key> ret(addresses);
+	for(unsigned int i(0u); i < addresses; ++i)
+		ret[i].address = htonl(0x0a000000u + i);
+	return ret;
+}
+
+std::vector<ipv4_key> low_slots_ipv4(unsigned int addresses) {
+	std::vector<ipv4_key> ret;
+	unkeyed_ipv4_key key;
+	for(uint32_t i(0u); ret.size() < addresses && i != 0xffffffffu; ++i) {
+		key.address = i;
+		if(0u == (key.hash() & 0xfffu))
+			ret.push_back(key);
+	}
+	return ret;
+}
+
+std::vector<ipv6_key> random_ipv6(unsigned int addresses) {
+	std::vector<ipv6_key> ret(addresses);
+	for(unsigned int i(0u); i < addresses; ++i) {
+		ret[i].words[0] = mix64(2u * i);
+		ret[i].words[1] = mix64(2u * i + 1u);
+	}
+	return ret;
+}
+
+std::vector<ipv6_key> sequential_ipv6(unsigned int addresses) {
+	std::vector<ipv6_key> ret(addresses);
+	for(unsigned int i(0u); i < addresses; ++i) {
+		ret[i].words[0] = htobe64(UINT64_CONSTANT(0x20010db8u, 0u));
+		ret[i].words[1] = htobe64(i);
+	}
+	return ret;
+}
+
+std::vector<ipv6_key> collisions_ipv6(unsigned int addresses) {
+	std::vector<ipv6_key> ret(addresses);
+	for(unsigned int i(0u); i < addresses; ++i) {
+		ret[i].words[1] = htobe64(i);
+		ret[i].words[0] = mix64(ret[i].words[1]);
+	}
+	return ret;
+}
+
+/**
+ * Count every address rounds times in a random order.
+ * @returns additions per second
+ */
+template<typename TableKey, typename Key>
+double count(const std::vector<Key> &addresses, unsigned int rounds) {
+	const std::vector<TableKey> keys(addresses.begin(), addresses.end());
+	std::vector<size_t> order(addresses.size() * rounds);
+	for(size_t i(0u); i < order.size(); ++i)
+		order[i] = i % addresses.size();
+	std::srand(1);
+	std::random_shuffle(order.begin(), order.end());
+	counter_table<TableKey> table;
+	const double start(now());
+	for(std::vector<size_t>::const_iterator i(order.begin());
+			i != order.end(); ++i)
+		table.add(keys[*i], 64u);
+	return order.size() / (now() - start);
+}
+
+template<typename Key, typename UnkeyedKey>
+void run(const char *name, const std::vector<Key> &addresses,
+		unsigned int rounds) {
+	const double keyed(count<Key>(addresses, rounds));
+	const double unkeyed(count<UnkeyedKey>(addresses, rounds));
+	std::cout << name << " (" << addresses.size() << " addresses): keyed "
+		<< (unsigned long)keyed << " additions/s, unkeyed "
+		<< (unsigned long)unkeyed << " additions/s" << std::endl;
+}
+
+int main(int argc, char **argv) {
+	unsigned int addresses(10000u), rounds(20u);
+	try {
+		if(argc > 1)
+			addresses = str2int(argv[1]);
+		if(argc > 2)
+			rounds = str2int(argv[2]);
+	} catch(nflogipac_error &) {
+		std::cerr << "usage: " << argv[0] << " [addresses [rounds]]"
+			<< std::endl;
+		return 1;
+	}
+	if(0u == addresses)
+		addresses = 1u;
+	if(!seed_table_hash()) {
+		std::cerr << "cannot read /dev/urandom" << std::endl;
+		return 1;
+	}
+	run<ipv4_key, unkeyed_ipv4_key>("ipv4 random",
+			random_ipv4(addresses), rounds);
+	run<ipv4_key, unkeyed_ipv4_key>("ipv4 sequential",
+			sequential_ipv4(addresses), rounds);
+	run<ipv4_key, unkeyed_ipv4_key>("ipv4 low-slots",
+			low_slots_ipv4(addresses), rounds);
+	run<ipv6_key, unkeyed_ipv6_key>("ipv6 random",
+			random_ipv6(addresses), rounds);
+	run<ipv6_key, unkeyed_ipv6_key>("ipv6 sequential",
+			sequential_ipv6(addresses), rounds);
+	run<ipv6_key, unkeyed_ipv6_key>("ipv6 collisions",
+			collisions_ipv6(addresses), rounds);
+	return 0;
+}
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of storing a snapshot with examples/mysqlplugin.py. The plugin talks
+to a stand-in for the MySQLdb module, which formats every statement like
+MySQLdb does, delays every round trip by a fixed latency and counts the
+connections, the round trips and the bytes sent including files of LOAD DATA
+LOCAL INFILE. A connection costs three round trips. For several values of
+insert_batch_rows, with load_data, with userids looked up by userid_query or
+userid_query_bulk and without persistent connections it reports these counts,
+the wall clock time and the CPU time of several snapshots. Both groups account
+the same addresses like the two directions of the traffic of the same hosts.
+"""
+
+import Queue
+import configobj
+import datetime
+import imp
+import optparse
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+plugin_path = os.path.join(os.path.dirname(bench_dir), "examples",
+						   "mysqlplugin.py")
+
+
+class Server(object):
+	"""Counts round trips and delays each by latency seconds."""
+
+	def __init__(self, latency):
+		self.latency = latency
+		self.connects = 0
+		self.roundtrips = 0
+		self.sent = 0
+
+	def connect(self):
+		self.connects += 1
+		if self.latency:
+			time.sleep(3 * self.latency)
+		return Connection(self)
+
+	def roundtrip(self, statement):
+		self.roundtrips += 1
+		self.sent += len(statement)
+		if self.latency:
+			time.sleep(self.latency)
+
+	def literal(self, value):
+		if value is None:
+			return "NULL"
+		if isinstance(value, (int, long)):
+			return str(value)
+		return "'%s'" % str(value).replace("\\", "\\\\").replace("'", "\\'")
+
+
+class OperationalError(Exception):
+	pass
+
+
+class Cursor(object):
+	def __init__(self, server):
+		self.server = server
+		self.result = ()
+
+	def execute(self, query, params):
+		if params:
+			query = query % tuple(map(self.server.literal, params))
+		self.server.roundtrip(query)
+		if query.startswith("LOAD DATA LOCAL INFILE"):
+			with open(params[0]) as datafile:
+				self.server.sent += len(datafile.read())
+		if "information_schema" in query:
+			self.result = [dict(count=1)]
+		elif query.startswith("SELECT IP AS address, id AS userid"):
+			self.result = [dict(address=address, userid="user")
+						   for address in params]
+		elif query.startswith("SELECT id AS userid"):
+			self.result = [dict(userid="user")]
+		elif query.startswith("SELECT NOW()"):
+			self.result = [dict(now=datetime.datetime.now())]
+		else:
+			self.result = []
+
+	def fetchall(self):
+		return self.result
+
+	def close(self):
+		pass
+
+
+class Connection(object):
+	def __init__(self, server):
+		self.server = server
+
+	def cursor(self):
+		return Cursor(self.server)
+
+	def commit(self):
+		self.server.roundtrip("COMMIT")
+
+	def ping(self):
+		self.server.roundtrip("PING")
+
+	def close(self):
+		pass
+
+
+def install_standin(server):
+	"""Make "import MySQLdb" return the stand-in talking to server."""
+	module = imp.new_module("MySQLdb")
+	module.OperationalError = OperationalError
+	module.Error = OperationalError
+	module.connect = lambda **_: server.connect()
+	module.cursors = imp.new_module("MySQLdb.cursors")
+	module.cursors.DictCursor = Cursor
+	sys.modules["MySQLdb"] = module
+	sys.modules["MySQLdb.cursors"] = module.cursors
+
+
+class BenchLog(object):
+	def log_err(self, message, *args):
+		sys.stderr.write((message % args if args else message) + "\n")
+
+	log_error = log_warning = log_err
+
+	def log_notice(self, message, *args):
+		pass
+
+	def log_debug(self, message, level=0, *args):
+		pass
+
+
+def make_config(batch_rows, load_data, userid, persistent):
+	"""
+	@type batch_rows: int
+	@type load_data: bool
+	@type userid: str or None
+	@param userid: is "query" or "bulk" to look up userids with userid_query
+			or userid_query_bulk
+	@type persistent: bool
+	@rtype: configobj.ConfigObj
+	"""
+	lines = ["[main]", "reconnect_interval = 1", "reconnect_attempts = 1",
+			 "query_attempts = 2", "queue_age_warn = 1000000",
+			 "queue_size_warn = 100000000",
+			 "insert_batch_rows = %d" % batch_rows,
+			 "load_data = %s" % load_data,
+			 "persistent_connections = %s" % persistent]
+	if userid == "query":
+		lines.extend(("userid_query = 'SELECT id AS userid FROM onlinedb "
+					  "WHERE IP = ? ORDER BY LOGIN DESC LIMIT 0,1'",
+					  "userid_query_params = address,"))
+	elif userid == "bulk":
+		lines.append("userid_query_bulk = 'SELECT IP AS address, id AS userid "
+					 "FROM onlinedb WHERE IP IN (?) ORDER BY LOGIN'")
+	lines.append("[groups]")
+	for group, direction in ((1, 0), (2, 1)):
+		lines.extend((
+			"[[%d]]" % group,
+			"kind = %s" % ("ipv4dst" if direction == 0 else "ipv4src"),
+			"table_prefix = traffic_", "table_strftime = %Y_%m",
+			"create_table = (IP char(15), bytes bigint)"))
+		if userid is None:
+			lines.extend((
+				"insert = '(pid,hostname,IP,bytes,direction,time) values "
+				"(?,\"myhostname\",?,?,%d,now())'" % direction,
+				"insert_params = pid, address, value"))
+		else:
+			lines.extend((
+				"insert = '(pid,hostname,IP,userid,bytes,direction,time) "
+				"values (?,\"myhostname\",?,?,?,%d,now())'" % direction,
+				"insert_params = pid, address, userid, value"))
+	lines.extend(("[databases]", "[[traffic_bench]]", "host = localhost",
+				  "db = nflogipac", "user = bench", "password = bench",
+				  "[[userid_bench]]", "host = localhost", "db = nflogipac",
+				  "user = bench", "password = bench"))
+	return configobj.ConfigObj(lines, interpolation=False)
+
+
+def run(events, server, batch_rows=1000, load_data=False, userid=None,
+		persistent=True):
+	"""
+	@rtype: (int, int, int, float, float)
+	@returns: the connections, the round trips, the bytes sent and the wall
+			clock and CPU time
+	"""
+	plugin = imp.load_source("__plugin_mysql__", plugin_path).plugin(
+		make_config(batch_rows, load_data, userid, persistent), BenchLog())
+	queue = Queue.Queue()
+	for event in events:
+		queue.put(event)
+	server.connects = server.roundtrips = server.sent = 0
+	cpu = os.times()
+	start = time.time()
+	plugin.run(queue)
+	wall = time.time() - start
+	after = os.times()
+	return (server.connects, server.roundtrips, server.sent, wall,
+			(after[0] - cpu[0]) + (after[1] - cpu[1]))
+
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("-n", "--records", type="int", default=50000,
+					  help="number of records per group")
+	parser.add_option("-l", "--latency", type="float", default=0.2,
+					  help="latency of a round trip in milliseconds")
+	parser.add_option("-b", "--batch-rows", type="int", action="append",
+					  default=[], help="value of insert_batch_rows")
+	parser.add_option("-s", "--snapshots", type="int", default=3,
+					  help="number of snapshots")
+	options, _ = parser.parse_args()
+	server = Server(options.latency / 1000.0)
+	install_standin(server)
+	rng = random.Random(0)
+	timestamp = time.time()
+	addresses = [struct.pack("!I", rng.getrandbits(32))
+				 for _ in xrange(options.records)]
+	snapshot = [("start_write",)]
+	for group in (1, 2):
+		rng.shuffle(addresses)
+		snapshot.extend(("account", timestamp, group, address,
+						 rng.randint(64, 1 << 30)) for address in addresses)
+	snapshot.append(("end_write",))
+	events = snapshot * options.snapshots + [("terminate",)]
+	print("2 groups, %d records per group, %d snapshots, %.2fms latency" %
+		  (options.records, options.snapshots, options.latency))
+	result = "%d connections, %d round trips, %d bytes sent, %.2fs, %.2fs CPU"
+	for batch_rows in options.batch_rows or (1, 100, 1000, 10000):
+		print(("insert_batch_rows %d: " + result) %
+			  ((batch_rows,) + run(events, server, batch_rows)))
+	print("load_data: " + result % run(events, server, load_data=True))
+	for userid in ("query", "bulk"):
+		print(("userid_%s: " + result) %
+			  ((userid,) + run(events, server, userid=userid)))
+	print("userid_bulk, not persistent: " +
+		  result % run(events, server, userid="bulk", persistent=False))
+
+
+if __name__ == '__main__':
+	main()
+
+# vim:ts=4 sw=4
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+End to end benchmark of the Python side of nflogipacd. A GatherThread spawns
+bench/counter_standin.py instead of the counter and passes its snapshots
+through ReportingCounter and the WriteThread queue to a plugin. For each of
+the null, debug and spawn plugins it reports
+ - the latency from requesting a snapshot until the plugin handled its end
+ - the high-water mark of the WriteThread queue
+ - the CPU time of the daemon process per million records
+"""
+
+import asyncore
+import configobj
+import imp
+import optparse
+import os
+import sys
+import threading
+import time
+import validate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import nflogipacd
+from nflogipac.statistics import MeasuredQueue
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+examples_dir = os.path.join(os.path.dirname(bench_dir), "examples")
+plugins = (("null", "nullplugin.py"), ("debug", "debugplugin.py"),
+		   ("spawn", "spawnplugin.py"))
+
+
+class MeteredQueue(MeasuredQueue):
+	"""Queue signalling when the consumer handled an end_write event."""
+
+	def __init__(self):
+		MeasuredQueue.__init__(self)
+		self.written = threading.Event()
+
+	def write_finished(self, now):
+		MeasuredQueue.write_finished(self, now)
+		self.written.set()
+
+
+class BenchWriteThread(nflogipacd.WriteThread):
+	def __init__(self, writeplugin, log):
+		nflogipacd.WriteThread.__init__(self, writeplugin, log)
+		self.queue = MeteredQueue()
+
+	def run(self):
+		# Unlike the daemon the benchmark goes on after the plugin returned.
+		self.writeplugin.run(self.queue)
+
+
+class BenchLog(object):
+	def log_err(self, message):
+		sys.stderr.write(message + "\n")
+
+	log_notice = log_err
+
+	def log_debug(self, message, level):
+		pass
+
+
+def make_config(plugin, groups):
+	"""
+	@type plugin: str
+	@type groups: int
+	@rtype: configobj.ConfigObj
+	"""
+	lines = ["[main]", "plugin = %s" % plugin, "interval = 1",
+			 "cmdline = cat > /dev/null", "[groups]"]
+	for group in xrange(1, groups + 1):
+		lines.extend(("[[%d]]" % group,
+					  "kind = %s" % ("ipv6src" if group % 2 == 0 else
+									 "ipv4src")))
+	config = configobj.ConfigObj(lines, configspec=nflogipacd.config_spec,
+								 interpolation=False)
+	config.validate(validate.Validator())
+	return config
+
+
+def run(name, plugin, options):
+	"""
+	@rtype: (float, float, float, int, float)
+	@returns: the minimum, average and maximum latency, the queue high-water
+			mark and the CPU time per million records
+	"""
+	config = make_config(plugin, options.groups)
+	log = BenchLog()
+	wt = BenchWriteThread(imp.load_source("__plugin_%s__" % name,
+										  plugin).plugin(config, log), log)
+	gt = nflogipacd.GatherThread(1, wt, log, os.path.join(
+		bench_dir, "counter_standin.py"))
+	groups = [(int(group), cfg["kind"], nflogipacd.counter_arguments(cfg))
+			  for group, cfg in config["groups"].items()]
+	gt.add_counter(*groups[0], extra_groups=groups[1:])
+	pid = gt.counters[groups[0][0]].pid
+	wt.start()
+	# The first snapshot makes the stand-in encode its messages.
+	latencies = []
+	for index in xrange(options.snapshots + 1):
+		wt.queue.written.clear()
+		if index == 1:
+			cpu = os.times()
+			wt.queue.highwater = 0
+		start = time.time()
+		gt.request_data()
+		while gt.counters_working:
+			asyncore.loop(1, map=gt.asc.asynmap, count=1)
+		wt.queue.written.wait()
+		latencies.append(time.time() - start)
+	after = os.times()
+	wt.terminate()
+	wt.join()
+	for counter in set(gt.counters.values()):
+		counter.close()
+	os.waitpid(pid, 0)
+	latencies = latencies[1:]
+	records = options.snapshots * options.groups * options.records
+	cpu = (after[0] - cpu[0]) + (after[1] - cpu[1])
+	return (min(latencies), sum(latencies) / len(latencies), max(latencies),
+			wt.queue.highwater, cpu * 1e6 / records)
+
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("-n", "--records", type="int", default=100000,
+					  help="number of records per group and snapshot")
+	parser.add_option("-g", "--groups", type="int", default=2,
+					  help="number of groups, alternately IPv4 and IPv6")
+	parser.add_option("-s", "--snapshots", type="int", default=5,
+					  help="number of measured snapshots")
+	parser.add_option("-p", "--plugin", action="append", default=[],
+					  help="run only the named plugin (null, debug, spawn)")
+	options, _ = parser.parse_args()
+	os.environ["NFLOGIPAC_STANDIN_RECORDS"] = str(options.records)
+	print("%d groups, %d records per group and snapshot, %d snapshots" %
+		  (options.groups, options.records, options.snapshots))
+	for name, filename in plugins:
+		if options.plugin and name not in options.plugin:
+			continue
+		# The debug plugin prints every record.
+		sys.stdout.flush()
+		stdout = os.dup(1)
+		devnull = os.open(os.devnull, os.O_WRONLY)
+		os.dup2(devnull, 1)
+		os.close(devnull)
+		try:
+			result = run(name, os.path.join(examples_dir, filename), options)
+		finally:
+			sys.stdout.flush()
+			os.dup2(stdout, 1)
+			os.close(stdout)
+		print("%s: latency min %.3fs avg %.3fs max %.3fs, queue high-water "
+			  "%d, %.2fs CPU per million records" % ((name,) + result))
+
+
+if __name__ == '__main__':
+	main()
+
+# vim:ts=4 sw=4
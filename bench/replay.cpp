@@ -0,0 +1,135 @@
+/*
+ * Benchmark for counting replayed packets. Every counter kind is run with
+ * several netmasks on generated packets (like -G) or on the packets of a pcap
+ * file (like -R). Each run happens in a process of its own and reports
+ *  - the packet rate of replaying the packets through the counting path
+ *  - the time to export the resulting snapshot to /dev/null
+ *  - the peak memory of the process and the part of it used while counting
+ *    and exporting, i.e. without the replayed packets
+ *
+ * Usage: replay [packets [addresses [uniform|zipf|scan]]]
+ *        replay pcapfile [times]
+ */
+
+#define NFLOGIPAC_NO_MAIN
+#include "../nflogipacd.cpp"
+
+#include <fcntl.h>
+#include <sys/resource.h>
+#include <sys/wait.h>
+
+long maxrss_kb() {
+	struct rusage usage;
+	getrusage(RUSAGE_SELF, &usage);
+	return usage.ru_maxrss;
+}
+
+/**
+ * Replay the packets through a counter of the given kind and report.
+ * @param pcap is the pcap file to replay or empty to generate packets
+ */
+void run(const std::string &kind, const std::string &pcap, unsigned int
+		packets, unsigned int addresses,
+		address_distribution distribution) {
+	nflogipac_counter *const counter(make_counter(kind));
+	const unsigned int version(0 == kind.compare(0u, 4u, "ipv6") ?
+			6u : 4u);
+	packet_trace trace(counter->caplen);
+	uint64_t replayed(packets);
+	if(pcap.empty())
+		generate_packets(version, std::min(packets,
+					std::max(addresses,
+						GENERATED_PACKETS)),
+				addresses, distribution, trace);
+	else {
+		read_pcap(pcap, version, trace);
+		replayed = (uint64_t)trace.size() * packets;
+	}
+	if(0u == trace.size()) {
+		std::cout << kind << ": no IPv" << version << " packets"
+			<< std::endl;
+		return;
+	}
+	const long before(maxrss_kb());
+	replay_source source(0u, counter, trace, replayed, READ_BATCH);
+	const double counting(source.replay());
+
+	const int fd(open("/dev/null", O_WRONLY));
+	const double start(monotonic_seconds());
+	{
+		frame_writer out(fd);
+		counter->retire();
+		counter->writedata(out, PROTOCOL_LEVEL);
+		write_end_message(out);
+		out.flush();
+	}
+	const double exporting(monotonic_seconds() - start);
+	close(fd);
+	const long peak(maxrss_kb());
+	std::cout << kind << ": " << (uint64_t)(replayed / counting)
+		<< " packets/s, export " << exporting * 1000.0
+		<< "ms, maxrss " << peak << "kB (counter "
+		<< peak - before << "kB)" << std::endl;
+}
+
+int main(int argc, char **argv) {
+	static const char *const kinds[] = {"ipv4src", "ipv4src/24",
+		"ipv4src/16", "ipv4dst", "ipv6src", "ipv6src/64",
+		"ipv6src/48", "ipv6dst"};
+	unsigned int packets(10000000u), addresses(1000000u);
+	address_distribution distribution(DISTRIBUTION_UNIFORM);
+	std::string pcap;
+	try {
+		if(argc > 1) {
+			std::stringstream ss(argv[1]);
+			if((ss >> packets).fail()) {
+				pcap = argv[1];
+				packets = argc > 2 ? str2int(argv[2]) : 1u;
+			} else {
+				std::string spec(argv[1]);
+				spec += ",";
+				spec += argc > 2 ? argv[2] : "1000000";
+				if(argc > 3)
+					spec += std::string(",") + argv[3];
+				parse_generator(spec, packets, addresses,
+						distribution);
+			}
+		}
+	} catch(nflogipac_error &) {
+		std::cerr << "usage: " << argv[0]
+			<< " [packets [addresses [uniform|zipf|scan]]]"
+			<< std::endl << "       " << argv[0]
+			<< " pcapfile [times]" << std::endl;
+		return 1;
+	}
+	if(!seed_table_hash()) {
+		std::cerr << "cannot read /dev/urandom" << std::endl;
+		return 1;
+	}
+	if(pcap.empty())
+		std::cout << packets << " packets, " << addresses
+			<< " addresses" << std::endl;
+	for(size_t i(0u); i < sizeof(kinds) / sizeof(kinds[0]); ++i) {
+		const pid_t pid(fork());
+		if(pid < 0) {
+			std::cerr << "fork failed" << std::endl;
+			return 1;
+		}
+		if(0 == pid) {
+			try {
+				run(kinds[i], pcap, packets, addresses,
+						distribution);
+			} catch(nflogipac_error &e) {
+				std::cerr << kinds[i] << ": " << e.message
+					<< std::endl;
+				std::exit(1);
+			}
+			std::exit(0);
+		}
+		int status;
+		waitpid(pid, &status, 0);
+		if(!WIFEXITED(status) || 0 != WEXITSTATUS(status))
+			return 1;
+	}
+	return 0;
+}
@@ -0,0 +1,186 @@
+/*
+ * Benchmark for exporting a snapshot. A table of random addresses is encoded
+ * as UPDATE (level 0) and BULK_UPDATE (level 1) messages once with the former
+ * per field std::ostream writes through a stdio synchronized streambuf (like
+ * std::cout) and once with frame_writer. The output goes to /dev/null and to a
+ * socketpair drained by another thread like the one to nflogipacd.py.
+ *
+ * Usage: snapshot_export [entries]
+ */
+
+#define NFLOGIPAC_NO_MAIN
+#include "../nflogipacd.cpp"
+
+#include <fcntl.h>
+#include <sys/time.h>
+
+#include <ext/stdio_sync_filebuf.h>
+
+double now() {
+	struct timeval tv;
+	gettimeofday(&tv, 0);
+	return tv.tv_sec + tv.tv_usec / 1e6;
+}
+
+/**
+ * The export path of nflogipacd before the introduction of frame_writer.
+ */
+inline bool writeuint16stream(std::ostream &out, uint16_t value) {
+	char buf[2u];
+	writeuint16(buf, value);
+	return out.write(buf, 2u).good();
+}
+
+template<typename Key>
+bool ostream_write_table(std::ostream &out, unsigned int level,
+		const counter_table<Key> &table) {
+	typedef typename counter_table<Key>::const_iterator iterator;
+	char buf[8u + Key::size];
+	if(level >= 1u) {
+		iterator begin(table.begin());
+		const iterator end(table.end());
+		while(begin != end) {
+			iterator chunkend(begin);
+			uint32_t records(0u);
+			for(; chunkend != end && records < BULK_UPDATE_RECORDS;
+					++chunkend)
+				++records;
+			if(!writeuint16stream(out, 2u + 2u + 4u + 2u + 2u))
+				return false;
+			if(!writeuint16stream(out, CMD_BULK_UPDATE))
+				return false;
+			writeuint32(buf, records);
+			writeuint16(buf+4u, Key::size);
+			writeuint16(buf+6u, 0u);
+			if(!out.write(buf, 8u).good())
+				return false;
+			for(iterator i(begin); i != chunkend; ++i) {
+				writeuint64(buf, i->value);
+				if(!out.write(buf, 8u).good())
+					return false;
+			}
+			for(iterator i(begin); i != chunkend; ++i) {
+				i->key.write(buf);
+				if(!out.write(buf, Key::size).good())
+					return false;
+			}
+			begin = chunkend;
+		}
+	} else
+		for(iterator i(table.begin()); i != table.end(); ++i) {
+			if(!writeuint16stream(out, 2u + 2u + sizeof(buf)))
+				return false;
+			if(!writeuint16stream(out, CMD_ACCOUNT))
+				return false;
+			writeuint64(buf, i->value);
+			i->key.write(buf + 8u);
+			if(!out.write(buf, sizeof(buf)).good())
+				return false;
+		}
+	return writeuint16stream(out, 2u + 2u) &&
+		writeuint16stream(out, CMD_END) && out.flush().good();
+}
+
+template<typename Key>
+counter_table<Key> make_table(unsigned int entries) {
+	counter_table<Key> table(entries);
+	char buf[Key::size];
+	for(unsigned int i(0u); table.size() < entries; ++i) {
+		for(size_t j(0u); j < Key::size; j += 4u)
+			writeuint32(buf + j, mix64((uint64_t)i << 8 | j));
+		Key key;
+		key.read(buf);
+		table.add(key, 64u + mix64(i) % 100000u);
+	}
+	return table;
+}
+
+void drain(int fd) {
+	char buf[65536];
+	while(read(fd, buf, sizeof(buf)) > 0)
+		;
+}
+
+/**
+ * Open the output of a run.
+ * @param sink is "/dev/null" or "socketpair"
+ * @param reader receives the thread draining the socketpair
+ */
+int open_sink(const std::string &sink, boost::thread *&reader) {
+	reader = 0;
+	if("/dev/null" == sink)
+		return open("/dev/null", O_WRONLY);
+	int fds[2];
+	if(socketpair(AF_UNIX, SOCK_STREAM, 0, fds) < 0)
+		throw nflogipac_error("socketpair failed");
+	reader = new boost::thread(boost::bind(&drain, fds[0]));
+	return fds[1];
+}
+
+/**
+ * Wait until the reader of a socketpair has received everything.
+ */
+void finish_sink(int fd, boost::thread *reader) {
+	if(reader) {
+		shutdown(fd, SHUT_WR);
+		reader->join();
+		delete reader;
+	}
+}
+
+template<typename Key>
+void run(const char *name, const counter_table<Key> &table) {
+	static const char *const sinks[] = {"/dev/null", "socketpair"};
+	for(unsigned int level(0u); level < 2u; ++level)
+		for(size_t s(0u); s < sizeof(sinks) / sizeof(sinks[0]); ++s) {
+			boost::thread *reader;
+			int fd(open_sink(sinks[s], reader));
+			FILE *file(fdopen(fd, "w"));
+			double start(now());
+			{
+				__gnu_cxx::stdio_sync_filebuf<char> buf(file);
+				std::ostream out(&buf);
+				ostream_write_table(out, level, table);
+			}
+			fflush(file);
+			finish_sink(fd, reader);
+			const double before(now() - start);
+			fclose(file);
+
+			fd = open_sink(sinks[s], reader);
+			start = now();
+			{
+				frame_writer out(fd);
+				write_table(out, level, table, loss_report());
+				write_end_message(out);
+				out.flush();
+			}
+			finish_sink(fd, reader);
+			const double after(now() - start);
+			close(fd);
+
+			std::cout << name << " level " << level << " to "
+				<< sinks[s] << ": ostream "
+				<< before * 1000.0 << "ms, frame_writer "
+				<< after * 1000.0 << "ms" << std::endl;
+		}
+}
+
+int main(int argc, char **argv) {
+	unsigned int entries(1000000u);
+	try {
+		if(argc > 1)
+			entries = str2int(argv[1]);
+	} catch(nflogipac_error &) {
+		std::cerr << "usage: " << argv[0] << " [entries]" << std::endl;
+		return 1;
+	}
+	if(!seed_table_hash()) {
+		std::cerr << "cannot read /dev/urandom" << std::endl;
+		return 1;
+	}
+	std::cout << entries << " entries" << std::endl;
+	run("ipv4", make_table<ipv4_key>(entries));
+	run("ipv6", make_table<ipv6_key>(entries));
+	return 0;
+}
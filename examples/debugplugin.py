@@ -13,9 +13,19 @@ class plugin(FormattingPlugin):
 
 	@staticmethod
 	def handle_loss(timestamp, group, count):
-		print("missed at least %d packets for group %d" %
+		print("missed %d packets for group %d" %
 			  (count, group))
 
+	@staticmethod
+	def handle_loss_bytes(timestamp, group, bytes):
+		print("missed about %d bytes for group %d" %
+			  (bytes, group))
+
+	@staticmethod
+	def handle_remainder(timestamp, group, bytes, error, threshold):
+		print("%d bytes for group %d not attributed (error %d, threshold %d)" %
+			  (bytes, group, error, threshold))
+
 	@staticmethod
 	def handle_end_write():
 		print("ending write")
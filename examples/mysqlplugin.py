@@ -4,20 +4,204 @@ import time
 import MySQLdb
 import MySQLdb.cursors
 import os
+import re
+from nflogipac.dbpool import ConnectionPool
 from nflogipac.plugins import AddressFormatter
+from nflogipac.prefixmap import PrefixMap
 import socket
+import tempfile
 
 TRAFFIC_DB_START = "traffic_"
 
+insert_values = re.compile(r"^(.*?\bvalues\s*)(\(.*\))\s*$", re.IGNORECASE | re.DOTALL)
+column_list = re.compile(r"^\s*\((.*)\)\s*values\s*$", re.IGNORECASE | re.DOTALL)
+
+
+def split_insert(insert):
+	"""Split the insert setting of a group into the column list and the row
+	of values, e.g. '(IP,bytes) values ' and '(%s,%s)'.
+	@type insert: str
+	@rtype: (str, str) or None
+	@returns: None if insert lacks a values clause
+	"""
+	match = insert_values.match(insert.replace("?", "%s"))
+	if match is None:
+		return None
+	return match.groups()
+
+
+def split_values(row):
+	"""Split a row of values like '(%s,"a,b",now())' at its top level commas.
+	@type row: str
+	@rtype: [str]
+	"""
+	values = []
+	current = []
+	depth = 0
+	quote = None
+	escaped = False
+	for char in row[1:-1]:
+		if quote:
+			if escaped:
+				escaped = False
+			elif char == "\\":
+				escaped = True
+			elif char == quote:
+				quote = None
+		elif char in "'\"`":
+			quote = char
+		elif char == "(":
+			depth += 1
+		elif char == ")":
+			depth -= 1
+		elif char == "," and depth == 0:
+			values.append("".join(current).strip())
+			current = []
+			continue
+		current.append(char)
+	values.append("".join(current).strip())
+	return values
+
+
+def load_columns(insert):
+	"""Translate the insert setting of a group into the column list and SET
+	clause of a LOAD DATA statement reading one field per placeholder, e.g.
+	'(IP,bytes,time) values (?,?,now())' into '(IP,bytes) SET time = now()'.
+	Placeholders within expressions are read into user variables.
+	@type insert: str
+	@rtype: str or None
+	@returns: None if insert lacks a column list or a values clause
+	"""
+	parts = split_insert(insert)
+	if parts is None:
+		return None
+	match = column_list.match(parts[0])
+	if match is None:
+		return None
+	names = [name.strip() for name in match.group(1).split(",")]
+	values = split_values(parts[1])
+	if len(names) != len(values):
+		return None
+	fields = []
+	assignments = []
+	for name, value in zip(names, values):
+		if value == "%s":
+			fields.append(name)
+			continue
+		pieces = value.split("%s")
+		expression = pieces[0]
+		for piece in pieces[1:]:
+			fields.append("@field%d" % len(fields))
+			expression += fields[-1] + piece
+		assignments.append("%s = %s" % (name, expression))
+	clause = "(%s)" % ",".join(fields)
+	if assignments:
+		clause += " SET " + ", ".join(assignments)
+	return clause
+
+
+def tsv_field(value):
+	"""Encode a value as a field of LOAD DATA with default field and line
+	terminators.
+	@rtype: str
+	"""
+	if value is None:
+		return "\\N"
+	if isinstance(value, (int, long)):
+		return str(value)
+	if isinstance(value, unicode):
+		value = value.encode("utf-8")
+	return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+class LoadDataFile(object):
+	"""Rows collected in a temporary file for a LOAD DATA LOCAL INFILE
+	statement. The file is removed when closed."""
+
+	def __init__(self, table, clause, directory=None):
+		self.query = "LOAD DATA LOCAL INFILE %%s INTO TABLE %s CHARACTER SET utf8 %s;" % (table, clause)
+		self.file = tempfile.NamedTemporaryFile(prefix="nflogipac", suffix=".tsv", dir=directory)
+		self.rows = 0
+
+	def add(self, params):
+		self.file.write("\t".join(map(tsv_field, params)) + "\n")
+		self.rows += 1
+
+	def load(self, db):
+		"""
+		@type db: LaggyMySQLdb
+		@raises MySQLdb.OperationalError
+		"""
+		self.file.flush()
+		db.execute(self.query, (self.file.name,))
+
+	def close(self):
+		self.file.close()
+
+
+class InsertBatch(object):
+	"""Rows collected for a single multi-row INSERT statement."""
+
+	def __init__(self, table, columns):
+		self.prefix = "INSERT INTO %s %s" % (table, columns)
+		self.rows = []
+		self.params = []
+		self.size = len(self.prefix)
+
+	def row_size(self, row, params):
+		"""Estimate the length a row adds to the statement.
+		@type row: str
+		@type params: list
+		@rtype: int
+		"""
+		return len(row) + 1 + sum(len("%s" % (param,)) + 2 for param in params)
+
+	def add(self, row, params, size):
+		self.rows.append(row)
+		self.params.extend(params)
+		self.size += size
+
+	def query(self):
+		return "%s%s;" % (self.prefix, ",".join(self.rows))
+
+	def clear(self):
+		self.rows = []
+		self.params = []
+		self.size = len(self.prefix)
+
 
 class LaggyMySQLdb(object):
-	def __init__(self, config, name, log):
+	def __init__(self, config, name, log, pool=None):
+		"""
+		@type pool: ConnectionPool or None
+		@param pool: keeps the connection of this database open across
+				snapshots
+		"""
 		self.config = config
 		self.name = name
 		self.log = log
 		self.dbconf = config["databases"][name]
-		self.db = None
-		self.cursor = None
+		self.options = {}
+		if config["main"].get("load_data", "0").lower()[:1] not in "0fn":
+			self.options["local_infile"] = 1
+		self.pool = pool if pool is not None else ConnectionPool(False)
+		self.connection = self.pool.get(name)
+
+	@property
+	def db(self):
+		return self.connection.db
+
+	@db.setter
+	def db(self, value):
+		self.connection.db = value
+
+	@property
+	def cursor(self):
+		return self.connection.cursor
+
+	@cursor.setter
+	def cursor(self, value):
+		self.connection.cursor = value
 
 	def connect(self):
 		self.close()
@@ -27,7 +211,8 @@ class LaggyMySQLdb(object):
 			db=self.dbconf["db"],
 			user=self.dbconf["user"],
 			passwd=self.dbconf["password"],
-			cursorclass=MySQLdb.cursors.DictCursor)
+			cursorclass=MySQLdb.cursors.DictCursor,
+			**self.options)
 		self.cursor = self.db.cursor()
 		self.log.log_debug("Connected to db %s." % self.name, 4)
 
@@ -42,6 +227,40 @@ class LaggyMySQLdb(object):
 			self.db.close()
 			self.db = None
 
+	def acquire(self):
+		"""Reuse the pooled connection if it is alive and was not idle for
+		too long. Otherwise reconnect."""
+		if self.db is not None:
+			if self.pool.reusable(self.connection, time.time()):
+				try:
+					self.db.ping()
+					self.connection.released = None
+					return
+				except MySQLdb.Error as error:
+					self.log.log_notice("Reconnecting to db %s after failed ping: %r", self.name, error)
+			self.discard()
+		self.reconnect()
+		self.connection.released = None
+
+	def discard(self):
+		"""Drop the connection without committing, e.g. after it failed."""
+		try:
+			self.db.close()
+		except MySQLdb.Error:
+			pass
+		self.db = None
+		self.cursor = None
+
+	def release(self):
+		"""Commit and return the connection to the pool or close it if
+		connections are not persistent."""
+		if not self.pool.persistent:
+			return self.close()
+		if self.db:
+			self.log.log_debug("Committing all entries to db %s." % self.name, 5)
+			self.db.commit()
+			self.connection.released = time.time()
+
 	def reconnect(self):
 		for i in range(int(self.config["main"]["reconnect_attempts"])):
 			try:
@@ -64,7 +283,7 @@ class LaggyMySQLdb(object):
 		@raises MySQLdb.OperationalError
 		"""
 		for i in range(int(self.config["main"]["query_attempts"])):
-			self.log.log_debug("Querying db %s with %r %r attempt %d" % (self.name, query, params, i), 8)
+			self.log.log_debug("Querying db %s with %r %r attempt %d", 8, self.name, query, params, i)
 			try:
 				self.cursor.execute(query, params)
 				return self.cursor.fetchall()
@@ -72,7 +291,7 @@ class LaggyMySQLdb(object):
 				if error.args[0] != 2006:  # MySQL server has gone away
 					self.log.log_err("Recieved MySQLdb.OperationalError while querying %s for %r %r: %r" % (self.name, query, params, error))
 					raise  # no clue what to do
-				self.log.log_warning(("MySQL server %s has gone away during query %r %r attempt %d") % (self.name, query, params, i))
+				self.log.log_warning("MySQL server %s has gone away during query %r %r attempt %d", self.name, query, params, i)
 				self.reconnect()
 			# implicit continue
 		self.log.log_error("Giving up querying %s for %r %r." % (self.name, query, params))
@@ -80,8 +299,9 @@ class LaggyMySQLdb(object):
 
 	def execute(self, query, params):
 		"""Execute a query without result set on the database and commit it.
-		It must change precisely one row. Changing multiple rows may result in
-		some of them being changed twice.
+		It must be a single statement. Like a statement changing one row a
+		multi-row INSERT is retried as a whole. Executing multiple statements
+		may result in some of them being executed twice.
 		@type query: str
 		@type params: tuple
 		@returns: None
@@ -89,18 +309,18 @@ class LaggyMySQLdb(object):
 		"""
 		lasterr = None
 		for i in range(int(self.config["main"]["query_attempts"])):
-			self.log.log_debug("Executing db %s with %r %r attempt %d" % (self.name, query, params, i), 8)
+			self.log.log_debug("Executing db %s with %r %r attempt %d", 8, self.name, query, params, i)
 			try:
 				self.cursor.execute(query, params)
 				return
 			except MySQLdb.OperationalError as error:
 				lasterr = error
 				if error.args[0] == 2006:  # MySQL server has gone away
-					self.log.log_warning(("MySQL server %s has gone away during execute %r %r attempt %d") % (self.name, query, params, i))
+					self.log.log_warning("MySQL server %s has gone away during execute %r %r attempt %d", self.name, query, params, i)
 					self.reconnect()
 					continue
 				if error.args[0] == 1205:  # Lock wait timeout exceeded
-					self.log.log_warning("Ran into a lock timeout on server %s during execute %r %r attempt %d" % (self.name, query, params, i))
+					self.log.log_warning("Ran into a lock timeout on server %s during execute %r %r attempt %d", self.name, query, params, i)
 					self.reconnect()
 					continue
 				self.log.log_err("Received MySQLdb.OperationalError while executing %r %r on %s: %r" % (query, params, self.name, error))
@@ -109,6 +329,88 @@ class LaggyMySQLdb(object):
 		raise lasterr
 
 
+class UseridCache(object):
+	"""Userids of the addresses and prefixes returned by userid_query_cache,
+	kept across snapshots. The map is reloaded once it is older than
+	userid_cache_ttl seconds. In between, userid_query_delta, if given, fetches
+	the rows changed since the previous refresh at most every
+	userid_cache_refresh seconds. A NULL userid removes the address."""
+
+	def __init__(self, config, log):
+		self.log = log
+		self.query = config["main"]["userid_query_cache"]
+		self.delta_query = config["main"].get("userid_query_delta")
+		if self.delta_query is not None:
+			self.delta_query = self.delta_query.replace("?", "%s")
+		self.ttl = int(config["main"].get("userid_cache_ttl", 0))
+		self.refresh_interval = int(config["main"].get("userid_cache_refresh", 0))
+		self.prefixes = PrefixMap()
+		self.loaded = None  # time of the last full load
+		self.refreshed = None  # time of the last full or delta load
+		self.since = None  # server time before the last full or delta load
+
+	def refresh(self, db, now):
+		"""
+		@type db: LaggyMySQLdb
+		@type now: float
+		@raises MySQLdb.OperationalError
+		"""
+		if self.loaded is None or now - self.loaded >= self.ttl:
+			since = self.server_time(db)
+			rows = db.query(self.query, None)
+			self.prefixes = PrefixMap()
+			self.update(rows)
+			self.loaded = self.refreshed = now
+			self.since = since
+			self.log.log_debug("Loaded %d userids", 5, len(self.prefixes))
+		elif self.delta_query is not None and now - self.refreshed >= self.refresh_interval:
+			since = self.server_time(db)
+			rows = db.query(self.delta_query, (self.since,))
+			self.update(rows)
+			self.refreshed = now
+			self.since = since
+			self.log.log_debug("Updated %d userids", 5, len(rows))
+
+	def server_time(self, db):
+		"""The changes are timestamped by the database server, so the delta
+		query is bounded by its clock rather than by the local one.
+		@type db: LaggyMySQLdb
+		@returns: the current time of the server if a delta query is used
+		@raises MySQLdb.OperationalError
+		"""
+		if self.delta_query is None:
+			return None
+		return db.query("SELECT NOW() AS now", None)[0]["now"]
+
+	def update(self, rows):
+		invalid = incomplete = 0
+		for row in rows:
+			if "address" not in row or "userid" not in row:
+				incomplete += 1
+				continue
+			try:
+				if row["userid"] is None:
+					del self.prefixes[row["address"]]
+				else:
+					self.prefixes[row["address"]] = row["userid"]
+			except KeyError:
+				pass  # removing an unknown address
+			except (ValueError, AttributeError):
+				invalid += 1
+		if invalid:
+			self.log.log_warning("Ignored %d userid rows with invalid addresses", invalid)
+		if incomplete:
+			self.log.log_warning("Ignored %d userid rows lacking an address or userid column", incomplete)
+
+	def lookup(self, addr, length=None):
+		"""
+		@type addr: str
+		@type length: int or None
+		@param length: is the prefix length of a masked group
+		"""
+		return self.prefixes.lookup(addr, length)
+
+
 class backend(object):
 	def __init__(self, config, trafficdb, useriddb=None):
 		self.config = config
@@ -117,7 +419,30 @@ class backend(object):
 		self.current_tables = {}
 		self.useriddb = useriddb
 		self.userid_cache = None
-		if all("userid" not in groupconf["insert_params"] for groupconf in self.groups.values()):
+		if "userid_query_cache" in config["main"]:
+			self.userid_cache = UseridCache(config, trafficdb.log)
+		self.userid_bulk = None
+		if self.userid_cache is None and "userid_query_bulk" in config["main"]:
+			self.userid_bulk = config["main"]["userid_query_bulk"]
+		self.userid_chunk = int(config["main"].get("userid_query_chunk", 1000))
+		# whether the userid of an address may differ between groups
+		self.userid_by_group = self.userid_bulk is None and "group" in config["main"].get("userid_query_params", ())
+		self.userids = {}  # address or (group, address) -> userid of this snapshot
+		self.pending = []  # (group, address, value) lacking a userid
+		# group -> prefix length of masked groups or None
+		self.prefix_lengths = dict((group, int(groupconf["kind"].split("/", 1)[1]) if "/" in groupconf["kind"] else None) for group, groupconf in self.groups.items())
+		self.inserts = dict((group, split_insert(groupconf["insert"])) for group, groupconf in self.groups.items())
+		self.batch_rows = int(config["main"].get("insert_batch_rows", 1000))
+		self.max_packet = int(config["main"].get("insert_max_packet", 1048576))
+		self.batches = {}  # (table, columns) -> InsertBatch
+		self.loads = {}  # group -> LOAD DATA clause or None
+		if config["main"].get("load_data", "0").lower()[:1] not in "0fn":
+			self.loads = dict((group, load_columns(groupconf["insert"])) for group, groupconf in self.groups.items())
+		self.load_dir = config["main"].get("load_data_dir")
+		self.files = {}  # (table, clause) -> LoadDataFile
+		self.parammap = {}
+		self.employ_userid = any("userid" in groupconf["insert_params"] for groupconf in self.groups.values())
+		if not self.employ_userid:
 			self.useriddb = None
 
 	def create_current_table(self, group):
@@ -151,60 +476,133 @@ class backend(object):
 		except IndexError:  # no rows returned
 			return None  # results in a NULL value
 
-	def __lookup_userid_bycache(self, group, addr):
-		if self.userid_cache is None:
-			query = self.config["main"]["userid_query_cache"]
+	def lookup_userid(self, group, addr):
+		if self.userid_cache is not None:
+			return self.userid_cache.lookup(addr, self.prefix_lengths[group])
+		key = (group, addr) if self.userid_by_group else addr
+		try:
+			return self.userids[key]
+		except KeyError:
+			userid = self.userids[key] = self.__lookup_userid_byquery(group, addr)
+			return userid
+
+	def resolve_pending(self):
+		"""Look up the userids of the pending rows with userid_query_bulk in
+		chunks of userid_query_chunk addresses and store the rows."""
+		missing = sorted(set(addr for _, addr, _ in self.pending if addr not in self.userids))
+		for first in range(0, len(missing), self.userid_chunk):
+			chunk = missing[first:first + self.userid_chunk]
+			query = "%s;" % self.userid_bulk.replace("?", ",".join(["%s"] * len(chunk)))
 			if self.useriddb is not None:
-				rows = self.useriddb.query(query, None)
-			else:
-				rows = self.db.query(query, None)
-			self.userid_cache = dict((row["address"], row["userid"]) for row in rows)
-		else:
-			if addr in self.userid_cache:
-				return self.userid_cache[addr]
+				rows = self.useriddb.query(query, chunk)
 			else:
-				return None
-
-	def lookup_userid(self, group, addr):
-		if "userid_query_cache" in self.config["main"]:
-			return self.__lookup_userid_bycache(group, addr)
-		else:
-			return self.__lookup_userid_byquery(group, addr)
+				rows = self.db.query(query, chunk)
+			for row in rows:
+				self.userids[row["address"]] = row["userid"]
+		for addr in missing:
+			self.userids.setdefault(addr, None)  # results in a NULL value
+		pending = self.pending
+		self.pending = []
+		for group, addr, value in pending:
+			self.store(group, addr, value)
 
 
 	def start_write(self):
-		self.db.reconnect()
+		self.parammap = dict(pid=os.getpid(), hostname=socket.gethostname())
+		self.db.acquire()
 		if self.useriddb is not None:
-			self.useriddb.reconnect()
+			self.useriddb.acquire()
+		if self.userid_cache is not None and self.employ_userid:
+			self.userid_cache.refresh(self.useriddb or self.db, time.time())
 
 	def account(self, group, addr, value):
+		"""Rows needing a userid from userid_query_bulk are kept until
+		userid_query_chunk of them are pending. Others are stored at once."""
 		self.create_current_table(group)
-		query = "INSERT INTO %s %s;" % (self.current_tables[group], self.groups[group]["insert"].replace("?", "%s"))
-		parammap = dict(pid=os.getpid(), hostname=socket.gethostname(), address=addr, value=value)
+		if self.userid_bulk is not None and "userid" in self.groups[group]["insert_params"]:
+			self.pending.append((group, addr, value))
+			if len(self.pending) >= self.userid_chunk:
+				self.resolve_pending()
+			return
+		self.store(group, addr, value)
+
+	def store(self, group, addr, value):
+		"""Add a row to the batch of its table. The batch is inserted once it
+		holds insert_batch_rows rows or would exceed insert_max_packet bytes.
+		Inserts lacking a values clause are executed right away. With load_data
+		the row is appended to the file of its table instead."""
+		parammap = self.parammap
+		parammap["address"] = addr
+		parammap["value"] = value
 		params = self.groups[group]["insert_params"]
 		if "userid" in params:
 			parammap["userid"] = self.lookup_userid(group, addr)
 		params = list(map(parammap.__getitem__, params))
 
-		self.db.execute(query, params)
+		if self.loads.get(group) is not None:
+			key = (self.current_tables[group], self.loads[group])
+			datafile = self.files.get(key)
+			if datafile is None:
+				datafile = self.files[key] = LoadDataFile(key[0], key[1], self.load_dir)
+			datafile.add(params)
+			return
+		if self.inserts[group] is None:  # e.g. INSERT ... SELECT
+			query = "INSERT INTO %s %s;" % (self.current_tables[group], self.groups[group]["insert"].replace("?", "%s"))
+			self.db.execute(query, params)
+			return
+		columns, row = self.inserts[group]
+		key = (self.current_tables[group], columns)
+		batch = self.batches.get(key)
+		if batch is None:
+			batch = self.batches[key] = InsertBatch(*key)
+		size = batch.row_size(row, params)
+		if batch.rows and batch.size + size > self.max_packet:
+			self.flush(batch)
+		batch.add(row, params, size)
+		if len(batch.rows) >= self.batch_rows:
+			self.flush(batch)
+
+	def flush(self, batch):
+		self.db.execute(batch.query(), batch.params)
+		batch.clear()
 
 	def end_write(self):
+		try:
+			if self.pending:
+				self.resolve_pending()
+		finally:
+			self.pending = []
+			self.userids = {}
+		try:
+			for datafile in self.files.values():
+				datafile.load(self.db)
+		finally:
+			for datafile in self.files.values():
+				datafile.close()
+			self.files = {}
+		for batch in self.batches.values():
+			if batch.rows:
+				self.flush(batch)
+		self.batches = {}
 		if self.useriddb is not None:
-			self.useriddb.close()
-		self.userid_cache = None
-		self.db.close()
+			self.useriddb.release()
+		self.db.release()
 
 
 class plugin(object):
+	accepts_loss_bytes = True
+	accepts_remainder = True
+
 	def __init__(self, config, log):
 		self.log = log
 		self.queue_size_warn = int(config["main"]["queue_size_warn"])
 		self.queue_age_warn = int(config["main"]["queue_age_warn"])
 		self.formatter = AddressFormatter(config)
 		self.backends = []
+		self.pool = pool = ConnectionPool(config["main"].get("persistent_connections", "1").lower()[:1] not in "0fn", int(config["main"].get("connection_idle_timeout", 0)))
 
 		employ_userid = any("userid" in groupconf["insert_params"] for groupconf in config["groups"].values())
-		if "userid_query" not in config["main"] and employ_userid:
+		if not any(key in config["main"] for key in ("userid_query", "userid_query_bulk", "userid_query_cache")) and employ_userid:
 			log.log_err("Some inserts statements employ userid, but the main section is lacking a userid_query.")
 			raise ValueError("userid_query missing in main config section")
 		elif "userid_query" in config["main"] and not employ_userid:
@@ -212,12 +610,12 @@ class plugin(object):
 
 		for dbname in config["databases"]:
 			if dbname.startswith(TRAFFIC_DB_START):
-				trafficdb = LaggyMySQLdb(config, dbname, log)
+				trafficdb = LaggyMySQLdb(config, dbname, log, pool)
 				log.log_debug("Found database %s for traffic information" % dbname, 3)
 				useriddbname = "userid_%s" % dbname[len(TRAFFIC_DB_START):]
 				useriddb = None
 				if employ_userid and useriddbname in config["databases"]:
-					useriddb = LaggyMySQLdb(config, useriddbname, log)
+					useriddb = LaggyMySQLdb(config, useriddbname, log, pool)
 					log.log_debug("Using separate database %s for userid information" % useriddbname)
 				elif config["main"].has_key("userid_query"):
 					log.log_debug("Using database %s for userid query" % dbname)
@@ -230,9 +628,13 @@ class plugin(object):
 		while True:
 			qsize = queue.qsize()
 			if qsize > self.queue_size_warn:
-				self.log.log_warning("queue contains at least %d entries" % qsize)
+				self.log.log_warning("queue contains at least %d entries", qsize)
 			entry = queue.get()
 			if entry[0] == "terminate":
+				try:
+					self.pool.close()
+				except MySQLdb.Error as error:
+					self.log.log_warning("Failed to close the database connections: %r", error)
 				return
 			elif entry[0] == "start_write":
 				for backend in self.backends:
@@ -241,13 +643,19 @@ class plugin(object):
 				timestamp, group, addr, value = entry[1:]
 				queue_age = time.time() - timestamp
 				if queue_age > self.queue_age_warn:
-					self.log.log_warning("processing of queue lacks behind for at least %d seconds" % queue_age)
+					self.log.log_warning("processing of queue lacks behind for at least %d seconds", queue_age)
 				for backend in self.backends:
 					backend.account(group, self.formatter(group, addr), value)
 			elif entry[0] == "loss":
 				timestamp, group, count = entry[1:]
 				age = time.time() - timestamp
-				self.log.log_warning(("collector missed at least %d packets in group %d observed %ds ago") % (count, group, age))
+				self.log.log_warning("collector missed %d packets in group %d observed %ds ago", count, group, age)
+			elif entry[0] == "loss_bytes":
+				timestamp, group, bytes = entry[1:]
+				self.log.log_warning("collector missed about %d bytes in group %d", bytes, group)
+			elif entry[0] == "remainder":
+				timestamp, group, bytes, error, threshold = entry[1:]
+				self.log.log_notice("%d bytes in group %d not attributed to any address (threshold %d)" % (bytes, group, threshold))
 			elif entry[0] == "end_write":
 				for backend in self.backends:
 					backend.end_write()
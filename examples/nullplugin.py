@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Discard all accounting data. Useful for measuring the daemon without the cost
+of storing anything.
+"""
+
+from nflogipac.plugins import SimplePlugin
+
+
+class plugin(SimplePlugin):
+	def __init__(self, config, log):
+		SimplePlugin.__init__(self, config)
+		self.records = 0
+
+	def handle_account_batch(self, timestamp, group, batch):
+		self.records += len(batch)
+
+# vim:ts=4 sw=4
@@ -11,6 +11,7 @@
 import time
 import psycopg2
 import os
+from nflogipac.dbpool import ConnectionPool
 from nflogipac.plugins import AddressFormatter
 import socket
 
@@ -19,13 +20,34 @@ TRAFFIC_DB_START = "traffic_"
 
 
 class LaggyPostgreSQLdb(object):
-	def __init__(self, config, name, log):
+	def __init__(self, config, name, log, pool=None):
+		"""
+		@type pool: ConnectionPool or None
+		@param pool: keeps the connection of this database open across
+				snapshots
+		"""
 		self.config = config
 		self.name = name
 		self.log = log
 		self.dbconf = config["databases"][name]
-		self.db = None
-		self.cursor = None
+		self.pool = pool if pool is not None else ConnectionPool(False)
+		self.connection = self.pool.get(name)
+
+	@property
+	def db(self):
+		return self.connection.db
+
+	@db.setter
+	def db(self, value):
+		self.connection.db = value
+
+	@property
+	def cursor(self):
+		return self.connection.cursor
+
+	@cursor.setter
+	def cursor(self, value):
+		self.connection.cursor = value
 
 	def connect(self):
 		self.close()
@@ -47,6 +69,39 @@ class LaggyPostgreSQLdb(object):
 			self.db.close()
 			self.db = None
 
+	def acquire(self):
+		"""Reuse the pooled connection if it is alive and was not idle for
+		too long. Otherwise reconnect."""
+		if self.db is not None:
+			if self.pool.reusable(self.connection, time.time()):
+				try:
+					self.cursor.execute("SELECT 1")
+					self.db.rollback()
+					self.connection.released = None
+					return
+				except psycopg2.Error as error:
+					self.log.log_notice("Reconnecting to db %s after failed " +
+										"ping: %r", self.name, error)
+			self.discard()
+		self.reconnect()
+		self.connection.released = None
+
+	def discard(self):
+		"""Drop the connection, e.g. after it failed."""
+		try:
+			self.db.close()
+		except psycopg2.Error:
+			pass
+		self.db = None
+		self.cursor = None
+
+	def release(self):
+		"""Return the connection to the pool or close it if connections are
+		not persistent."""
+		if not self.pool.persistent:
+			return self.close()
+		self.connection.released = time.time()
+
 	def reconnect(self):
 		for i in range(int(self.config["main"]["reconnect_attempts"])):
 			try:
@@ -71,8 +126,8 @@ class LaggyPostgreSQLdb(object):
 		@raises psycopg2.OperationalError
 		"""
 		for i in range(int(self.config["main"]["query_attempts"])):
-			self.log.log_debug("Querying db %s with %r %r attempt %d" %
-							   (self.name, query, params, i), 8)
+			self.log.log_debug("Querying db %s with %r %r attempt %d", 8,
+							   self.name, query, params, i)
 			try:
 				self.cursor.execute(query, params)
 				return self.cursor.fetchall()
@@ -82,8 +137,8 @@ class LaggyPostgreSQLdb(object):
 									 " querying %s for %r %r: %r" %
 									 (self.name, query, params, error))
 					raise  # no clue what to do
-				self.log.log_warning(("PostgreSQL server %s has gone away during " +
-									  "query %r %r attempt %d") % (self.name, query, params, i))
+				self.log.log_warning("PostgreSQL server %s has gone away during " +
+									 "query %r %r attempt %d", self.name, query, params, i)
 				self.reconnect()
 			# implicit continue
 		self.log.log_error("Giving up querying %s for %r %r." %
@@ -98,8 +153,8 @@ class LaggyPostgreSQLdb(object):
 		@raises psycopg2.OperationalError
 		"""
 		for i in range(int(self.config["main"]["query_attempts"])):
-			self.log.log_debug("Executing db %s with %r %r attempt %d" %
-							   (self.name, query, params, i), 8)
+			self.log.log_debug("Executing db %s with %r %r attempt %d", 8,
+							   self.name, query, params, i)
 			try:
 				self.cursor.execute(query, params)
 				self.db.commit()
@@ -110,9 +165,9 @@ class LaggyPostgreSQLdb(object):
 									 " executing %r %r on %s: %r" %
 									 (query, params, self.name, error))
 					raise  # no clue what to do
-				self.log.log_warning(("PostgreSQL server %s has gone away during " +
-									  "execute %r %r attempt %d") %
-									 (self.name, query, params, i))
+				self.log.log_warning("PostgreSQL server %s has gone away during " +
+									 "execute %r %r attempt %d",
+									 self.name, query, params, i)
 				self.reconnect()
 			# implicit continue
 		self.log.log_error("Giving up executing %r %r on %s." %
@@ -151,7 +206,7 @@ class backend(object):
 		self.current_tables[group] = table_name
 
 	def start_write(self):
-		self.db.reconnect()
+		self.db.acquire()
 
 	def account(self, group, addr, value):
 		self.create_current_table(group)
@@ -165,20 +220,27 @@ class backend(object):
 		self.db.execute(query, params)
 
 	def end_write(self):
-		self.db.close()
+		self.db.release()
 
 
 class plugin(object):
+	accepts_loss_bytes = True
+	accepts_remainder = True
+
 	def __init__(self, config, log):
 		self.log = log
 		self.queue_size_warn = int(config["main"]["queue_size_warn"])
 		self.queue_age_warn = int(config["main"]["queue_age_warn"])
 		self.formatter = AddressFormatter(config)
 		self.backends = []
+		self.pool = pool = ConnectionPool(
+			config["main"].get("persistent_connections", "1").lower()[:1]
+			not in "0fn",
+			int(config["main"].get("connection_idle_timeout", 0)))
 
 		for dbname in config["databases"]:
 			if dbname.startswith(TRAFFIC_DB_START):
-				trafficdb = LaggyPostgreSQLdb(config, dbname, log)
+				trafficdb = LaggyPostgreSQLdb(config, dbname, log, pool)
 				log.log_debug("Found database %s for traffic information" %
 							  dbname, 3)
 				self.backends.append(backend(config, trafficdb))
@@ -187,10 +249,15 @@ class plugin(object):
 		while True:
 			qsize = queue.qsize()
 			if qsize > self.queue_size_warn:
-				self.log.log_warning("queue contains at least %d entries" %
+				self.log.log_warning("queue contains at least %d entries",
 									 qsize)
 			entry = queue.get()
 			if entry[0] == "terminate":
+				try:
+					self.pool.close()
+				except psycopg2.Error as error:
+					self.log.log_warning("Failed to close the database " +
+										 "connections: %r", error)
 				return
 			elif entry[0] == "start_write":
 				for backend in self.backends:
@@ -200,14 +267,23 @@ class plugin(object):
 				queue_age = time.time() - timestamp
 				if queue_age > self.queue_age_warn:
 					self.log.log_warning("processing of queue lacks behind " +
-										 "for at least %d seconds" % queue_age)
+										 "for at least %d seconds", queue_age)
 				for backend in self.backends:
 					backend.account(group, self.formatter(group, addr), value)
 			elif entry[0] == "loss":
 				timestamp, group, count = entry[1:]
 				age = time.time() - timestamp
-				self.log.log_warning(("collector missed at least %d packets " +
-									  "in group %d observed %ds ago") % (count, group, age))
+				self.log.log_warning("collector missed %d packets " +
+									 "in group %d observed %ds ago", count, group, age)
+			elif entry[0] == "loss_bytes":
+				timestamp, group, bytes = entry[1:]
+				self.log.log_warning("collector missed about %d bytes in group %d",
+									 bytes, group)
+			elif entry[0] == "remainder":
+				timestamp, group, bytes, error, threshold = entry[1:]
+				self.log.log_notice(("%d bytes in group %d not attributed to " +
+									 "any address (threshold %d)") %
+									(bytes, group, threshold))
 			elif entry[0] == "end_write":
 				for backend in self.backends:
 					backend.end_write()
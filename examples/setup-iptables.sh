@@ -19,8 +19,21 @@ modprobe xt_NFLOG || true
 # http://www.spinics.net/lists/netfilter/msg50123.html for further details.
 ./nfnetlink_log_ctl rebind AF_INET rebind AF_INET6
 
-# A bigger --nflog-threshold reduces the per packet overhead.
+# A bigger --nflog-threshold reduces the per packet overhead. Instead of
+# giving it on every rule, the qthreshold key of the corresponding group in
+# the nflogipacd configuration can be used.
 iptables -A FORWARD -i eth0 -o eth1 -j NFLOG --nflog-group 1 --nflog-threshold 1024
 iptables -A FORWARD -o eth0 -i eth1 -j NFLOG --nflog-group 2 --nflog-threshold 1024
 ip6tables -A FORWARD -i eth0 -o eth1 -j NFLOG --nflog-group 3 --nflog-threshold 1024
 ip6tables -A FORWARD -o eth0 -i eth1 -j NFLOG --nflog-group 4 --nflog-threshold 1024
+
+# A single receiving thread may not keep up with a busy group. The load can be
+# spread by logging the packets handled by each CPU to a separate group and
+# listing these groups in the shards key of the group, e.g. instead of the
+# first rule above:
+#for cpu in 1 2 3; do
+#	iptables -A FORWARD -i eth0 -o eth1 -m cpu --cpu $cpu -j NFLOG \
+#		--nflog-group 1$cpu --nflog-threshold 1024
+#done
+#iptables -A FORWARD -i eth0 -o eth1 -m cpu --cpu 0 -j NFLOG --nflog-group 1 \
+#	--nflog-threshold 1024
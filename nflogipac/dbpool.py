@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Database connections kept open across snapshots by the database plugins."""
+
+
+class PooledConnection(object):
+	"""A connection and its cursor. Each database of a plugin has its own,
+	because one committing or reconnecting must not affect another one in the
+	middle of a snapshot.
+
+	@ivar db: is the DB-API connection or None
+	@ivar cursor: is a cursor of db or None
+	@type released: float or None
+	@ivar released: is the time the connection was last released
+	"""
+
+	def __init__(self):
+		self.db = None
+		self.cursor = None
+		self.released = None
+
+	def close(self):
+		"""Commit and close the connection if it is open. It is closed even
+		if committing fails.
+		@raises Exception: the error of the database module
+		"""
+		try:
+			if self.cursor is not None:
+				self.cursor.close()
+			if self.db is not None:
+				self.db.commit()
+		finally:
+			self.cursor = None
+			db, self.db = self.db, None
+			if db is not None:
+				db.close()
+
+
+class ConnectionPool(object):
+	def __init__(self, persistent=True, idle_timeout=0):
+		"""
+		@type persistent: bool
+		@param persistent: whether connections stay open between snapshots
+		@type idle_timeout: int
+		@param idle_timeout: is the number of seconds after which a released
+				connection is not reused but replaced, 0 for no limit
+		"""
+		self.persistent = persistent
+		self.idle_timeout = idle_timeout
+		self.connections = {}  # database name -> PooledConnection
+
+	def get(self, key):
+		"""
+		@param key: identifies the database, e.g. by the name of its section
+		@rtype: PooledConnection
+		"""
+		connection = self.connections.get(key)
+		if connection is None:
+			connection = self.connections[key] = PooledConnection()
+		return connection
+
+	def close(self):
+		"""Commit and close all connections, e.g. when the plugin terminates.
+		@raises Exception: the error of the database module for the first
+				connection that failed. The others are closed anyway.
+		"""
+		error = None
+		for connection in self.connections.values():
+			try:
+				connection.close()
+			except Exception as err:
+				if error is None:
+					error = err
+		if error is not None:
+			raise error
+
+	def reusable(self, connection, now):
+		"""
+		@type connection: PooledConnection
+		@type now: float
+		@rtype: bool
+		@returns: whether the connection is open and was not idle too long
+		"""
+		if connection.db is None:
+			return False
+		if connection.released is None or not self.idle_timeout:
+			return True
+		return now - connection.released < self.idle_timeout
+
+# vim:ts=4 sw=4
@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import array
 import socket
 
+if array.array("L").itemsize >= 8:
+	def new_value_array():
+		return array.array("L")
+else:  # unsigned long cannot hold 64bit byte counts
+	new_value_array = list
+
 
 class AddressFormatter(object):
 	kindtofamily = dict(
@@ -29,9 +36,74 @@ class AddressFormatter(object):
 		return socket.inet_ntop(self.groupmap[group], binaryaddress)
 
 
+class AccountBatch(object):
+	"""The accounting data of one group from one snapshot stored in two
+	columns. Iterating yields (address, value) pairs.
+
+	@type addrlen: int
+	@ivar addrlen: is the length of every binary address in the batch
+	@type addresses: bytearray
+	@ivar addresses: is the concatenation of all binary addresses
+	@type values: array.array or list
+	@ivar values: contains the byte count for each address in the same order
+	"""
+
+	def __init__(self, addrlen):
+		self.addrlen = addrlen
+		self.addresses = bytearray()
+		self.values = new_value_array()
+
+	def __len__(self):
+		return len(self.values)
+
+	def append(self, addr, value):
+		"""
+		@type addr: str
+		@param addr: a binary address of length addrlen
+		@type value: int or long
+		"""
+		assert len(addr) == self.addrlen
+		self.addresses.extend(addr)
+		self.values.append(value)
+
+	def extend(self, addresses, values):
+		"""
+		@type addresses: str
+		@param addresses: concatenated binary addresses of length addrlen
+		@type values: array.array or list
+		@param values: a sequence as returned by new_value_array
+		"""
+		assert len(addresses) == len(values) * self.addrlen
+		self.addresses.extend(addresses)
+		self.values.extend(values)
+
+	def address(self, index):
+		"""
+		@type index: int
+		@rtype: str
+		"""
+		start = index * self.addrlen
+		return str(self.addresses[start:start + self.addrlen])
+
+	def __iter__(self):
+		addrlen = self.addrlen
+		addresses = self.addresses
+		start = 0
+		for value in self.values:
+			yield str(addresses[start:start + addrlen]), value
+			start += addrlen
+
+
 class SimplePlugin(object):
 	"""A possible base class for simple plugins. It translates events to
-	calling "handle_..." methods if present."""
+	calling "handle_..." methods if present. Account batches are passed to
+	handle_account_batch which by default calls handle_account for each entry.
+	It also accepts loss_bytes and remainder events.
+	"""
+
+	accepts_account_batch = True
+	accepts_loss_bytes = True
+	accepts_remainder = True
 
 	def __init__(self, config):
 		pass
@@ -46,6 +118,16 @@ class SimplePlugin(object):
 			if hasattr(self, cmd):
 				getattr(self, cmd)(*params)
 
+	def handle_account_batch(self, timestamp, group, batch):
+		"""
+		@type timestamp: float
+		@type group: int
+		@type batch: AccountBatch
+		"""
+		if hasattr(self, "handle_account"):
+			for addr, value in batch:
+				self.handle_account(timestamp, group, addr, value)
+
 
 class FormattingPlugin(SimplePlugin):
 	"""Implements handle_account for SimplePlugin by calling
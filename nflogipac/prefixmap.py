@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Map from IPv4 and IPv6 prefixes to values with longest prefix match."""
+
+import binascii
+import socket
+
+
+def parse_prefix(text):
+	"""Parse an address or a prefix in CIDR notation like 192.0.2.0/24.
+	@type text: str
+	@rtype: (int, int, int or long)
+	@returns: the address family, the prefix length and the network bits
+	@raises ValueError:
+	"""
+	address, _, length = text.partition("/")
+	family = socket.AF_INET6 if ":" in address else socket.AF_INET
+	try:
+		binary = socket.inet_pton(family, address.strip())
+	except socket.error:
+		raise ValueError("invalid address: %r" % text)
+	bits = len(binary) * 8
+	length = int(length) if length else bits
+	if not 0 <= length <= bits:
+		raise ValueError("invalid prefix length: %r" % text)
+	return family, length, int(binascii.hexlify(binary), 16) >> (bits - length)
+
+
+class PrefixMap(object):
+	"""Values of IPv4 and IPv6 prefixes. A host address is a prefix of full
+	length. The prefixes are kept in one dict per family and length, keyed by
+	the network bits as integer, so a lookup costs a dict access per distinct
+	prefix length at most."""
+
+	def __init__(self):
+		self.tables = {}  # (family, length) -> {network bits: value}
+		self.lengths = {}  # family -> lengths of tables in descending order
+		self.contained = {}  # (family, length) -> {network bits: value}
+
+	def __len__(self):
+		return sum(map(len, self.tables.values()))
+
+	def __setitem__(self, prefix, value):
+		"""
+		@type prefix: str
+		@raises ValueError: if prefix is invalid
+		"""
+		family, length, network = parse_prefix(prefix)
+		table = self.tables.get((family, length))
+		if table is None:
+			table = self.tables[family, length] = {}
+			self.lengths[family] = sorted(
+				(key[1] for key in self.tables if key[0] == family),
+				reverse=True)
+		table[network] = value
+		self.contained.clear()
+
+	def __delitem__(self, prefix):
+		"""
+		@type prefix: str
+		@raises ValueError: if prefix is invalid
+		@raises KeyError: if prefix is not in the map
+		"""
+		family, length, network = parse_prefix(prefix)
+		del self.tables.get((family, length), {})[network]
+		self.contained.clear()
+
+	def lookup(self, address, length=None, default=None):
+		"""Find the value of the longest prefix containing an address.
+		@type address: str
+		@param address: is an IPv4 or IPv6 address
+		@type length: int or None
+		@param length: makes the address a prefix of this length, e.g. of a
+				masked group. The value of a longer prefix within it takes
+				precedence over prefixes containing it. If there are several
+				longer prefixes, any of them is returned.
+		@raises ValueError: if address is invalid
+		"""
+		family, bits, network = parse_prefix(address)
+		if length is not None and length < bits:
+			network >>= bits - length
+			bits = length
+			value = self.within(family, bits).get(network, self)
+			if value is not self:
+				return value
+		for prefix in self.lengths.get(family, ()):
+			if prefix <= bits:
+				value = self.tables[family, prefix].get(
+					network >> (bits - prefix), self)
+				if value is not self:
+					return value
+		return default
+
+	def within(self, family, length):
+		"""The index is kept until the map changes.
+		@rtype: {int or long: object}
+		@returns: the values of the prefixes longer than length by their
+				first length bits
+		"""
+		contained = self.contained.get((family, length))
+		if contained is None:
+			contained = self.contained[family, length] = {}
+			for prefix in self.lengths.get(family, ()):
+				if prefix > length:
+					for network, value in \
+							self.tables[family, prefix].iteritems():
+						contained[network >> (prefix - length)] = value
+		return contained
+
+# vim:ts=4 sw=4
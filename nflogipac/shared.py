@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+import os
+import struct
+import time
+
+from nflogipac.plugins import AccountBatch, new_value_array
+
+# magic, version, group, address length, sequence, capacity, records,
+# generation, started, updated and unlisted (see shared.txt)
+header = struct.Struct("=8sIHHQQQQQQQ56x")
+magic = "nflogipa"
+version = 1
+
+
+class SharedTotals(object):
+	"""The running totals of one group read from a shared memory file.
+
+	@type group: int
+	@type generation: int or long
+	@ivar generation: is the number of completed report periods
+	@type started: float
+	@ivar started: is the start of the report period in seconds since epoch
+	@type updated: float
+	@ivar updated: is the time of the last update in seconds since epoch
+	@type unlisted: int or long
+	@ivar unlisted: is the number of bytes of the report period not contained
+			in the batch
+	@type batch: AccountBatch
+	"""
+
+	def __init__(self, group, generation, started, updated, unlisted, batch):
+		self.group = group
+		self.generation = generation
+		self.started = started
+		self.updated = updated
+		self.unlisted = unlisted
+		self.batch = batch
+
+
+class SharedCounterReader(object):
+	"""Reads the shared memory file a counter maintains for a group with a
+	shared_file setting. Reading never disturbs the counter or the accounting.
+	"""
+
+	def __init__(self, path):
+		"""
+		@type path: str
+		@raises OSError: if the file cannot be opened
+		@raises ValueError: if the file is not a shared memory file
+		"""
+		self.path = path
+		fd = os.open(path, os.O_RDONLY)
+		try:
+			self.inode = os.fstat(fd).st_ino
+			self.map = mmap.mmap(fd, 0, mmap.MAP_SHARED, mmap.PROT_READ)
+		finally:
+			os.close(fd)
+		if len(self.map) < header.size:
+			self.close()
+			raise ValueError("%s is too short" % path)
+		fields = header.unpack_from(self.map)
+		if fields[0] != magic or fields[1] != version:
+			self.close()
+			raise ValueError("%s is no shared memory file of version %d" %
+							 (path, version))
+		self.group, self.addrlen = fields[2:4]
+		self.capacity = fields[5]
+		self.valuesoffset = header.size
+		self.addressesoffset = header.size + 8 * self.capacity
+		if len(self.map) < self.addressesoffset + self.addrlen * self.capacity:
+			self.close()
+			raise ValueError("%s is too short" % path)
+
+	def current(self):
+		"""A restarted counter replaces the file. The reader then needs to be
+		recreated to see further updates.
+		@rtype: bool
+		@returns: whether the file read is still the one at the path
+		"""
+		try:
+			return os.stat(self.path).st_ino == self.inode
+		except OSError:
+			return False
+
+	def read(self, attempts=100):
+		"""Take a consistent copy of the running totals.
+		@type attempts: int
+		@rtype: SharedTotals
+		@raises IOError: if the counter was updating the file during all
+				attempts
+		"""
+		for _ in xrange(attempts):
+			fields = header.unpack_from(self.map)
+			sequence, records = fields[4], fields[6]
+			if sequence % 2 or records > self.capacity:
+				time.sleep(0.001)
+				continue
+			start = self.valuesoffset
+			values = self.map[start:start + 8 * records]
+			start = self.addressesoffset
+			addresses = self.map[start:start + self.addrlen * records]
+			fields = header.unpack_from(self.map)
+			if fields[4] != sequence:
+				continue
+			batch = AccountBatch(self.addrlen)
+			batch.extend(addresses, unpack_host_values(values))
+			return SharedTotals(self.group, fields[7], fields[8] / 1e6,
+								fields[9] / 1e6, fields[10], batch)
+		raise IOError("%s is updated too often" % self.path)
+
+	def close(self):
+		self.map.close()
+
+
+def unpack_host_values(data):
+	"""Decode a sequence of 64bit unsigned integers in host byte order.
+	@type data: str
+	@rtype: array.array or list
+	"""
+	values = new_value_array()
+	if isinstance(values, list):
+		return list(struct.unpack("=%dQ" % (len(data) // 8), data))
+	values.fromstring(data)
+	return values
+
+# vim:ts=4 sw=4
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Runtime statistics of nflogipacd.py. Every connection to the statistics
+socket (stats_socket setting) receives one JSON object and is closed."""
+
+import Queue
+import asyncore
+import errno
+import json
+import os
+import socket
+import stat
+import time
+
+
+class GroupStatistics(object):
+	"""Statistics of the snapshots of one group. The attributes named last_*
+	describe the last complete snapshot and are None before the first one. The
+	attributes named total_* accumulate over all snapshots.
+
+	@type snapshots: int
+	@ivar snapshots: is the number of complete snapshots
+	@type last_duration: float or None
+	@ivar last_duration: is the time from the request until the END message
+			in seconds
+	@type last_records: int or None
+	@ivar last_records: is the number of addresses exported
+	@type last_bytes: int or long or None
+	@ivar last_bytes: is the number of bytes counted as reported by a TABLE
+			message
+	@type table_entries: int or long or None
+	@ivar table_entries: is the number of addresses counted before any
+			restriction as reported by a TABLE message
+	@type table_memory: int or long or None
+	@ivar table_memory: is the memory allocated by the tables of the counter
+			as reported by a TABLE message
+	"""
+
+	def __init__(self):
+		self.snapshots = 0
+		self.requested = None
+		self.records = 0
+		self.last_duration = None
+		self.last_records = None
+		self.last_bytes = None
+		self.table_entries = None
+		self.table_memory = None
+		self.total_records = 0
+		self.total_bytes = 0
+		self.total_lost_packets = 0
+		self.total_lost_bytes = 0
+		self.total_remainder_bytes = 0
+
+	def start(self, now):
+		self.requested = now
+		self.records = 0
+
+	def account(self, records):
+		self.records += records
+
+	def loss(self, packets, bytes):
+		self.total_lost_packets += packets
+		if bytes is not None:
+			self.total_lost_bytes += bytes
+
+	def remainder(self, bytes):
+		self.total_remainder_bytes += bytes
+
+	def table(self, entries, memory, bytes):
+		self.table_entries = entries
+		self.table_memory = memory
+		self.last_bytes = bytes
+		self.total_bytes += bytes
+
+	def end(self, now):
+		self.snapshots += 1
+		if self.requested is not None:
+			self.last_duration = now - self.requested
+		self.last_records = self.records
+		self.total_records += self.records
+
+	def as_dict(self):
+		"""
+		@rtype: dict
+		"""
+		return dict((key, value) for key, value in self.__dict__.items()
+					if key not in ("requested", "records"))
+
+
+class MeasuredQueue(Queue.Queue):
+	"""The queue of the WriteThread. It records its high-water mark and the
+	time the plugin takes for each snapshot, i.e. from taking the start_write
+	event until asking for the event after end_write.
+
+	@type highwater: int
+	@ivar highwater: is the maximum number of queued events
+	@type writes: int
+	@ivar writes: is the number of snapshots handled by the plugin
+	@type last_write: float or None
+	@ivar last_write: is the time the plugin took for the last snapshot
+	@type total_write: float
+	@ivar total_write: is the time the plugin took for all snapshots
+	"""
+
+	def __init__(self):
+		Queue.Queue.__init__(self)
+		self.highwater = 0
+		self.writes = 0
+		self.last_write = None
+		self.total_write = 0.0
+		self.write_started = None
+		self.writing = False
+
+	def _put(self, item):
+		Queue.Queue._put(self, item)
+		if len(self.queue) > self.highwater:
+			self.highwater = len(self.queue)
+
+	def get(self, block=True, timeout=None):
+		if self.writing:
+			self.writing = False
+			self.write_finished(time.time())
+		item = Queue.Queue.get(self, block, timeout)
+		if item[0] == "start_write":
+			self.write_started = time.time()
+		elif item[0] == "end_write":
+			self.writing = True
+		return item
+
+	def write_finished(self, now):
+		"""Called when the plugin handled an end_write event.
+		@type now: float
+		"""
+		self.writes += 1
+		if self.write_started is not None:
+			self.last_write = now - self.write_started
+			self.total_write += self.last_write
+			self.write_started = None
+
+	def as_dict(self):
+		"""
+		@rtype: dict
+		"""
+		return dict(depth=self.qsize(), highwater=self.highwater,
+					writes=self.writes, last_write=self.last_write,
+					total_write=self.total_write)
+
+
+class StatisticsConnection(asyncore.dispatcher_with_send):
+	def __init__(self, sock, data, mapping):
+		asyncore.dispatcher_with_send.__init__(self, sock, map=mapping)
+		self.send(data)
+		if not self.out_buffer:
+			self.close()
+
+	def readable(self):
+		return False
+
+	def handle_write(self):
+		self.initiate_send()
+		if not self.out_buffer:
+			self.close()
+
+
+class StatisticsServer(asyncore.dispatcher):
+	def __init__(self, path, collect, mapping):
+		"""
+		@type path: str
+		@param path: is the path of the UNIX socket. A stale socket is
+				replaced.
+		@type collect: () -> dict
+		@param collect: returns the statistics to send
+		@raises socket.error:
+		"""
+		asyncore.dispatcher.__init__(self, map=mapping)
+		self.path = path
+		self.collect = collect
+		try:
+			if stat.S_ISSOCK(os.stat(path).st_mode):
+				os.unlink(path)
+		except OSError as err:
+			if err.args[0] != errno.ENOENT:
+				raise
+		self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.bind(path)
+		self.listen(5)
+
+	def handle_accept(self):
+		pair = self.accept()
+		if pair is None:
+			return
+		StatisticsConnection(pair[0], json.dumps(self.collect(),
+												 sort_keys=True) + "\n",
+							 self._map)
+
+	def handle_close(self):
+		self.close()
+
+	def close(self):
+		asyncore.dispatcher.close(self)
+		try:
+			os.unlink(self.path)
+		except OSError:
+			pass
+
+# vim:ts=4 sw=4
@@ -2,31 +2,118 @@
 # -*- coding: utf-8 -*-
 """Syslogging class using Python syslog module"""
 
-import inspect
+import Queue
 import os
 import syslog
 import sys
+import threading
+import time
+
+# (ident, facility) last passed to syslog.openlog
+opened = None
+
+
+class RateLimiter(object):
+	"""Limits messages sharing a key to a burst of messages per interval."""
+
+	def __init__(self, burst, interval):
+		"""
+		@param burst: Number of messages passed per key and interval
+		@type burst: integer
+		@param interval: Length of an interval in seconds
+		@type interval: integer
+		"""
+		self.burst = burst
+		self.interval = interval
+		self.windows = {}  # key -> [start of interval, number of messages]
+		self.lock = threading.Lock()
+
+	def admit(self, key, now):
+		"""Decides whether a message may be logged.
+		@param key: Key of the message
+		@param now: Current time
+		@type now: float
+		@returns: Whether to log the message and the number of messages suppressed during the previous interval of the key
+		@rtype: (boolean, integer)
+		"""
+		with self.lock:
+			window = self.windows.get(key)
+			if window is None or now - window[0] >= self.interval:
+				suppressed = 0 if window is None else max(0, window[1] - self.burst)
+				self.windows[key] = [now, 1]
+				return True, suppressed
+			window[1] += 1
+			return window[1] <= self.burst, 0
+
+	def expire(self, now=None):
+		"""Forgets the keys whose interval has passed or all keys if now is None.
+		@param now: Current time
+		@type now: float or None
+		@returns: Keys and numbers of suppressed messages
+		@rtype: [(key, integer)]
+		"""
+		expired = []
+		with self.lock:
+			for key, (start, count) in self.windows.items():
+				if now is None or now - start >= self.interval:
+					del self.windows[key]
+					if count > self.burst:
+						expired.append((key, count - self.burst))
+		return expired
+
+
+class LoggingThread(threading.Thread):
+	"""Thread writing the messages of a Syslogging instance, so logging does not block the caller"""
+
+	def __init__(self, log):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.log = log
+		self.queue = Queue.Queue()
+
+	def run(self):
+		timeout = None
+		if self.log.limiter is not None:
+			timeout = self.log.limiter.interval
+		while True:
+			try:
+				entry = self.queue.get(True, timeout)
+			except Queue.Empty:
+				self.log.expire(time.time())
+				continue
+			if entry is None:
+				return
+			self.log.emit(*entry)
+
+	def terminate(self):
+		self.queue.put(None)
 
 
 class Syslogging(object):
 	"""Syslogging class providing wrapper functions for logging priorites. Should not be used directly. See classes below"""
 
-	def __init__(self, filename=None, facility=syslog.LOG_LOCAL0, quiet=True):
+	def __init__(self, filename=None, facility=syslog.LOG_LOCAL0, quiet=True, location=True):
 		"""Initializes a new Syslogging function using a given facility. A filename can be specified, which is used in syslogging to define a prefix for the logging program
 		A facility can be specified. If quiet is set to False (default to True) and no Python optimizing is done, data will be put out to std output
-		A sourcecode position will be added to the log output including line numbers and python objects.
+		A sourcecode position will be added to the log output including line numbers and python objects unless location is set to False.
 		Using enable_full_trace a complete trace will be given. Without just the last so called frame will be used.
+		Messages may be format strings. Their arguments are passed to the logging functions and only formatted if the message is logged.
 		@param filename: A Syslog prefix (given to syslog.openlog)
 		@type filename: string
 		@param facility: Syslog facility. Defaults to syslog.LOG_LOCAL0
 		@type facility: class
 		@param quiet: Outputs log to standard output if set to False and no Python optimization is done
 		@type quiet: boolean
+		@param location: Prefixes messages with their sourcecode position
+		@type location: boolean
 		"""
 		self.facility = facility
 		self.filename = filename
 		self.quiet = quiet
+		self.location = location
 		self.full_trace = False
+		self.limiter = None
+		self.thread = None
 
 	def enable_full_trace(self):
 		"""Enables full trace of function calls in log output"""
@@ -36,6 +123,29 @@ class Syslogging(object):
 		"""Disables full trace of function calls in log output"""
 		self.full_trace = False
 
+	def enable_rate_limit(self, burst, interval=60):
+		"""Limits warnings and errors sharing a message (before formatting) to burst messages per interval. The number of suppressed messages is logged once the interval has passed and a further such message is logged or the background thread notices.
+		@param burst: Number of messages logged per interval
+		@type burst: integer
+		@param interval: Length of an interval in seconds
+		@type interval: integer
+		"""
+		self.limiter = RateLimiter(burst, interval)
+
+	def start_thread(self):
+		"""Writes messages from a background thread. The thread does not survive a fork, so it must be started afterwards. Call close to write pending messages before exiting."""
+		if self.thread is None:
+			self.thread = LoggingThread(self)
+			self.thread.start()
+
+	def close(self):
+		"""Writes all pending messages including the numbers of suppressed messages and stops the background thread"""
+		if self.thread is not None:
+			self.thread.terminate()
+			self.thread.join()
+			self.thread = None
+		self.expire(None)
+
 	def log_output(self, prefix, message):
 		"""Outputs to stdout log message including a prefix
 		@param prefix: a prefix set for the log message seperated by space from message
@@ -45,101 +155,146 @@ class Syslogging(object):
 		"""
 		sys.stdout.write("%s %s\n" % (prefix, message))
 
-	def log_generic(self, level, message):
+	def calling_prefix(self):
+		"""Determines the sourcecode position of the caller of the logging function
+		@rtype: string
+		"""
+		frames = []
+		frame = sys._getframe(1)
+		while frame is not None:
+			if frame.f_code.co_filename != srcfile:
+				frames.append(frame)
+				if not self.full_trace:
+					break
+			frame = frame.f_back
+		if not frames:
+			return ""
+		last_function = frames[0].f_code.co_name
+		frames.reverse()
+		calling_prefix = "#".join("%s:%d" % (os.path.basename(frame.f_code.co_filename), frame.f_lineno) for frame in frames)
+		if last_function != "<module>":
+			calling_prefix += "/" + last_function
+		return calling_prefix
+
+	def log_generic(self, level, message, args=()):
 		"""Generic logging function used by all other logging functions
 		@param level: a syslog priority as defined by syslog Python module
 		@type level: integer
 		@param message: A message to be logged
 		@type message: string
+		@param args: Arguments formatted into the message using the % operator if not empty
+		@type args: tuple
 		"""
-		syslog.openlog(self.filename, syslog.LOG_PID, self.facility)
-		calling_prefix = ""
-		outer = inspect.getouterframes(inspect.currentframe())
-		this_filename = os.path.basename(outer[0][1])
-		outer.reverse()
-		for elem in outer:
-			if os.path.basename(elem[1]) != this_filename:
-				if calling_prefix != "":
-					calling_prefix += "#"
-				calling_prefix += os.path.basename(elem[1]) + ":" + str(elem[2])
-				last_prefix = os.path.basename(elem[1]) + ":" + str(elem[2])
-				last_function = elem[3]
-
-		if self.full_trace:
-			if last_function != "<module>":
-				calling_prefix += "/" + last_function
-		else:
-			if last_function != "<module>":
-				calling_prefix = last_prefix + "/" + last_function
-			else:
-				calling_prefix = last_prefix
-		message = calling_prefix + "###" + message
-
-		if level == syslog.LOG_ERR:
-			if __debug__ and not self.quiet:
-				self.log_output("ERR", message)
-		elif level == syslog.LOG_WARNING:
-			if __debug__ and self.quiet is False:
-				self.log_output("WARNING", message)
-		elif level == syslog.LOG_INFO:
-			if __debug__ and self.quiet is False:
-				self.log_output("INFO", message)
-		elif level == syslog.LOG_DEBUG:
-			if (__debug__) and (self.quiet is False):
-				self.log_output("DEBUG", message)
+		text = message % args if args else message
+		if self.location:
+			text = self.calling_prefix() + "###" + text
+		if self.thread is not None:
+			self.thread.queue.put((level, message, text))
 		else:
-			if (__debug__) and (self.quiet is False):
-				self.log_output("UNKNOWN", message)
-		syslog.syslog(level, message)
+			self.emit(level, message, text)
+
+	def emit(self, level, message, text):
+		"""Applies the rate limit and writes a message
+		@param level: a syslog priority as defined by syslog Python module
+		@type level: integer
+		@param message: The message before formatting
+		@type message: string
+		@param text: The message to be written
+		@type text: string
+		"""
+		if self.limiter is not None and level <= syslog.LOG_WARNING:
+			now = time.time()
+			if len(self.limiter.windows) > 256:
+				self.expire(now)
+			admitted, suppressed = self.limiter.admit((level, message), now)
+			if suppressed:
+				self.write_suppressed(level, message, suppressed)
+			if not admitted:
+				return
+		self.write(level, text)
+
+	def expire(self, now):
+		"""Writes the numbers of suppressed messages whose interval has passed or all if now is None
+		@param now: Current time
+		@type now: float or None
+		"""
+		if self.limiter is not None:
+			for (level, message), suppressed in self.limiter.expire(now):
+				self.write_suppressed(level, message, suppressed)
+
+	def write_suppressed(self, level, message, suppressed):
+		self.write(level, "suppressed %d further messages like: %s" % (suppressed, message))
 
-	def log_error(self, message):
+	def write(self, level, text):
+		"""Writes a message to syslog and standard output
+		@param level: a syslog priority as defined by syslog Python module
+		@type level: integer
+		@param text: The message to be written
+		@type text: string
+		"""
+		global opened
+		if opened != (self.filename, self.facility):
+			syslog.openlog(self.filename, syslog.LOG_PID, self.facility)
+			opened = (self.filename, self.facility)
+		if __debug__ and not self.quiet:
+			self.log_output(level_names.get(level, "UNKNOWN"), text)
+		syslog.syslog(level, text)
+
+	def log_error(self, message, *args):
 		"""Logs a error message
 		@param message: Message to be logged
 		@type message: string
+		@param args: Arguments formatted into the message
 		"""
-		self.log_generic(syslog.LOG_ERR, message)
+		self.log_generic(syslog.LOG_ERR, message, args)
 
-	def log_err(self, message):
+	def log_err(self, message, *args):
 		"""Logs a error message
 		@param message: Message to be logged
 		@type message: string
+		@param args: Arguments formatted into the message
 		"""
-		self.log_generic(syslog.LOG_ERR, message)
+		self.log_generic(syslog.LOG_ERR, message, args)
 
-	def log_warning(self, message):
+	def log_warning(self, message, *args):
 		"""Logs a warning message
 		@param message: Message to be logged
 		@type message: string
+		@param args: Arguments formatted into the message
 		"""
-		self.log_generic(syslog.LOG_WARNING, message)
+		self.log_generic(syslog.LOG_WARNING, message, args)
 
-	def log_warn(self, message):
+	def log_warn(self, message, *args):
 		"""Logs a warning message
 		@param message: Message to be logged
 		@type message: string
+		@param args: Arguments formatted into the message
 		"""
-		self.log_generic(syslog.LOG_WARNING, message)
+		self.log_generic(syslog.LOG_WARNING, message, args)
 
-	def log_notice(self, message):
+	def log_notice(self, message, *args):
 		"""Logs a notice message
 		@param message: Message to be logged
 		@type message: str
+		@param args: Arguments formatted into the message
 		"""
-		self.log_generic(syslog.LOG_NOTICE, message)
+		self.log_generic(syslog.LOG_NOTICE, message, args)
 
-	def log_info(self, message):
+	def log_info(self, message, *args):
 		"""Logs a info message
 		@param message: Message to be logged
 		@type message: string
+		@param args: Arguments formatted into the message
 		"""
-		self.log_generic(syslog.LOG_INFO, message)
+		self.log_generic(syslog.LOG_INFO, message, args)
 
-	def log_debug(self, message):
+	def log_debug(self, message, *args):
 		"""Logs a debug message
 		@param message: Message to be logged
 		@type message: string
+		@param args: Arguments formatted into the message
 		"""
-		self.log_generic(syslog.LOG_DEBUG, message)
+		self.log_generic(syslog.LOG_DEBUG, message, args)
 
 
 class SysloggingDebugLevel(Syslogging):
@@ -147,7 +302,7 @@ class SysloggingDebugLevel(Syslogging):
 	A debug level can be set. Messages are only logged if the given debug level in the log_debug function parameter exceeds the currently set log_level
 	"""
 
-	def __init__(self, filename, facility=syslog.LOG_LOCAL0, quiet=True, log_level=0):
+	def __init__(self, filename, facility=syslog.LOG_LOCAL0, quiet=True, log_level=0, location=True):
 		"""Constructor calling Syslogging init function and in addition introduces parameter log_level which is set to 0 as default
 		@param filename: A Syslog prefix (given to syslog.openlog)
 		@type filename: string
@@ -157,8 +312,10 @@ class SysloggingDebugLevel(Syslogging):
 		@type quiet: boolean
 		@param log_level: Integer value setting the log level
 		@type log_level: integer
+		@param location: Prefixes messages with their sourcecode position
+		@type location: boolean
 		"""
-		Syslogging.__init__(self, filename, facility=facility, quiet=quiet)
+		Syslogging.__init__(self, filename, facility=facility, quiet=quiet, location=location)
 		self.log_level = log_level
 		self.log_debug(filename + " started and SysloggingDebugLevel initialized")
 
@@ -169,14 +326,21 @@ class SysloggingDebugLevel(Syslogging):
 		"""
 		self.log_level = log_level
 
-	def log_debug(self, message, level=0):
+	def log_debug(self, message, level=0, *args):
 		"""Log function which logs a message if the given level is equal or higher the current debug log level
+		Neither the message is formatted nor the sourcecode position determined otherwise.
 		@param message: A message to be logge
 		@type message: string
 		@param level: Log level of message
 		@type level: integer
+		@param args: Arguments formatted into the message
 		"""
 		if level <= self.log_level:
-			Syslogging.log_debug(self, message)
+			self.log_generic(syslog.LOG_DEBUG, message, args)
+
+
+srcfile = Syslogging.log_generic.__code__.co_filename
+
+level_names = {syslog.LOG_ERR: "ERR", syslog.LOG_WARNING: "WARNING", syslog.LOG_INFO: "INFO", syslog.LOG_DEBUG: "DEBUG"}
 
 # vim:ts=4 sw=4
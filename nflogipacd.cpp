@@ -1,8 +1,16 @@
 #include <arpa/inet.h>
+#include <byteswap.h>
 #include <endian.h>
+#include <pthread.h>
+#include <sched.h>
 #include <stdint.h>
+#include <fcntl.h>
+#include <poll.h>
 #include <unistd.h>
+#include <sys/mman.h>
 #include <sys/socket.h>
+#include <sys/stat.h>
+#include <sys/time.h>
 
 #include <algorithm>
 #include <cassert>
@@ -10,24 +18,26 @@
 #include <cstdio>
 #include <cstdlib>
 #include <cstring>
+#include <fstream>
+#include <functional>
 #include <iostream>
 #include <limits>
 #include <sstream>
 #include <string>
+#include <vector>
 
 #include <boost/bind.hpp>
-#include <boost/thread/mutex.hpp>
 #include <boost/thread/thread.hpp>
 
+/* Defaults of the options -r, -b and -m. */
 #ifndef RECEIVE_BUFFER_SIZE
-/* TODO: should this be runtime configurable? */
 #define RECEIVE_BUFFER_SIZE 1024*1024
 #endif
-
-#ifdef USE_STANDARD_MAP
-#include <map>
-#else
-#include <boost/tr1/unordered_map.hpp>
+#ifndef READ_BUFFER_SIZE
+#define READ_BUFFER_SIZE 65536
+#endif
+#ifndef READ_BATCH
+#define READ_BATCH 1
 #endif
 
 extern "C" {
@@ -40,8 +50,29 @@ extern "C" {
 #define UNUSED
 #endif
 
+#define UINT64_CONSTANT(high, low) (((uint64_t)(high) << 32) | (uint64_t)(low))
+
 #define CMD_ACCOUNT 1u
 #define CMD_END 2u
+#define CMD_LOSS 3u
+#define CMD_BULK_UPDATE 4u
+#define CMD_LOSS64 5u
+#define CMD_GROUP 6u
+#define CMD_REMAINDER 7u
+#define CMD_TABLE 8u
+
+/* Highest protocol extension level (see protocol.txt) understood. */
+#define PROTOCOL_LEVEL 5u
+
+#ifndef BULK_UPDATE_RECORDS
+/* Maximum number of records in one BULK_UPDATE message. */
+#define BULK_UPDATE_RECORDS 16384u
+#endif
+
+#ifndef FRAME_BUFFER_SIZE
+/* Size of the buffer messages are encoded into before writing them out. */
+#define FRAME_BUFFER_SIZE 1024*1024
+#endif
 
 /**
  * Generic error nflogipac error class.
@@ -52,17 +83,51 @@ class nflogipac_error : public std::exception {
 		nflogipac_error(const char *m) : message(m) {}
 };
 
+class frame_writer;
+class shared_region;
+class checkpoint_file;
+
 /**
- * Base class for traffic counters. Invoking the methods count, packet_lost and
- * writedata in different threads must be safe.
+ * Base class for traffic counters. The methods count, begin_batch and
+ * end_batch are invoked by the receiving thread only and retire and writedata
+ * are invoked by the reporting thread only. Invoking packet_lost and packets_missing in
+ * any thread is safe.
+ * Counters do not lock. Instead the receiving thread brackets each batch of
+ * count invocations with begin_batch and end_batch, so writedata can wait for
+ * the receiving thread to stop using a table before exporting it.
  */
 class nflogipac_counter {
+	private:
+		/* Odd while the receiving thread is inside a batch. */
+		volatile unsigned long batchseq;
+		volatile unsigned int packets_lost;
+		volatile uint64_t missing_packets;
 	protected:
-		boost::mutex lock;
-		unsigned int packets_lost;
+		/**
+		 * Wait until the batch running at the time of invocation (if
+		 * any) has ended. All later batches observe any memory
+		 * modification done before invoking this method.
+		 */
+		void wait_for_batch() const;
+		/**
+		 * Fetch and clear the number of lost packets.
+		 */
+		unsigned int fetch_packets_lost();
+		/**
+		 * Fetch and clear the number of missing packets.
+		 */
+		uint64_t fetch_missing_packets();
 	public:
 		const size_t caplen;
-		nflogipac_counter(size_t cl) : packets_lost(0), caplen(cl) {}
+		nflogipac_counter(size_t cl) : batchseq(0u), packets_lost(0u),
+			missing_packets(0u), caplen(cl) {}
+		virtual ~nflogipac_counter() {}
+		void begin_batch() {
+			__sync_fetch_and_add(&this->batchseq, 1u);
+		}
+		void end_batch() {
+			__sync_fetch_and_add(&this->batchseq, 1u);
+		}
 		/**
 		 * Account a given packet.
 		 * @param payload is a buffer of precisely caplen bytes
@@ -72,63 +137,479 @@ class nflogipac_counter {
 		 * Report loss of packets. This can happen if the kernel fills
 		 * the receive buffer faster than we empty it.
 		 */
-		void packet_lost();
+		void packet_lost() {
+			__sync_fetch_and_add(&this->packets_lost, 1u);
+		}
+		/**
+		 * Report packets the kernel logged but which never reached
+		 * us as determined from sequence numbers.
+		 */
+		void packets_missing(uint32_t count) {
+			__sync_fetch_and_add(&this->missing_packets,
+					(uint64_t)count);
+		}
+		/**
+		 * Add a counter of the same kind fed by another receiving
+		 * thread as a shard. retire and writedata then also retire
+		 * and export the tables of the shard merged with the tables
+		 * of this counter.
+		 * @returns whether the shard is of the same kind
+		 */
+		virtual bool attach(nflogipac_counter *shard)=0;
+		/**
+		 * Limit the number of addresses counted between two
+		 * snapshots. Beyond the limit only the addresses with the
+		 * most traffic are kept and the traffic of the others is
+		 * reported as remainder.
+		 */
+		virtual void limit_entries(size_t entries)=0;
+		/**
+		 * Export only the addresses with at least minimum bytes and
+		 * of those at most the count ones with the most bytes per
+		 * snapshot. The traffic of the other addresses is reported as
+		 * remainder or, if carry is set, added to the next snapshot
+		 * once before being reported as remainder.
+		 */
+		virtual void filter_entries(uint64_t minimum, size_t count,
+				bool carry)=0;
+		/**
+		 * Stop carrying addresses into the next snapshot, e.g. before
+		 * the last one. The next writedata reports the addresses
+		 * carried so far and the omitted ones as remainder.
+		 */
+		virtual void stop_carrying()=0;
+		/**
+		 * Maintain the running totals of the current report period
+		 * in a shared memory file (see shared.txt) updated by publish.
+		 * @param capacity is the maximum number of addresses listed
+		 * @throws nflogipac_error if the file cannot be created
+		 */
+		virtual void share(const std::string &path, uint16_t group,
+				size_t capacity)=0;
+		/**
+		 * Retire the counted packets into the running totals and
+		 * write those to the shared memory file and the checkpoint
+		 * file if any. Invoked by the reporting thread only.
+		 */
+		virtual void publish()=0;
+		/**
+		 * Keep the running totals not exported yet in a checkpoint
+		 * file (see checkpoint.txt) updated by publish and writedata.
+		 * Totals left in the file by a previous counter are added to
+		 * the next snapshot.
+		 * @returns the number of bytes recovered from the file
+		 * @throws nflogipac_error if the file cannot be used
+		 */
+		virtual uint64_t checkpoint(const std::string &path,
+				uint16_t group)=0;
+		/**
+		 * Make the receiving thread count into a fresh table. The
+		 * packets accounted before are exported by the next writedata.
+		 */
+		virtual void retire()=0;
 		/**
-		 * Write current accounting data to the given ostream.
+		 * Write the accounting data retired by the last invocation of
+		 * retire to the given frame_writer. No END message is written.
+		 * @param level is the protocol extension level requested by
+		 *        the reader
 		 * @returns whether writing was successful
 		 */
-		virtual bool writedata(std::ostream &out)=0;
+		virtual bool writedata(frame_writer &out, unsigned int level)=0;
+};
+
+/* Marks an option that leaves the kernel default in effect. */
+const unsigned int option_unset(std::numeric_limits<unsigned int>::max());
+
+/**
+ * Tunables of the netlink socket and the nflog instance used by a nflogipac
+ * instance.
+ */
+struct nflogipac_options {
+	/* SO_RCVBUF of the netlink socket in bytes */
+	unsigned int receive_buffer;
+	/* size of the buffer for a single netlink datagram in bytes */
+	unsigned int read_buffer;
+	/* maximum number of datagrams received per system call */
+	unsigned int read_batch;
+	/* number of packets the kernel queues before sending a datagram */
+	unsigned int qthreshold;
+	/* time in 1/100s after which the kernel sends a partial datagram */
+	unsigned int flush_timeout;
+	/* size of the kernel buffer for a datagram in bytes */
+	unsigned int nlbufsiz;
+	nflogipac_options() : receive_buffer(RECEIVE_BUFFER_SIZE),
+		read_buffer(READ_BUFFER_SIZE), read_batch(READ_BATCH),
+		qthreshold(option_unset), flush_timeout(option_unset),
+		nlbufsiz(option_unset) {}
+};
+
+/**
+ * Source of the packets of a counter. Each source is run by a receiving
+ * thread of its own.
+ */
+class packet_source {
+	protected:
+		nflogipac_counter *counter;
+	public:
+		packet_source(nflogipac_counter *c) : counter(c) {}
+		virtual ~packet_source() {}
+		/**
+		 * Prepare receiving packets.
+		 * @throws nflogipac_error
+		 */
+		virtual void open()=0;
+		/**
+		 * Account a received packet. Packets shorter than the caplen
+		 * of the counter are ignored.
+		 */
+		void count(const char *payload, size_t length) {
+			if(length < this->counter->caplen)
+				return;
+			this->counter->count(payload);
+		}
+		/**
+		 * Receive packets and account them.
+		 */
+		virtual void run()=0;
 };
 
 /**
  * OOP interface to libnetfilter_log. This class is not thread safe by itself.
  */
-class nflogipac {
+class nflogipac : public packet_source {
 	private:
 		struct nflog_handle *handle;
 		struct nflog_g_handle *ghandle;
 		uint16_t group;
-		nflogipac_counter *counter;
+		const nflogipac_options options;
 		int fd;
+		/* read_batch buffers of read_buffer bytes each */
+		std::vector<char> buffers;
+		std::vector<struct iovec> iovecs;
+		std::vector<struct mmsghdr> messages;
+		/* whether nextseq holds the expected sequence number */
+		bool seqvalid;
+		uint32_t nextseq;
 
 		int receive();
 	public:
-		nflogipac(uint16_t g, nflogipac_counter *c);
+		nflogipac(uint16_t g, nflogipac_counter *c,
+				const nflogipac_options &o);
 		void open();
-		void count(const char *payload, size_t length);
+		/**
+		 * Account the sequence number of a received packet.
+		 */
+		void sequence(uint32_t seq);
 		void run();
 };
 
-void nflogipac_counter::packet_lost() {
-	boost::lock_guard<boost::mutex> lock(this->lock);
-	++this->packets_lost;
+void nflogipac_counter::wait_for_batch() const {
+	__sync_synchronize();
+	const unsigned long seq(this->batchseq);
+	if(seq % 2u)
+		while(seq == this->batchseq)
+			boost::this_thread::yield();
+	__sync_synchronize();
+}
+
+unsigned int nflogipac_counter::fetch_packets_lost() {
+	return __sync_fetch_and_and(&this->packets_lost, 0u);
+}
+
+uint64_t nflogipac_counter::fetch_missing_packets() {
+	return __sync_fetch_and_and(&this->missing_packets, (uint64_t)0u);
 }
 
-struct ipv4_hash : public std::unary_function<std::string, size_t> {
-	size_t operator()(const std::string &s) const;
+/**
+ * Counter key for IPv4 addresses. The address is kept in network byte order.
+ */
+struct ipv4_key {
+	static const size_t size = 4u;
+	uint32_t address;
+	size_t hash() const;
+	bool operator==(const ipv4_key &other) const {
+		return this->address == other.address;
+	}
+	void read(const char *data) {
+		std::memcpy(&this->address, data, 4u);
+	}
+	void write(char *data) const {
+		std::memcpy(data, &this->address, 4u);
+	}
+	void applynetmask(const ipv4_key &mask) {
+		this->address &= mask.address;
+	}
+};
+
+/**
+ * Counter key for IPv6 addresses. The address is kept in network byte order.
+ */
+struct ipv6_key {
+	static const size_t size = 16u;
+	uint64_t words[2];
+	size_t hash() const;
+	bool operator==(const ipv6_key &other) const {
+		return this->words[0] == other.words[0] &&
+			this->words[1] == other.words[1];
+	}
+	void read(const char *data) {
+		std::memcpy(this->words, data, 16u);
+	}
+	void write(char *data) const {
+		std::memcpy(data, this->words, 16u);
+	}
+	void applynetmask(const ipv6_key &mask) {
+		this->words[0] &= mask.words[0];
+		this->words[1] &= mask.words[1];
+	}
+};
+
+/**
+ * Traffic of a snapshot that is not attributed to any address.
+ */
+struct remainder_report {
+	/* number of bytes */
+	uint64_t bytes;
+	/* maximum number of these bytes that belong to a single reported
+	 * address */
+	uint64_t error;
+	/* upper bound on the bytes of any address that is not reported */
+	uint64_t threshold;
 };
 
-class nflogipac_counter_ipv4 : public nflogipac_counter {
+/**
+ * Hash table from fixed width keys to byte counts using open addressing with
+ * linear probing. A zero value marks an empty slot, so only positive values
+ * can be added. Adding to a key that is already present never allocates
+ * memory. This class is not thread safe by itself.
+ *
+ * The number of entries can be limited. Once a new key exceeds the limit, the
+ * table becomes a weighted Space-Saving summary: the key replaces the entry
+ * with the smallest value and inherits that value as its error. Keys already
+ * present are counted as before. A lazily updated min-heap of all entries
+ * finds the smallest one. settle turns the summary back into a table holding
+ * the guaranteed value of every entry and accounts the errors as remainder.
+ */
+template<typename Key> class counter_table {
+	public:
+		struct entry {
+			Key key;
+			uint64_t value;
+		};
+		/**
+		 * Forward iterator over the occupied slots.
+		 */
+		class const_iterator {
+			private:
+				const entry *pos;
+				const entry *last;
+				void skip() {
+					while(this->pos != this->last &&
+							0u == this->pos->value)
+						++this->pos;
+				}
+			public:
+				const_iterator(const entry *p, const entry *l)
+						: pos(p), last(l) {
+					this->skip();
+				}
+				const entry &operator*() const { return *this->pos; }
+				const entry *operator->() const { return this->pos; }
+				const_iterator &operator++() {
+					++this->pos;
+					this->skip();
+					return *this;
+				}
+				bool operator==(const const_iterator &other) const {
+					return this->pos == other.pos;
+				}
+				bool operator!=(const const_iterator &other) const {
+					return this->pos != other.pos;
+				}
+		};
 	private:
-#ifdef USE_STANDARD_MAP
-		typedef std::map<std::string, uint64_t> counter_map_type;
-#else
-		typedef std::tr1::unordered_map<std::string, uint64_t,
-			ipv4_hash> counter_map_type;
-#endif
-		counter_map_type counters;
-		const unsigned int netmask;
+		std::vector<entry> slots;
+		/**
+		 * Heap element of the Space-Saving summary. The value is the
+		 * value of the entry at the time the element was last pushed.
+		 */
+		struct hitter {
+			uint64_t value;
+			uint64_t error;
+			Key key;
+			bool operator<(const hitter &other) const {
+				return this->value > other.value;
+			}
+		};
+		size_t mask;
+		size_t used;
+		uint64_t additions;
+		uint64_t sum;
+		/* part of sum not passed to add */
+		uint64_t restored;
+		size_t limit;
+		/* empty unless the limit was exceeded since the last settle */
+		std::vector<hitter> hitters;
+		remainder_report rest;
+		static size_t capacity_for(size_t entries);
+		void grow();
+		void place(const entry &e);
+		void insert(const Key &key, uint64_t value);
+		void replace_smallest(const Key &key, uint64_t value);
+		entry *find(const Key &key);
+		void erase(entry *slot);
+	public:
+		/**
+		 * @param expected is the number of entries to reserve space for
+		 */
+		explicit counter_table(size_t expected=0u);
+		void add(const Key &key, uint64_t value) {
+			++this->additions;
+			this->sum += value;
+			this->insert(key, value);
+		}
+		/**
+		 * Add a value counted before, e.g. by another process, without
+		 * counting it as addition.
+		 */
+		void restore(const Key &key, uint64_t value) {
+			this->restored += value;
+			this->sum += value;
+			this->insert(key, value);
+		}
+		/**
+		 * Add all entries and the remainder of another settled table.
+		 */
+		void merge(const counter_table &other);
+		/**
+		 * Limit the number of entries.
+		 */
+		void set_limit(size_t entries) { this->limit = entries; }
+		/**
+		 * Replace the value of every entry by its guaranteed value and
+		 * move the errors to the remainder. Adding to the table
+		 * afterwards starts a new summary.
+		 */
+		void settle();
+		const remainder_report &remainder() const {
+			return this->rest;
+		}
+		/**
+		 * Account traffic of addresses no longer known as remainder.
+		 * Like restore it is not counted as addition.
+		 */
+		void add_remainder(const remainder_report &other);
+		/**
+		 * Remove the entries below minimum and all but the count
+		 * entries with the largest values from a settled table.
+		 * Removed entries are added to carry unless carry is 0 or
+		 * their key is in carried. Otherwise they are accounted as
+		 * remainder.
+		 */
+		void filter(uint64_t minimum, size_t count, counter_table *carry,
+				const counter_table *carried);
+		bool contains(const Key &key) const {
+			return 0 != const_cast<counter_table*>(this)->find(key);
+		}
+		/**
+		 * Remove all entries.
+		 * @param expected is the number of entries to reserve space for
+		 */
+		void clear(size_t expected);
+		size_t size() const { return this->used; }
+		size_t capacity() const { return this->slots.size(); }
+		/**
+		 * @returns the number of invocations of add since the last
+		 *          clear
+		 */
+		uint64_t added() const { return this->additions; }
+		/**
+		 * @returns the sum of all values
+		 */
+		uint64_t total() const { return this->sum; }
+		/**
+		 * @returns the sum of the values passed to add since the last
+		 *          clear
+		 */
+		uint64_t counted() const { return this->sum - this->restored; }
+		/**
+		 * @returns the number of bytes allocated by the table
+		 */
+		size_t memory() const {
+			return this->slots.capacity() * sizeof(entry) +
+				this->hitters.capacity() * sizeof(hitter);
+		}
+		const_iterator begin() const {
+			return const_iterator(&this->slots.front(),
+					&this->slots.front() + this->slots.size());
+		}
+		const_iterator end() const {
+			return const_iterator(
+					&this->slots.front() + this->slots.size(),
+					&this->slots.front() + this->slots.size());
+		}
+};
+
+/**
+ * Base class for counters of fixed width addresses. The receiving thread
+ * counts into the active one of two tables. retire switches the active table.
+ * writedata exports the retired one once the receiving thread has left it and
+ * clears it for the next switch presized by its number of entries. The
+ * retired tables of shards are merged into the retired table before.
+ */
+template<typename Key> class nflogipac_counter_keyed
+		: public nflogipac_counter {
 	protected:
-		virtual std::string getaddress(const char *payload) const=0;
+		typedef counter_table<Key> counter_table_type;
+		counter_table_type tables[2];
+		counter_table_type *volatile active;
+		counter_table_type *retired;
+		Key netmask;
+		std::vector<nflogipac_counter_keyed*> shards;
+		/* Addresses below the thresholds of filter_entries carried
+		 * into the next snapshot and those carried into this one.
+		 * Only used by writedata. */
+		counter_table_type carries[2];
+		counter_table_type *carry;
+		counter_table_type *carried;
+		uint64_t minimum;
+		size_t top;
+		bool carrying;
+		/* Packets of the current report period retired by publish.
+		 * Only used by the reporting thread. */
+		counter_table_type accumulated;
+		shared_region *region;
+		checkpoint_file *saved;
+		virtual Key getaddress(const char *payload) const=0;
+		/**
+		 * Wait until the receiving threads stopped using the retired
+		 * tables and merge those of the shards into the own one.
+		 */
+		void collect();
+	public:
+		nflogipac_counter_keyed(size_t cl, unsigned int nm);
+		~nflogipac_counter_keyed();
+		bool attach(nflogipac_counter *shard);
+		void limit_entries(size_t entries);
+		void filter_entries(uint64_t minimum, size_t count, bool carry);
+		void stop_carrying() { this->carrying = false; }
+		void share(const std::string &path, uint16_t group,
+				size_t capacity);
+		void publish();
+		uint64_t checkpoint(const std::string &path, uint16_t group);
+		void retire();
+		bool writedata(frame_writer &out, unsigned int level);
+};
+
+class nflogipac_counter_ipv4 : public nflogipac_counter_keyed<ipv4_key> {
 	public:
 		nflogipac_counter_ipv4(size_t cl, unsigned int nm=32u);
 		void count(const char *payload);
-		bool writedata(std::ostream &out);
 };
 
 class nflogipac_counter_ipv4src : public nflogipac_counter_ipv4 {
 	protected:
-		std::string getaddress(const char *payload) const;
+		ipv4_key getaddress(const char *payload) const;
 	public:
 		nflogipac_counter_ipv4src(unsigned int nm=32u)
 			: nflogipac_counter_ipv4(16u, nm) {}
@@ -136,37 +617,21 @@ class nflogipac_counter_ipv4src : public nflogipac_counter_ipv4 {
 
 class nflogipac_counter_ipv4dst : public nflogipac_counter_ipv4 {
 	protected:
-		std::string getaddress(const char *payload) const;
+		ipv4_key getaddress(const char *payload) const;
 	public:
 		nflogipac_counter_ipv4dst(unsigned int nm=32u)
 			: nflogipac_counter_ipv4(20u, nm) {}
 };
 
-struct ipv6_hash : public std::unary_function<std::string, size_t> {
-	size_t operator()(const std::string &s) const;
-};
-
-class nflogipac_counter_ipv6 : public nflogipac_counter {
-	private:
-#ifdef USE_STANDARD_MAP
-		typedef std::map<std::string, uint64_t> counter_map_type;
-#else
-		typedef std::tr1::unordered_map<std::string, uint64_t,
-			ipv6_hash> counter_map_type;
-#endif
-		counter_map_type counters;
-		const unsigned int netmask;
-	protected:
-		virtual std::string getaddress(const char *payload) const=0;
+class nflogipac_counter_ipv6 : public nflogipac_counter_keyed<ipv6_key> {
 	public:
 		nflogipac_counter_ipv6(size_t cl, unsigned int nm=128u);
 		void count(const char *payload);
-		bool writedata(std::ostream &out);
 };
 
 class nflogipac_counter_ipv6src : public nflogipac_counter_ipv6 {
 	protected:
-		std::string getaddress(const char *payload) const;
+		ipv6_key getaddress(const char *payload) const;
 	public:
 		nflogipac_counter_ipv6src(unsigned int nm=128u)
 			: nflogipac_counter_ipv6(24u, nm) {}
@@ -174,14 +639,26 @@ class nflogipac_counter_ipv6src : public nflogipac_counter_ipv6 {
 
 class nflogipac_counter_ipv6dst : public nflogipac_counter_ipv6 {
 	protected:
-		std::string getaddress(const char *payload) const;
+		ipv6_key getaddress(const char *payload) const;
 	public:
 		nflogipac_counter_ipv6dst(unsigned int nm=128u)
 			: nflogipac_counter_ipv6(40u, nm) {}
 };
 
-nflogipac::nflogipac(uint16_t g, nflogipac_counter *c)
-		: handle(0), group(g), counter(c) {
+nflogipac::nflogipac(uint16_t g, nflogipac_counter *c,
+		const nflogipac_options &o)
+		: packet_source(c), handle(0), group(g), options(o),
+		buffers((size_t)o.read_buffer * o.read_batch),
+		iovecs(o.read_batch), messages(o.read_batch), seqvalid(false),
+		nextseq(0u) {
+	assert(o.read_buffer > 0u && o.read_batch > 0u);
+	for(unsigned int i(0u); i < o.read_batch; ++i) {
+		this->iovecs[i].iov_base = &this->buffers[i * o.read_buffer];
+		this->iovecs[i].iov_len = o.read_buffer;
+		std::memset(&this->messages[i], 0, sizeof(struct mmsghdr));
+		this->messages[i].msg_hdr.msg_iov = &this->iovecs[i];
+		this->messages[i].msg_hdr.msg_iovlen = 1u;
+	}
 }
 
 extern "C" {
@@ -196,7 +673,7 @@ void nflogipac::open() {
 
 	try {
 		{
-			socklen_t rcvbuf(RECEIVE_BUFFER_SIZE);
+			socklen_t rcvbuf(this->options.receive_buffer);
 			if(::setsockopt(this->fd, SOL_SOCKET, SO_RCVBUFFORCE,
 						&rcvbuf, sizeof(rcvbuf)) < 0)
 				throw nflogipac_error("setsockopt(..., "
@@ -211,6 +688,21 @@ void nflogipac::open() {
 						this->counter->caplen) < 0)
 				throw nflogipac_error("nflog_set_mode " 
 						"NFUNL_COPY_PACKET failed");
+			if(option_unset != this->options.qthreshold &&
+					::nflog_set_qthresh(this->ghandle,
+						this->options.qthreshold) < 0)
+				throw nflogipac_error("nflog_set_qthresh failed");
+			if(option_unset != this->options.flush_timeout &&
+					::nflog_set_timeout(this->ghandle,
+						this->options.flush_timeout) < 0)
+				throw nflogipac_error("nflog_set_timeout failed");
+			if(option_unset != this->options.nlbufsiz &&
+					::nflog_set_nlbufsiz(this->ghandle,
+						this->options.nlbufsiz) < 0)
+				throw nflogipac_error("nflog_set_nlbufsiz failed");
+			if(::nflog_set_flags(this->ghandle, NFULNL_CFG_F_SEQ) < 0)
+				throw nflogipac_error("nflog_set_flags "
+						"NFULNL_CFG_F_SEQ failed");
 			if(::nflog_callback_register(this->ghandle, &callback,
 						this) < 0)
 				throw nflogipac_error("nflog_callback_register "
@@ -232,26 +724,51 @@ extern "C" {
 static int callback(struct nflog_g_handle *g UNUSED, struct nfgenmsg *m UNUSED,
 		struct nflog_data *d, void *p) {
 	char *payload;
+	uint32_t seq;
 	const int l(::nflog_get_payload(d, &payload));
 	static_cast<nflogipac*>(p)->count(payload, l);
+	if(0 == ::nflog_get_seq(d, &seq))
+		static_cast<nflogipac*>(p)->sequence(seq);
 	return 0;
 }
 
 }
 
 int nflogipac::receive() {
-	/* FIXME: magic constant */
-	char buf[65536];
-	const int r(recv(this->fd, buf, sizeof(buf), 0u));
-	if(r > 0)
-		::nflog_handle_packet(this->handle, buf, r);
+	if(1u == this->options.read_batch) {
+		const int r(recv(this->fd, &this->buffers[0],
+					this->buffers.size(), 0u));
+		if(r > 0) {
+			this->counter->begin_batch();
+			::nflog_handle_packet(this->handle, &this->buffers[0], r);
+			this->counter->end_batch();
+		}
+		return r;
+	}
+	const int r(recvmmsg(this->fd, &this->messages[0],
+				this->options.read_batch, MSG_WAITFORONE, 0));
+	if(r > 0) {
+		this->counter->begin_batch();
+		for(int i(0); i < r; ++i)
+			::nflog_handle_packet(this->handle,
+					static_cast<char*>(
+						this->iovecs[i].iov_base),
+					this->messages[i].msg_len);
+		this->counter->end_batch();
+	}
 	return r;
 }
 
-void nflogipac::count(const char *payload, size_t length) {
-	if(length < this->counter->caplen)
-		return;
-	this->counter->count(payload);
+void nflogipac::sequence(uint32_t seq) {
+	if(this->seqvalid) {
+		const uint32_t missing(seq - this->nextseq);
+		/* A huge gap means the sequence went backwards, i.e. the
+		 * instance was recreated. */
+		if(0u < missing && missing < 0x80000000u)
+			this->counter->packets_missing(missing);
+	}
+	this->nextseq = seq + 1u;
+	this->seqvalid = true;
 }
 
 void nflogipac::run() {
@@ -279,10 +796,89 @@ inline void writeuint16(char data[2], uint16_t value) {
 	std::memcpy(data, &value, 2u);
 }
 
-inline bool writeuint16stream(std::ostream &out, uint16_t value) {
-	char buf[2u];
-	writeuint16(buf, value);
-	return out.write(buf, CMD_END).good();
+inline void writeuint32(char data[4], uint32_t value) {
+	value = htonl(value);
+	std::memcpy(data, &value, 4u);
+}
+
+inline void writeuint64(char data[8], uint64_t value) {
+#if BYTE_ORDER == LITTLE_ENDIAN
+	std::reverse_copy((const char*)&value, 8u+(const char*)&value, data);
+#else
+	std::memcpy(data, &value, 8u);
+#endif
+}
+
+/**
+ * Encoder for messages written to a file descriptor. Messages are encoded into
+ * a preallocated buffer which is written out with a single write whenever it
+ * fills up and on flush. After a failed write all further output is dropped.
+ */
+class frame_writer {
+	private:
+		const int fd;
+		std::vector<char> buffer;
+		size_t fill;
+		bool failed;
+		void drain();
+	public:
+		explicit frame_writer(int f, size_t size=FRAME_BUFFER_SIZE)
+			: fd(f), buffer(size), fill(0u), failed(false) {}
+		/**
+		 * Reserve space at the end of the buffer.
+		 * @param length must not exceed the buffer size
+		 * @returns where to encode length bytes to
+		 */
+		char *append(size_t length) {
+			assert(length <= this->buffer.size());
+			if(this->buffer.size() - this->fill < length)
+				this->drain();
+			char *const data(&this->buffer[this->fill]);
+			this->fill += length;
+			return data;
+		}
+		/**
+		 * Write out all buffered messages.
+		 * @returns whether all output so far was written successfully
+		 */
+		bool flush() {
+			this->drain();
+			return !this->failed;
+		}
+		bool good() const { return !this->failed; }
+		/**
+		 * @returns the maximum length passed to append
+		 */
+		size_t capacity() const { return this->buffer.size(); }
+};
+
+void frame_writer::drain() {
+	const char *data(&this->buffer[0]);
+	size_t remaining(this->fill);
+	this->fill = 0u;
+	while(!this->failed && remaining > 0u) {
+		const ssize_t r(::write(this->fd, data, remaining));
+		if(r < 0) {
+			if(EINTR != errno)
+				this->failed = true;
+			continue;
+		}
+		data += r;
+		remaining -= r;
+	}
+}
+
+/**
+ * Append the header of a message.
+ * @param length is the message length including the header
+ * @returns where to encode the content of the message to
+ */
+inline char *append_message(frame_writer &out, uint16_t length,
+		uint16_t command) {
+	char *const data(out.append(length));
+	writeuint16(data, length);
+	writeuint16(data + 2u, command);
+	return data + 4u;
 }
 
 void applynetmask(std::string &address, unsigned int netmask) {
@@ -296,69 +892,395 @@ void applynetmask(std::string &address, unsigned int netmask) {
 	}
 }
 
-inline size_t ipv4_hash::operator()(const std::string &s) const {
-	assert(4u == s.size());
-	size_t ret(0u);
-	std::memcpy(&ret, s.data(), 4u);
-	return ret;
+/**
+ * Finalizer of MurmurHash3. It spreads every input bit over the whole result.
+ */
+inline uint64_t mix64(uint64_t value) {
+	value ^= value >> 33;
+	value *= UINT64_CONSTANT(0xff51afd7u, 0xed558ccdu);
+	value ^= value >> 33;
+	value *= UINT64_CONSTANT(0xc4ceb9feu, 0x1a85ec53u);
+	value ^= value >> 33;
+	return value;
 }
 
-nflogipac_counter_ipv4::nflogipac_counter_ipv4(size_t cl, unsigned int nm)
-		: nflogipac_counter(std::max((size_t)4, cl)), netmask(nm) {
-	assert(nm <= 32u);
+/**
+ * SipHash-1-3. It is keyed, so that the hash values of addresses cannot be
+ * predicted by those sending the packets and used to overload a single region
+ * of a counter_table. The message is passed as 64bit words in host byte order,
+ * which does not matter as hash values never leave the process.
+ */
+class siphash {
+	private:
+		uint64_t v0, v1, v2, v3;
+		static uint64_t rotl(uint64_t value, unsigned int bits) {
+			return (value << bits) | (value >> (64u - bits));
+		}
+		void round() {
+			this->v0 += this->v1;
+			this->v1 = rotl(this->v1, 13u);
+			this->v1 ^= this->v0;
+			this->v0 = rotl(this->v0, 32u);
+			this->v2 += this->v3;
+			this->v3 = rotl(this->v3, 16u);
+			this->v3 ^= this->v2;
+			this->v0 += this->v3;
+			this->v3 = rotl(this->v3, 21u);
+			this->v3 ^= this->v0;
+			this->v2 += this->v1;
+			this->v1 = rotl(this->v1, 17u);
+			this->v1 ^= this->v2;
+			this->v2 = rotl(this->v2, 32u);
+		}
+	public:
+		siphash(uint64_t k0, uint64_t k1)
+			: v0(k0 ^ UINT64_CONSTANT(0x736f6d65u, 0x70736575u)),
+			v1(k1 ^ UINT64_CONSTANT(0x646f7261u, 0x6e646f6du)),
+			v2(k0 ^ UINT64_CONSTANT(0x6c796765u, 0x6e657261u)),
+			v3(k1 ^ UINT64_CONSTANT(0x74656462u, 0x79746573u)) {}
+		void update(uint64_t word) {
+			this->v3 ^= word;
+			this->round();
+			this->v0 ^= word;
+		}
+		/**
+		 * @param tail holds the last length % 8 bytes of the message
+		 * @param length is the length of the message in bytes
+		 * @returns the hash value of the message
+		 */
+		uint64_t finish(uint64_t tail, size_t length) {
+			this->update(tail | (uint64_t)length << 56);
+			this->v2 ^= 0xffu;
+			this->round();
+			this->round();
+			this->round();
+			return this->v0 ^ this->v1 ^ this->v2 ^ this->v3;
+		}
+};
+
+/* Initial state of the hash function of the counter tables. The constant key
+ * is replaced by seed_table_hash before counting. */
+siphash table_hash(UINT64_CONSTANT(0x0f0e0d0cu, 0x0b0a0908u),
+		UINT64_CONSTANT(0x07060504u, 0x03020100u));
+
+/**
+ * Choose a random key for the hash function of the counter tables. It must be
+ * called before any counter is created.
+ * @returns whether the key could be read from /dev/urandom
+ */
+bool seed_table_hash() {
+	uint64_t key[2];
+	std::ifstream urandom("/dev/urandom", std::ios::binary);
+	if(!urandom.read((char*)key, sizeof(key)))
+		return false;
+	table_hash = siphash(key[0], key[1]);
+	return true;
 }
 
-void nflogipac_counter_ipv4::count(const char *payload) {
-	const uint64_t totlen(readuint16(payload+2u));
-	std::string addr(this->getaddress(payload));
-	applynetmask(addr, this->netmask);
-	boost::lock_guard<boost::mutex> lock(this->lock);
-	this->counters[addr] += std::max((uint64_t)20u, totlen);
+inline size_t ipv4_key::hash() const {
+	siphash state(table_hash);
+	return state.finish(this->address, size);
+}
+
+inline size_t ipv6_key::hash() const {
+	siphash state(table_hash);
+	state.update(this->words[0]);
+	state.update(this->words[1]);
+	return state.finish(0u, size);
+}
+
+template<typename Key>
+size_t counter_table<Key>::capacity_for(size_t entries) {
+	size_t capacity(16u);
+	while(capacity < 2u * entries)
+		capacity *= 2u;
+	return capacity;
+}
+
+template<typename Key>
+counter_table<Key>::counter_table(size_t expected)
+		: slots(capacity_for(expected)), mask(slots.size() - 1u),
+		used(0u), additions(0u), sum(0u), restored(0u),
+		limit(std::numeric_limits<size_t>::max()), rest() {
 }
 
-std::string nflogipac_counter_ipv4src::getaddress(const char *payload) const {
-	return std::string(payload+12u, 4u);
+template<typename Key>
+void counter_table<Key>::grow() {
+	std::vector<entry> old(2u * this->slots.size());
+	old.swap(this->slots);
+	this->mask = this->slots.size() - 1u;
+	for(typename std::vector<entry>::const_iterator i(old.begin());
+			i != old.end(); ++i)
+		if(0u != i->value)
+			this->place(*i);
 }
 
-std::string nflogipac_counter_ipv4dst::getaddress(const char *payload) const {
-	return std::string(payload+16u, 4u);
+/**
+ * Put an entry whose key is not present into the first free slot of its probe
+ * sequence without counting it.
+ */
+template<typename Key>
+inline void counter_table<Key>::place(const entry &e) {
+	size_t pos(e.key.hash() & this->mask);
+	while(0u != this->slots[pos].value)
+		pos = (pos + 1u) & this->mask;
+	this->slots[pos] = e;
 }
 
-inline size_t ipv6_hash::operator()(const std::string &s) const {
-	/* Assumption: sizeof(size_t) is a power of two. */
-	static const unsigned int size_t_size(std::min(16u,
-				(unsigned int)sizeof(size_t)));
-	assert(16u == s.size());
-	size_t ret(0u);
-	std::memcpy(&ret, s.data(), size_t_size);
-	for(unsigned int i(size_t_size);
-			i < 16u; i += size_t_size) {
-		size_t tmp(0u);
-		std::memcpy(&tmp, s.data() + i, size_t_size);
-		ret ^= tmp;
+template<typename Key>
+inline void counter_table<Key>::insert(const Key &key, uint64_t value) {
+	assert(value > 0u);
+	for(size_t pos(key.hash() & this->mask);;
+			pos = (pos + 1u) & this->mask) {
+		entry &slot(this->slots[pos]);
+		if(0u == slot.value) {
+			if(this->used >= this->limit) {
+				this->replace_smallest(key, value);
+				return;
+			}
+			/* Keep the load factor at most one half. */
+			if(2u * (this->used + 1u) > this->slots.size()) {
+				this->grow();
+				this->insert(key, value);
+				return;
+			}
+			slot.key = key;
+			slot.value = value;
+			++this->used;
+			return;
+		}
+		if(slot.key == key) {
+			slot.value += value;
+			return;
+		}
 	}
-	return ret;
+}
+
+template<typename Key>
+void counter_table<Key>::replace_smallest(const Key &key, uint64_t value) {
+	if(this->hitters.empty()) {
+		this->hitters.reserve(this->used);
+		for(const_iterator i(this->begin()); i != this->end(); ++i) {
+			const hitter h = {i->value, 0u, i->key};
+			this->hitters.push_back(h);
+		}
+		std::make_heap(this->hitters.begin(), this->hitters.end());
+	}
+	/* Values only grow, so the top is the smallest entry once its
+	 * recorded value is current. */
+	for(;;) {
+		std::pop_heap(this->hitters.begin(), this->hitters.end());
+		hitter &top(this->hitters.back());
+		entry *const slot(this->find(top.key));
+		if(slot->value == top.value) {
+			this->erase(slot);
+			break;
+		}
+		top.value = slot->value;
+		std::push_heap(this->hitters.begin(), this->hitters.end());
+	}
+	hitter &replaced(this->hitters.back());
+	replaced.error = replaced.value;
+	replaced.value += value;
+	replaced.key = key;
+	const uint64_t inherited(replaced.value);
+	std::push_heap(this->hitters.begin(), this->hitters.end());
+	this->insert(key, inherited);
+}
+
+template<typename Key>
+typename counter_table<Key>::entry *counter_table<Key>::find(const Key &key) {
+	for(size_t pos(key.hash() & this->mask);;
+			pos = (pos + 1u) & this->mask) {
+		entry &slot(this->slots[pos]);
+		if(0u == slot.value)
+			return 0;
+		if(slot.key == key)
+			return &slot;
+	}
+}
+
+/**
+ * Remove an entry by moving following entries of the probe sequence back.
+ */
+template<typename Key>
+void counter_table<Key>::erase(entry *slot) {
+	size_t hole(slot - &this->slots.front());
+	for(size_t pos((hole + 1u) & this->mask);
+			0u != this->slots[pos].value;
+			pos = (pos + 1u) & this->mask) {
+		const size_t home(this->slots[pos].key.hash() & this->mask);
+		/* The entry stays if its home lies cyclically in (hole, pos]. */
+		if(((pos - home) & this->mask) < ((pos - hole) & this->mask))
+			continue;
+		this->slots[hole] = this->slots[pos];
+		hole = pos;
+	}
+	this->slots[hole] = entry();
+	--this->used;
+}
+
+template<typename Key>
+void counter_table<Key>::settle() {
+	if(this->hitters.empty())
+		return;
+	uint64_t smallest(std::numeric_limits<uint64_t>::max());
+	for(typename std::vector<hitter>::const_iterator
+			i(this->hitters.begin());
+			i != this->hitters.end(); ++i) {
+		entry *const slot(this->find(i->key));
+		smallest = std::min(smallest, slot->value);
+		slot->value -= i->error;
+		this->rest.bytes += i->error;
+		this->rest.error = std::max(this->rest.error, i->error);
+	}
+	this->rest.threshold = std::max(this->rest.threshold, smallest);
+	this->hitters.clear();
+}
+
+template<typename Key>
+void counter_table<Key>::filter(uint64_t minimum, size_t count,
+		counter_table *carry, const counter_table *carried) {
+	assert(this->hitters.empty());
+	/* Entries equal to the cutoff are kept while ties remain. */
+	uint64_t cutoff(minimum);
+	size_t ties(std::numeric_limits<size_t>::max());
+	if(0u < count && count < this->used) {
+		std::vector<uint64_t> values;
+		values.reserve(this->used);
+		for(const_iterator i(this->begin()); i != this->end(); ++i)
+			values.push_back(i->value);
+		const std::vector<uint64_t>::iterator nth(values.begin() +
+				(count - 1u));
+		std::nth_element(values.begin(), nth, values.end(),
+				std::greater<uint64_t>());
+		if(*nth >= minimum) {
+			cutoff = *nth;
+			ties = count;
+			for(std::vector<uint64_t>::const_iterator
+					i(values.begin()); i != nth; ++i)
+				if(*i > cutoff)
+					--ties;
+		}
+	}
+	std::vector<entry> old(this->slots.size());
+	old.swap(this->slots);
+	this->used = 0u;
+	for(typename std::vector<entry>::const_iterator i(old.begin());
+			i != old.end(); ++i) {
+		if(0u == i->value)
+			continue;
+		if(i->value > cutoff || (i->value == cutoff && 0u < ties)) {
+			if(i->value == cutoff)
+				--ties;
+			this->place(*i);
+			++this->used;
+		} else if(carry && !(carried && carried->contains(i->key)))
+			carry->restore(i->key, i->value);
+		else {
+			this->rest.bytes += i->value;
+			this->rest.threshold = std::max(this->rest.threshold,
+					i->value);
+		}
+	}
+}
+
+template<typename Key>
+void counter_table<Key>::merge(const counter_table &other) {
+	assert(other.hitters.empty());
+	for(const_iterator i(other.begin()); i != other.end(); ++i)
+		this->insert(i->key, i->value);
+	this->additions += other.additions;
+	this->sum += other.sum;
+	this->restored += other.restored;
+	this->rest.bytes += other.rest.bytes;
+	this->rest.error = std::max(this->rest.error, other.rest.error);
+	this->rest.threshold = std::max(this->rest.threshold,
+			other.rest.threshold);
+}
+
+template<typename Key>
+void counter_table<Key>::add_remainder(const remainder_report &other) {
+	this->sum += other.bytes;
+	this->restored += other.bytes;
+	this->rest.bytes += other.bytes;
+	this->rest.error = std::max(this->rest.error, other.error);
+	this->rest.threshold = std::max(this->rest.threshold, other.threshold);
+}
+
+template<typename Key>
+void counter_table<Key>::clear(size_t expected) {
+	const size_t capacity(capacity_for(std::min(expected, this->limit)));
+	if(capacity == this->slots.size())
+		std::fill(this->slots.begin(), this->slots.end(), entry());
+	else
+		std::vector<entry>(capacity).swap(this->slots);
+	this->mask = capacity - 1u;
+	this->used = 0u;
+	this->additions = 0u;
+	this->sum = 0u;
+	this->restored = 0u;
+	this->hitters.clear();
+	this->rest = remainder_report();
+}
+
+template<typename Key>
+nflogipac_counter_keyed<Key>::nflogipac_counter_keyed(size_t cl,
+		unsigned int nm) : nflogipac_counter(cl), active(&tables[0]),
+		retired(&tables[1]), carry(&carries[0]), carried(&carries[1]),
+		minimum(0u), top(0u), carrying(false), region(0), saved(0) {
+	assert(nm <= 8u * Key::size);
+	std::string mask(Key::size, '\xff');
+	applynetmask(mask, nm);
+	this->netmask.read(mask.data());
+}
+
+nflogipac_counter_ipv4::nflogipac_counter_ipv4(size_t cl, unsigned int nm)
+		: nflogipac_counter_keyed<ipv4_key>(std::max((size_t)4, cl),
+				nm) {
+}
+
+void nflogipac_counter_ipv4::count(const char *payload) {
+	const uint64_t totlen(readuint16(payload+2u));
+	ipv4_key addr(this->getaddress(payload));
+	addr.applynetmask(this->netmask);
+	this->active->add(addr, std::max((uint64_t)20u, totlen));
+}
+
+ipv4_key nflogipac_counter_ipv4src::getaddress(const char *payload) const {
+	ipv4_key addr;
+	addr.read(payload+12u);
+	return addr;
+}
+
+ipv4_key nflogipac_counter_ipv4dst::getaddress(const char *payload) const {
+	ipv4_key addr;
+	addr.read(payload+16u);
+	return addr;
 }
 
 nflogipac_counter_ipv6::nflogipac_counter_ipv6(size_t cl, unsigned int nm)
-		: nflogipac_counter(std::max((size_t)6, cl)), netmask(nm) {
-			assert(nm <= 128u);
+		: nflogipac_counter_keyed<ipv6_key>(std::max((size_t)6, cl),
+				nm) {
 }
 
 void nflogipac_counter_ipv6::count(const char *payload) {
 	const uint64_t totlen((uint64_t)40u + (uint64_t)readuint16(payload+4u));
-	std::string addr(this->getaddress(payload));
-	applynetmask(addr, this->netmask);
-	boost::lock_guard<boost::mutex> lock(this->lock);
-	this->counters[addr] += totlen;
+	ipv6_key addr(this->getaddress(payload));
+	addr.applynetmask(this->netmask);
+	this->active->add(addr, totlen);
 }
 
-std::string nflogipac_counter_ipv6src::getaddress(const char *payload) const {
-	return std::string(payload+8u, 16u);
+ipv6_key nflogipac_counter_ipv6src::getaddress(const char *payload) const {
+	ipv6_key addr;
+	addr.read(payload+8u);
+	return addr;
 }
 
-std::string nflogipac_counter_ipv6dst::getaddress(const char *payload) const {
-	return std::string(payload+24u, 16u);
+ipv6_key nflogipac_counter_ipv6dst::getaddress(const char *payload) const {
+	ipv6_key addr;
+	addr.read(payload+24u);
+	return addr;
 }
 
 unsigned int str2int(const std::string &str) {
@@ -369,9 +1291,38 @@ unsigned int str2int(const std::string &str) {
 	return result;
 }
 
-nflogipac_counter *make_counter(const std::string &str) {
-	if(0 == str.compare("ipv4src"))
-		return new nflogipac_counter_ipv4src();
+/**
+ * Parse a comma separated list of numbers.
+ */
+std::vector<unsigned int> str2intlist(const std::string &str) {
+	std::vector<unsigned int> result;
+	std::string::size_type start(0u);
+	for(;;) {
+		const std::string::size_type end(str.find(',', start));
+		result.push_back(str2int(str.substr(start, end - start)));
+		if(std::string::npos == end)
+			return result;
+		start = end + 1u;
+	}
+}
+
+/**
+ * Restrict the given thread to run on a single CPU only.
+ */
+void pin_thread(boost::thread &thread, unsigned int cpu) {
+	if(cpu >= CPU_SETSIZE)
+		throw nflogipac_error("cpu number too large");
+	cpu_set_t cpus;
+	CPU_ZERO(&cpus);
+	CPU_SET(cpu, &cpus);
+	if(0 != pthread_setaffinity_np(thread.native_handle(), sizeof(cpus),
+				&cpus))
+		throw nflogipac_error("pthread_setaffinity_np failed");
+}
+
+nflogipac_counter *make_counter(const std::string &str) {
+	if(0 == str.compare("ipv4src"))
+		return new nflogipac_counter_ipv4src();
 	if(0 == str.compare(0, 8, "ipv4src/"))
 		try {
 			const unsigned int mask(str2int(str.substr(8)));
@@ -417,80 +1368,1049 @@ nflogipac_counter *make_counter(const std::string &str) {
 	return 0;
 }
 
-bool write_count_message(std::ostream &out, const std::string &address,
+template<typename Key>
+bool write_count_message(frame_writer &out, const Key &address,
 		uint64_t value) {
-	char buf[8u];
-	const unsigned int msgsize(2u + 2u + 8u + address.size());
-	if(!writeuint16stream(out, msgsize))
-		return false;
-	if(!writeuint16stream(out, CMD_ACCOUNT))
-		return false;
-#if BYTE_ORDER == LITTLE_ENDIAN
-	std::reverse_copy((const char*)&value, 8u+(const char*)&value, buf);
-#else
-	std::memcpy(buf, &value, 8u)
-#endif
-	if(!out.write(buf, 8u).good())
-		return false;
-	return out.write(address.data(), address.size()).good();
+	char *const data(append_message(out, 2u + 2u + 8u + Key::size,
+				CMD_ACCOUNT));
+	writeuint64(data, value);
+	address.write(data + 8u);
+	return out.good();
+}
+
+/**
+ * Write the entries of the given table as BULK_UPDATE messages. Each message
+ * carries at most BULK_UPDATE_RECORDS entries and is encoded in one piece, so
+ * it must fit into the buffer of the frame_writer.
+ * @param zero is added to the value of the all zero address
+ */
+template<typename Key>
+bool write_bulk_update_messages(frame_writer &out,
+		const counter_table<Key> &table, uint64_t zero) {
+	static const size_t headersize(2u + 2u + 4u + 2u + 2u);
+	const size_t maxrecords(std::min((size_t)BULK_UPDATE_RECORDS,
+				(out.capacity() - headersize) / (8u + Key::size)));
+	assert(maxrecords > 0u);
+	typename counter_table<Key>::const_iterator i(table.begin());
+	for(size_t remaining(table.size()); remaining > 0u;) {
+		const size_t records(std::min(remaining, maxrecords));
+		char *const data(out.append(headersize +
+					records * (8u + Key::size)));
+		writeuint16(data, headersize);
+		writeuint16(data+2u, CMD_BULK_UPDATE);
+		writeuint32(data+4u, records);
+		writeuint16(data+8u, Key::size);
+		writeuint16(data+10u, 0u);
+		char *value(data + headersize);
+		char *address(value + 8u * records);
+		for(size_t j(0u); j < records; ++j, ++i) {
+			writeuint64(value, i->key == Key() ?
+					i->value + zero : i->value);
+			i->key.write(address);
+			value += 8u;
+			address += Key::size;
+		}
+		remaining -= records;
+	}
+	return out.good();
+}
+
+bool write_end_message(frame_writer &out) {
+	append_message(out, 2u + 2u, CMD_END);
+	return out.good();
+}
+
+/**
+ * Packets lost during one accounting interval.
+ */
+struct loss_report {
+	/* number of receive buffer overruns */
+	uint64_t overruns;
+	/* number of lost packets */
+	uint64_t packets;
+	/* estimated number of bytes in the lost packets */
+	uint64_t bytes;
+};
+
+/**
+ * Estimate the loss of an interval. Every overrun loses at least one packet.
+ * The lost packets are assumed to have the average size of the packets
+ * accounted in the given table, not counting values restored from a
+ * checkpoint.
+ * @param overruns is the number of receive buffer overruns
+ * @param missing is the number of packets missing from the sequence numbers
+ */
+template<typename Key>
+loss_report estimate_loss(const counter_table<Key> &table, uint64_t overruns,
+		uint64_t missing) {
+	loss_report loss;
+	loss.overruns = overruns;
+	loss.packets = std::max(overruns, missing);
+	loss.bytes = 0u;
+	if(table.added() > 0u)
+		loss.bytes = (uint64_t)((double)table.counted() /
+				(double)table.added() * (double)loss.packets);
+	return loss;
 }
 
-bool write_end_message(std::ostream &out) {
-	static const unsigned int msgsize(2u + 2u);
-	return writeuint16stream(out, msgsize) && writeuint16stream(out, 2);
+bool write_loss_message(frame_writer &out, uint64_t value) {
+	static const uint64_t uint16max(std::numeric_limits<uint16_t>::max());
+	writeuint16(append_message(out, 2u + 2u + 2u, CMD_LOSS),
+			std::min(value, uint16max));
+	return out.good();
 }
 
-bool write_loss_message(std::ostream &out, unsigned int value) {
-	static const unsigned int msgsize(2u + 2u + 2u),
-		     uint16max(std::numeric_limits<uint16_t>::max());
-	return writeuint16stream(out, msgsize) && writeuint16stream(out, 3u) &&
-		writeuint16stream(out, std::min(value, uint16max));
+bool write_loss64_message(frame_writer &out, const loss_report &loss) {
+	char *const data(append_message(out, 2u + 2u + 3u * 8u, CMD_LOSS64));
+	writeuint64(data, loss.packets);
+	writeuint64(data + 8u, loss.bytes);
+	writeuint64(data + 16u, loss.overruns);
+	return out.good();
 }
 
-bool nflogipac_counter_ipv4::writedata(std::ostream &out) {
-	counter_map_type exportcounters;
-	unsigned int export_packets_lost(0);
-	{
-		boost::lock_guard<boost::mutex>
-			lg(this->lock);
-		/* Fetch and clear counters. */
-		exportcounters.swap(this->counters);
-		std::swap(export_packets_lost, this->packets_lost);
+/**
+ * Size of the counter tables of a group at one snapshot.
+ */
+struct table_report {
+	/* number of addresses counted */
+	uint64_t entries;
+	/* bytes allocated by the tables */
+	uint64_t memory;
+	/* number of bytes counted */
+	uint64_t bytes;
+};
+
+bool write_table_message(frame_writer &out, const table_report &report) {
+	char *const data(append_message(out, 2u + 2u + 3u * 8u, CMD_TABLE));
+	writeuint64(data, report.entries);
+	writeuint64(data + 8u, report.memory);
+	writeuint64(data + 16u, report.bytes);
+	return out.good();
+}
+
+bool write_remainder_message(frame_writer &out,
+		const remainder_report &rest) {
+	char *const data(append_message(out, 2u + 2u + 3u * 8u,
+				CMD_REMAINDER));
+	writeuint64(data, rest.bytes);
+	writeuint64(data + 8u, rest.error);
+	writeuint64(data + 16u, rest.threshold);
+	return out.good();
+}
+
+/**
+ * Write a settled table. Readers below level 4 receive the remainder as
+ * traffic of the all zero address. It is added to the entry of that address
+ * if there is one, so every address is still reported at most once.
+ */
+template<typename Key>
+bool write_table(frame_writer &out, unsigned int level,
+		const counter_table<Key> &table, const loss_report &loss) {
+	if(loss.packets > 0u) {
+		if(level >= 2u) {
+			if(!write_loss64_message(out, loss))
+				return false;
+		} else if(!write_loss_message(out, loss.packets))
+			return false;
 	}
-	if(export_packets_lost > 0)
-		if(!write_loss_message(out, export_packets_lost))
+	const remainder_report &rest(table.remainder());
+	uint64_t zero(0u);
+	if(rest.bytes > 0u) {
+		if(level >= 4u) {
+			if(!write_remainder_message(out, rest))
+				return false;
+		} else if(table.contains(Key()))
+			zero = rest.bytes;
+		else if(!write_count_message(out, Key(), rest.bytes))
 			return false;
-	for(counter_map_type::iterator i(exportcounters.begin());
-				i != exportcounters.end(); ++i)
-		if(!write_count_message(out, i->first, i->second))
+	}
+	if(level >= 1u)
+		return write_bulk_update_messages(out, table, zero);
+	for(typename counter_table<Key>::const_iterator i(table.begin());
+			i != table.end(); ++i)
+		if(!write_count_message(out, i->key, i->key == Key() ?
+					i->value + zero : i->value))
 			return false;
-	return write_end_message(out) && out.flush().good();
+	return true;
+}
+
+/**
+ * Layout of the start of a shared memory file. All integers are in host byte
+ * order. It is followed by capacity many 64bit byte counts and capacity many
+ * addresses of address_length bytes each.
+ */
+struct shared_header {
+	char magic[8];
+	uint32_t version;
+	uint16_t group;
+	uint16_t address_length;
+	/* odd while the writer is modifying the file */
+	volatile uint64_t sequence;
+	uint64_t capacity;
+	uint64_t records;
+	/* number of completed report periods */
+	uint64_t generation;
+	/* start of the report period and time of the last update in
+	 * microseconds since the epoch */
+	uint64_t started;
+	uint64_t updated;
+	/* bytes of the report period not attributed to a listed address */
+	uint64_t unlisted;
+	char reserved[56];
+};
+
+inline uint64_t now_microseconds() {
+	struct timeval tv;
+	gettimeofday(&tv, 0);
+	return (uint64_t)tv.tv_sec * 1000000u + (uint64_t)tv.tv_usec;
 }
 
-bool nflogipac_counter_ipv6::writedata(std::ostream &out) {
-	counter_map_type exportcounters;
-	unsigned int export_packets_lost(0);
-	{
-		boost::lock_guard<boost::mutex>
-			lg(this->lock);
-		/* Fetch and clear counters. */
-		exportcounters.swap(this->counters);
-		std::swap(export_packets_lost, this->packets_lost);
+/**
+ * A shared memory file holding the running totals of a counter. Readers
+ * follow the sequence number of the header like a seqlock.
+ */
+class shared_region {
+	private:
+		shared_header *header;
+		uint64_t *values;
+		char *addresses;
+		size_t length;
+	public:
+		/**
+		 * Create a file at the given path. An existing file is
+		 * replaced atomically, so readers never see a partial one.
+		 * @throws nflogipac_error
+		 */
+		shared_region(const std::string &path, uint16_t group,
+				size_t addrlen, size_t capacity);
+		~shared_region();
+		/**
+		 * Replace the published totals.
+		 * @param restart is whether a new report period starts
+		 *        afterwards
+		 */
+		template<typename Key> void publish(
+				const counter_table<Key> &table, bool restart);
+};
+
+shared_region::shared_region(const std::string &path, uint16_t group,
+		size_t addrlen, size_t capacity)
+		: length(sizeof(shared_header) + capacity * (8u + addrlen)) {
+	const std::string temporary(path + ".new");
+	const int fd(::open(temporary.c_str(), O_RDWR | O_CREAT | O_TRUNC,
+				0644));
+	if(fd < 0)
+		throw nflogipac_error("cannot create shared memory file");
+	if(ftruncate(fd, this->length) < 0) {
+		close(fd);
+		throw nflogipac_error("cannot resize shared memory file");
+	}
+	void *const base(mmap(0, this->length, PROT_READ | PROT_WRITE,
+				MAP_SHARED, fd, 0));
+	close(fd);
+	if(MAP_FAILED == base)
+		throw nflogipac_error("cannot map shared memory file");
+	this->header = (shared_header*)base;
+	this->values = (uint64_t*)(this->header + 1);
+	this->addresses = (char*)(this->values + capacity);
+	std::memcpy(this->header->magic, "nflogipa", 8u);
+	this->header->version = 1u;
+	this->header->group = group;
+	this->header->address_length = addrlen;
+	this->header->capacity = capacity;
+	this->header->started = this->header->updated = now_microseconds();
+	if(rename(temporary.c_str(), path.c_str()) < 0) {
+		munmap(base, this->length);
+		throw nflogipac_error("cannot rename shared memory file");
+	}
+}
+
+shared_region::~shared_region() {
+	munmap(this->header, this->length);
+}
+
+template<typename Key>
+void shared_region::publish(const counter_table<Key> &table, bool restart) {
+	shared_header &h(*this->header);
+	++h.sequence;
+	__sync_synchronize();
+	uint64_t records(0u), listed(0u);
+	for(typename counter_table<Key>::const_iterator i(table.begin());
+			i != table.end() && records < h.capacity;
+			++i, ++records) {
+		this->values[records] = i->value;
+		i->key.write(this->addresses + records * Key::size);
+		listed += i->value;
+	}
+	h.records = records;
+	h.unlisted = table.total() - listed;
+	h.updated = now_microseconds();
+	if(restart) {
+		++h.generation;
+		h.started = h.updated;
 	}
-	if(export_packets_lost > 0)
-		if(!write_loss_message(out, export_packets_lost))
+	__sync_synchronize();
+	++h.sequence;
+}
+
+/**
+ * Layout of the start of a checkpoint file. All integers are in host byte
+ * order. It is followed by two slots of a checkpoint_slot, capacity many
+ * 64bit byte counts and capacity many addresses of address_length bytes each.
+ */
+struct checkpoint_header {
+	char magic[8];
+	uint32_t version;
+	uint16_t group;
+	uint16_t address_length;
+	uint64_t capacity;
+	/* number of the last complete checkpoint, which is in slot
+	 * serial % 2, or 0 if there is none */
+	volatile uint64_t serial;
+	char reserved[32];
+};
+
+struct checkpoint_slot {
+	/* number of the checkpoint, written after its records */
+	uint64_t serial;
+	uint64_t records;
+	remainder_report rest;
+	char reserved[24];
+};
+
+/**
+ * A memory mapped file holding the running totals of a counter not exported
+ * yet. Each checkpoint is written to the slot not holding the last complete
+ * one and committed by updating the serial of the header, so a counter dying
+ * at any time leaves a complete checkpoint behind.
+ */
+class checkpoint_file {
+	private:
+		const std::string path;
+		const uint16_t group;
+		const size_t addrlen;
+		checkpoint_header *header;
+		size_t length;
+		/* whether the mapped file still needs to be renamed to path */
+		bool pending;
+		size_t slot_length(size_t capacity) const {
+			return sizeof(checkpoint_slot) +
+				capacity * (8u + this->addrlen);
+		}
+		checkpoint_slot *slot(uint64_t serial) const {
+			return (checkpoint_slot*)((char*)(this->header + 1) +
+					(serial % 2u) *
+					this->slot_length(
+						this->header->capacity));
+		}
+		/**
+		 * Map an empty file at the given path instead of the
+		 * current one.
+		 * @throws nflogipac_error
+		 */
+		void create(const std::string &file, size_t capacity,
+				uint64_t serial);
+	public:
+		/**
+		 * Open the file at the given path or create it.
+		 * @throws nflogipac_error if the file exists but was not
+		 *         written by a counter of the same group and address
+		 *         length
+		 */
+		checkpoint_file(const std::string &path, uint16_t group,
+				size_t addrlen);
+		~checkpoint_file();
+		/**
+		 * Add the last complete checkpoint to a table.
+		 * @returns the number of bytes added
+		 */
+		template<typename Key> uint64_t recover(
+				counter_table<Key> &table) const;
+		/**
+		 * Write a checkpoint of the entries of two settled tables.
+		 * The file grows as needed.
+		 * @returns whether the checkpoint was committed to the file
+		 *          at path
+		 */
+		template<typename Key> bool save(const counter_table<Key> &first,
+				const counter_table<Key> &second);
+};
+
+checkpoint_file::checkpoint_file(const std::string &p, uint16_t g, size_t al)
+		: path(p), group(g), addrlen(al), header(0), length(0u),
+		pending(false) {
+	const int fd(::open(path.c_str(), O_RDWR));
+	if(fd < 0) {
+		if(ENOENT != errno)
+			throw nflogipac_error("cannot open checkpoint file");
+		this->create(this->path + ".new", 4096u, 0u);
+		if(rename((this->path + ".new").c_str(),
+					this->path.c_str()) < 0)
+			throw nflogipac_error("cannot rename checkpoint file");
+		return;
+	}
+	struct stat st;
+	if(fstat(fd, &st) < 0 || st.st_size < (off_t)sizeof(checkpoint_header)) {
+		close(fd);
+		throw nflogipac_error("checkpoint file is too short");
+	}
+	void *const base(mmap(0, st.st_size, PROT_READ | PROT_WRITE,
+				MAP_SHARED, fd, 0));
+	close(fd);
+	if(MAP_FAILED == base)
+		throw nflogipac_error("cannot map checkpoint file");
+	this->header = (checkpoint_header*)base;
+	this->length = st.st_size;
+	const checkpoint_header &h(*this->header);
+	const char *problem(0);
+	if(0 != std::memcmp(h.magic, "nflogick", 8u) || 1u != h.version)
+		problem = "not a checkpoint file";
+	else if(h.group != this->group ||
+			h.address_length != this->addrlen)
+		problem = "checkpoint file of another counter";
+	else if(h.capacity > (this->length - sizeof(checkpoint_header)) /
+			(2u * (8u + this->addrlen)) || this->length !=
+			sizeof(checkpoint_header) +
+			2u * this->slot_length(h.capacity))
+		problem = "checkpoint file is truncated";
+	if(problem) {
+		munmap(base, this->length);
+		this->header = 0;
+		throw nflogipac_error(problem);
+	}
+}
+
+checkpoint_file::~checkpoint_file() {
+	if(this->header)
+		munmap(this->header, this->length);
+}
+
+void checkpoint_file::create(const std::string &file, size_t capacity,
+		uint64_t serial) {
+	const size_t length(sizeof(checkpoint_header) +
+			2u * this->slot_length(capacity));
+	const int fd(::open(file.c_str(), O_RDWR | O_CREAT | O_TRUNC, 0600));
+	if(fd < 0)
+		throw nflogipac_error("cannot create checkpoint file");
+	if(ftruncate(fd, length) < 0) {
+		close(fd);
+		throw nflogipac_error("cannot resize checkpoint file");
+	}
+	void *const base(mmap(0, length, PROT_READ | PROT_WRITE, MAP_SHARED,
+				fd, 0));
+	close(fd);
+	if(MAP_FAILED == base)
+		throw nflogipac_error("cannot map checkpoint file");
+	if(this->header)
+		munmap(this->header, this->length);
+	this->header = (checkpoint_header*)base;
+	this->length = length;
+	std::memcpy(this->header->magic, "nflogick", 8u);
+	this->header->version = 1u;
+	this->header->group = this->group;
+	this->header->address_length = this->addrlen;
+	this->header->capacity = capacity;
+	this->header->serial = serial;
+}
+
+template<typename Key>
+uint64_t checkpoint_file::recover(counter_table<Key> &table) const {
+	const uint64_t serial(this->header->serial);
+	if(0u == serial)
+		return 0u;
+	const checkpoint_slot &s(*this->slot(serial));
+	if(s.serial != serial || s.records > this->header->capacity)
+		return 0u;
+	const uint64_t *const values((const uint64_t*)(&s + 1));
+	const char *const addresses((const char*)(values +
+				this->header->capacity));
+	const uint64_t before(table.total());
+	Key key;
+	for(uint64_t i(0u); i < s.records; ++i) {
+		key.read(addresses + i * Key::size);
+		table.restore(key, values[i]);
+	}
+	table.add_remainder(s.rest);
+	return table.total() - before;
+}
+
+template<typename Key>
+bool checkpoint_file::save(const counter_table<Key> &first,
+		const counter_table<Key> &second) {
+	const size_t records(first.size() + second.size());
+	if(records > this->header->capacity) {
+		try {
+			this->create(this->path + ".new",
+					std::max(records, 2u *
+						(size_t)this->header->capacity),
+					this->header->serial);
+		} catch(nflogipac_error &) {
 			return false;
-	for(counter_map_type::iterator i(exportcounters.begin());
-				i != exportcounters.end(); ++i)
-		if(!write_count_message(out, i->first, i->second))
+		}
+		this->pending = true;
+	}
+	const uint64_t serial(this->header->serial + 1u);
+	checkpoint_slot &s(*this->slot(serial));
+	uint64_t *const values((uint64_t*)(&s + 1));
+	char *const addresses((char*)(values + this->header->capacity));
+	const counter_table<Key> *const tables[2] = {&first, &second};
+	remainder_report rest = {0u, 0u, 0u};
+	uint64_t written(0u);
+	for(unsigned int t(0u); t < 2u; ++t) {
+		for(typename counter_table<Key>::const_iterator
+				i(tables[t]->begin()); i != tables[t]->end();
+				++i, ++written) {
+			values[written] = i->value;
+			i->key.write(addresses + written * Key::size);
+		}
+		rest.bytes += tables[t]->remainder().bytes;
+		rest.error = std::max(rest.error, tables[t]->remainder().error);
+		rest.threshold = std::max(rest.threshold,
+				tables[t]->remainder().threshold);
+	}
+	s.records = written;
+	s.rest = rest;
+	__sync_synchronize();
+	s.serial = serial;
+	__sync_synchronize();
+	this->header->serial = serial;
+	if(this->pending) {
+		if(rename((this->path + ".new").c_str(),
+					this->path.c_str()) < 0)
 			return false;
-	return write_end_message(out) && out.flush().good();
+		this->pending = false;
+	}
+	return true;
+}
+
+bool write_group_message(frame_writer &out, uint16_t group) {
+	writeuint16(append_message(out, 2u + 2u + 2u, CMD_GROUP), group);
+	return out.good();
+}
+
+template<typename Key>
+nflogipac_counter_keyed<Key>::~nflogipac_counter_keyed() {
+	delete this->region;
+	delete this->saved;
+}
+
+template<typename Key>
+bool nflogipac_counter_keyed<Key>::attach(nflogipac_counter *shard) {
+	nflogipac_counter_keyed *const keyed(
+			dynamic_cast<nflogipac_counter_keyed*>(shard));
+	if(0 == keyed || keyed->caplen != this->caplen)
+		return false;
+	this->shards.push_back(keyed);
+	return true;
+}
+
+template<typename Key>
+void nflogipac_counter_keyed<Key>::limit_entries(size_t entries) {
+	this->tables[0].set_limit(entries);
+	this->tables[1].set_limit(entries);
+	this->accumulated.set_limit(entries);
+}
+
+template<typename Key>
+void nflogipac_counter_keyed<Key>::filter_entries(uint64_t minimum,
+		size_t count, bool carry) {
+	this->minimum = minimum;
+	this->top = count;
+	this->carrying = carry;
+}
+
+template<typename Key>
+void nflogipac_counter_keyed<Key>::share(const std::string &path,
+		uint16_t group, size_t capacity) {
+	assert(!this->region);
+	this->region = new shared_region(path, group, Key::size, capacity);
+}
+
+template<typename Key>
+void nflogipac_counter_keyed<Key>::publish() {
+	if(!this->region && !this->saved)
+		return;
+	this->retire();
+	const size_t entries(this->retired->size());
+	this->collect();
+	this->accumulated.merge(*this->retired);
+	this->accumulated.settle();
+	this->retired->clear(entries);
+	if(this->region)
+		this->region->publish(this->accumulated, false);
+	if(this->saved && !this->saved->save(this->accumulated,
+				*this->carried))
+		std::cerr << "warning: cannot write checkpoint file"
+			<< std::endl;
 }
 
-int reportloop(nflogipac_counter *counter) {
+template<typename Key>
+uint64_t nflogipac_counter_keyed<Key>::checkpoint(const std::string &path,
+		uint16_t group) {
+	assert(!this->saved);
+	this->saved = new checkpoint_file(path, group, Key::size);
+	const uint64_t recovered(this->saved->recover(this->accumulated));
+	this->accumulated.settle();
+	return recovered;
+}
+
+template<typename Key>
+void nflogipac_counter_keyed<Key>::collect() {
+	this->wait_for_batch();
+	for(typename std::vector<nflogipac_counter_keyed*>::const_iterator
+			i(this->shards.begin()); i != this->shards.end(); ++i) {
+		(*i)->wait_for_batch();
+		(*i)->retired->settle();
+		this->retired->merge(*(*i)->retired);
+		(*i)->retired->clear((*i)->retired->size());
+	}
+	this->retired->settle();
+}
+
+template<typename Key>
+void nflogipac_counter_keyed<Key>::retire() {
+	this->retired = this->active;
+	(void)__sync_lock_test_and_set(&this->active,
+			this->retired == &this->tables[0] ?
+			&this->tables[1] : &this->tables[0]);
+	for(typename std::vector<nflogipac_counter_keyed*>::const_iterator
+			i(this->shards.begin()); i != this->shards.end(); ++i)
+		(*i)->retire();
+}
+
+template<typename Key>
+bool nflogipac_counter_keyed<Key>::writedata(frame_writer &out,
+		unsigned int level) {
+	assert(this->retired != this->active);
+	const size_t entries(this->retired->size());
+	this->collect();
+	uint64_t overruns(this->fetch_packets_lost()),
+		 missing(this->fetch_missing_packets());
+	for(typename std::vector<nflogipac_counter_keyed*>::const_iterator
+			i(this->shards.begin()); i != this->shards.end(); ++i) {
+		overruns += (*i)->fetch_packets_lost();
+		missing += (*i)->fetch_missing_packets();
+	}
+	if(this->region || this->saved) {
+		this->retired->merge(this->accumulated);
+		this->retired->settle();
+		this->accumulated.clear(this->accumulated.size());
+	}
+	const loss_report loss(estimate_loss(*this->retired, overruns,
+				missing));
+	table_report report;
+	report.entries = this->retired->size();
+	report.bytes = this->retired->total();
+	size_t retired(this->retired->memory());
+	for(typename std::vector<nflogipac_counter_keyed*>::const_iterator
+			i(this->shards.begin()); i != this->shards.end(); ++i)
+		retired += (*i)->retired->memory();
+	/* The tables the receiving threads count into are about as large
+	 * as the retired ones. */
+	report.memory = 2u * retired + this->accumulated.memory() +
+		this->carries[0].memory() + this->carries[1].memory();
+	if(0u < this->minimum || 0u < this->top) {
+		if(0u < this->carried->size()) {
+			this->retired->merge(*this->carried);
+			this->retired->settle();
+		}
+		this->retired->filter(this->minimum, this->top,
+				this->carrying ? this->carry : 0, this->carried);
+		std::swap(this->carry, this->carried);
+		this->carry->clear(this->carried->size());
+	}
+	const bool ret(write_table(out, level, *this->retired, loss) &&
+			(level < 5u || write_table_message(out, report)));
+	/* Keep the snapshot in the checkpoint if it could not be
+	 * written. Otherwise only the carried addresses are left. */
+	if(this->saved && !this->saved->save(ret ? this->accumulated :
+				*this->retired, *this->carried))
+		std::cerr << "warning: cannot write checkpoint file"
+			<< std::endl;
+	this->retired->clear(entries);
+	if(this->region)
+		this->region->publish(this->accumulated, true);
+	return ret;
+}
+
+/* The counters of all groups of a process in command line order. */
+typedef std::vector<std::pair<uint16_t, nflogipac_counter*> > counter_list;
+
+inline uint64_t monotonic_milliseconds() {
+	struct timespec ts;
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return (uint64_t)ts.tv_sec * 1000u + (uint64_t)ts.tv_nsec / 1000000u;
+}
+
+inline double monotonic_seconds() {
+	struct timespec ts;
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+/**
+ * Packets to replay into a counter. Like the kernel does for the counter,
+ * every packet is truncated to caplen bytes.
+ */
+struct packet_trace {
+	const size_t caplen;
+	/* the packets padded to caplen bytes each */
+	std::vector<char> data;
+	/* the number of bytes of each packet up to caplen */
+	std::vector<uint16_t> lengths;
+	explicit packet_trace(size_t cl) : caplen(cl) {}
+	size_t size() const { return this->lengths.size(); }
+	const char *packet(size_t index) const {
+		return &this->data[index * this->caplen];
+	}
+	void push_back(const char *packet, size_t length) {
+		length = std::min(length, this->caplen);
+		this->data.insert(this->data.end(), packet, packet + length);
+		this->data.resize(this->data.size() + this->caplen - length);
+		this->lengths.push_back(length);
+	}
+};
+
+/* pcap link types of interest */
+#define LINKTYPE_ETHERNET 1u
+#define LINKTYPE_RAW 101u
+#define LINKTYPE_LINUX_SLL 113u
+#define LINKTYPE_IPV4 228u
+#define LINKTYPE_IPV6 229u
+#define LINKTYPE_NFLOG 239u
+
+/* attribute type of the packet in LINKTYPE_NFLOG records */
+#define NFLOG_TLV_PAYLOAD 9u
+
+/**
+ * Find the IP packet in a record of a pcap file.
+ * @param swapped is whether the file was written in the other byte order
+ * @returns the start of the IP packet or 0
+ */
+const char *pcap_ip_packet(uint32_t linktype, bool swapped, const char *data,
+		size_t &length) {
+	size_t offset(0u);
+	switch(linktype) {
+		case LINKTYPE_RAW:
+		case LINKTYPE_IPV4:
+		case LINKTYPE_IPV6:
+			break;
+		case LINKTYPE_ETHERNET:
+			offset = 12u;
+			/* skip 802.1Q and 802.1ad tags */
+			while(offset + 2u <= length &&
+					(0x8100u == readuint16(data + offset) ||
+					 0x88a8u == readuint16(data + offset)))
+				offset += 4u;
+			offset += 2u;
+			break;
+		case LINKTYPE_LINUX_SLL:
+			offset = 16u;
+			break;
+		case LINKTYPE_NFLOG:
+			/* family, version and resource id followed by type
+			 * length value attributes in the byte order of the
+			 * file */
+			for(offset = 4u; offset + 4u <= length;) {
+				uint16_t tlvlength, tlvtype;
+				std::memcpy(&tlvlength, data + offset, 2u);
+				std::memcpy(&tlvtype, data + offset + 2u, 2u);
+				if(swapped) {
+					tlvlength = bswap_16(tlvlength);
+					tlvtype = bswap_16(tlvtype);
+				}
+				if(tlvlength < 4u || offset + tlvlength > length)
+					return 0;
+				if(NFLOG_TLV_PAYLOAD == tlvtype) {
+					length = tlvlength - 4u;
+					return data + offset + 4u;
+				}
+				offset += (tlvlength + 3u) & ~3u;
+			}
+			return 0;
+		default:
+			return 0;
+	}
+	if(offset >= length)
+		return 0;
+	length -= offset;
+	return data + offset;
+}
+
+/**
+ * Add the packets of the given IP version of a pcap file to a trace.
+ * @throws nflogipac_error
+ */
+void read_pcap(const std::string &path, unsigned int version,
+		packet_trace &trace) {
+	std::ifstream in(path.c_str(), std::ios::in | std::ios::binary);
+	if(!in)
+		throw nflogipac_error("cannot open pcap file");
+	char header[24];
+	if(!in.read(header, sizeof(header)))
+		throw nflogipac_error("pcap file too short");
+	uint32_t magic, linktype, snaplen;
+	std::memcpy(&magic, header, 4u);
+	std::memcpy(&snaplen, header + 16u, 4u);
+	std::memcpy(&linktype, header + 20u, 4u);
+	bool swapped(false);
+	if(0xd4c3b2a1u == magic || 0x4d3cb2a1u == magic) {
+		swapped = true;
+		snaplen = bswap_32(snaplen);
+		linktype = bswap_32(linktype);
+	} else if(0xa1b2c3d4u != magic && 0xa1b23c4du != magic)
+		throw nflogipac_error("not a pcap file");
+	/* the upper bits hold the FCS length */
+	linktype &= 0xffffu;
+	switch(linktype) {
+		case LINKTYPE_ETHERNET:
+		case LINKTYPE_RAW:
+		case LINKTYPE_LINUX_SLL:
+		case LINKTYPE_IPV4:
+		case LINKTYPE_IPV6:
+		case LINKTYPE_NFLOG:
+			break;
+		default:
+			throw nflogipac_error("unsupported pcap link type");
+	}
+	std::vector<char> record(std::max(snaplen, 65536u));
+	char recordheader[16];
+	while(in.read(recordheader, sizeof(recordheader))) {
+		uint32_t captured;
+		std::memcpy(&captured, recordheader + 8u, 4u);
+		if(swapped)
+			captured = bswap_32(captured);
+		if(captured > record.size())
+			record.resize(captured);
+		if(!in.read(&record[0], captured))
+			throw nflogipac_error("truncated pcap file");
+		size_t length(captured);
+		const char *const packet(pcap_ip_packet(linktype, swapped,
+					&record[0], length));
+		if(packet && 0u < length &&
+				version == ((unsigned char)packet[0] >> 4))
+			trace.push_back(packet, length);
+	}
+	if(!in.eof())
+		throw nflogipac_error("cannot read pcap file");
+}
+
+/**
+ * Distributions of the addresses of generated packets.
+ */
+enum address_distribution {
+	/* every packet has one of the addresses chosen at random */
+	DISTRIBUTION_UNIFORM,
+	/* the n-th most frequent address has a share proportional to 1/n */
+	DISTRIBUTION_ZIPF,
+	/* the addresses occur in turn like during a scan of a network */
+	DISTRIBUTION_SCAN
+};
+
+/**
+ * Parse the specification of generated packets given to -G.
+ * @param str is "packets,addresses[,uniform|zipf|scan]"
+ * @throws nflogipac_error
+ */
+void parse_generator(const std::string &str, unsigned int &packets,
+		unsigned int &addresses, address_distribution &distribution) {
+	const std::string::size_type first(str.find(',')),
+		second(str.find(',', first + 1u));
+	if(std::string::npos == first)
+		throw nflogipac_error("missing number of addresses");
+	packets = str2int(str.substr(0u, first));
+	addresses = str2int(str.substr(first + 1u, second - first - 1u));
+	if(0u == packets || 0u == addresses)
+		throw nflogipac_error("numbers must be positive");
+	const std::string name(std::string::npos == second ? "uniform" :
+			str.substr(second + 1u));
+	if("uniform" == name)
+		distribution = DISTRIBUTION_UNIFORM;
+	else if("zipf" == name)
+		distribution = DISTRIBUTION_ZIPF;
+	else if("scan" == name)
+		distribution = DISTRIBUTION_SCAN;
+	else
+		throw nflogipac_error("unknown distribution");
+}
+
+/**
+ * Write the n-th generated address. IPv4 addresses lie in 10.0.0.0/8 with 256
+ * consecutive ones per /24 and IPv6 addresses lie in 2001:db8::/32 with 16
+ * per /64, so netmasks aggregate them.
+ */
+void generated_address(char *data, unsigned int version, uint64_t n) {
+	if(4u == version)
+		writeuint32(data, 0x0a000000u | (((n >> 8) * 40503u) &
+					0xffffu) << 8 | (n & 0xffu));
+	else {
+		writeuint32(data, 0x20010db8u);
+		writeuint32(data + 4u, (n >> 4) * 2654435761u);
+		writeuint64(data + 8u, mix64(n));
+	}
+}
+
+/* Number of distinct packets generated for -G unless there are more
+ * addresses. Longer replays start over. */
+#define GENERATED_PACKETS (1u << 20)
+
+/**
+ * Add generated packets to a trace. The addresses are the source and the
+ * destination address alike.
+ * @throws nflogipac_error if there are more addresses than can be generated
+ */
+void generate_packets(unsigned int version, size_t packets,
+		unsigned int addresses, address_distribution distribution,
+		packet_trace &trace) {
+	if(4u == version && addresses > 1u << 24)
+		throw nflogipac_error("at most 16777216 IPv4 addresses");
+	std::vector<double> cumulative;
+	if(DISTRIBUTION_ZIPF == distribution) {
+		cumulative.resize(addresses);
+		double sum(0.0);
+		for(unsigned int i(0u); i < addresses; ++i)
+			cumulative[i] = sum += 1.0 / (i + 1u);
+	}
+	const size_t headerlen(4u == version ? 20u : 40u),
+	      addroffset(4u == version ? 12u : 8u), addrlen(4u == version ?
+			      4u : 16u);
+	std::vector<char> header(headerlen);
+	header[0] = version << 4;
+	trace.data.reserve(trace.data.size() + packets * trace.caplen);
+	trace.lengths.reserve(trace.lengths.size() + packets);
+	for(size_t i(0u); i < packets; ++i) {
+		const uint64_t random(mix64(i));
+		uint64_t n;
+		switch(distribution) {
+			case DISTRIBUTION_UNIFORM:
+				n = random % addresses;
+				break;
+			case DISTRIBUTION_ZIPF:
+				n = std::lower_bound(cumulative.begin(),
+						cumulative.end(),
+						(random >> 11) / 9007199254740992.0 *
+						cumulative.back()) -
+					cumulative.begin();
+				n = std::min(n, (uint64_t)addresses - 1u);
+				break;
+			default:
+				n = i % addresses;
+		}
+		/* a mix of small and full size packets */
+		const unsigned int length(random & 0x1000000u ?
+				40u + (random >> 32) % 100u : 1500u);
+		if(4u == version)
+			writeuint16(&header[2], length);
+		else
+			writeuint16(&header[4], length - 40u);
+		generated_address(&header[addroffset], version, n);
+		generated_address(&header[addroffset + addrlen], version, n);
+		trace.push_back(&header[0], headerlen);
+	}
+}
+
+/**
+ * Replays a trace into a counter at full speed. The packets are counted in
+ * batches like the datagrams read from a netlink socket.
+ */
+class replay_source : public packet_source {
+	private:
+		const uint16_t group;
+		const packet_trace &trace;
+		const uint64_t packets;
+		const unsigned int batch;
+	public:
+		/**
+		 * @param packets is the number of packets to replay,
+		 *        starting over at the start of the trace as needed
+		 * @param batch is the number of packets per batch
+		 */
+		replay_source(uint16_t g, nflogipac_counter *c,
+				const packet_trace &t, uint64_t p,
+				unsigned int b);
+		void open();
+		/**
+		 * Count all packets.
+		 * @returns the elapsed time in seconds
+		 */
+		double replay();
+		/**
+		 * Count all packets and report the packet rate on stderr.
+		 */
+		void run();
+};
+
+replay_source::replay_source(uint16_t g, nflogipac_counter *c,
+		const packet_trace &t, uint64_t p, unsigned int b)
+		: packet_source(c), group(g), trace(t), packets(p), batch(b) {
+	assert(b > 0u);
+}
+
+void replay_source::open() {
+	if(0u == this->trace.size())
+		throw nflogipac_error("no packets to replay");
+	if(this->trace.caplen != this->counter->caplen)
+		throw nflogipac_error("trace of a different counter");
+}
+
+double replay_source::replay() {
+	const double start(monotonic_seconds());
+	size_t next(0u);
+	for(uint64_t remaining(this->packets); remaining > 0u;) {
+		const size_t end(std::min(this->trace.size(), next +
+					(size_t)std::min(remaining,
+						(uint64_t)this->batch)));
+		this->counter->begin_batch();
+		for(size_t i(next); i < end; ++i)
+			this->count(this->trace.packet(i),
+					this->trace.lengths[i]);
+		this->counter->end_batch();
+		remaining -= end - next;
+		next = end == this->trace.size() ? 0u : end;
+	}
+	return monotonic_seconds() - start;
+}
+
+void replay_source::run() {
+	const double elapsed(this->replay());
+	std::cerr << "group " << this->group << ": replayed "
+		<< this->packets << " packets in " << elapsed << "s ("
+		<< (uint64_t)(this->packets / elapsed) << " packets/s)"
+		<< std::endl;
+}
+
+/**
+ * Answer snapshot requests read from stdin for all given counters. The tables
+ * of all counters are retired before exporting any of them, so every request
+ * cuts all groups at the same time.
+ * @param period is the interval in milliseconds at which the counters publish
+ *        their running totals or option_unset
+ */
+int reportloop(const counter_list &counters, unsigned int period) {
+	frame_writer out(STDOUT_FILENO);
+	uint64_t deadline(monotonic_milliseconds() + period);
 	for(;;) {
+		char buf;
+		if(option_unset != period) {
+			const uint64_t now(monotonic_milliseconds());
+			if(now >= deadline) {
+				for(counter_list::const_iterator
+						i(counters.begin());
+						i != counters.end(); ++i)
+					i->second->publish();
+				deadline = now + period;
+				continue;
+			}
+			struct pollfd pfd;
+			pfd.fd = STDIN_FILENO;
+			pfd.events = POLLIN;
+			const int r(poll(&pfd, 1, deadline - now));
+			if(r < 0 && EINTR != errno)
+				return 1;
+			if(r <= 0)
+				continue;
+		}
 		{
-			char buf;
 			/* Use read to avoid buffered IO. */
 			int r(read(STDIN_FILENO, &buf, 1));
 			/* r == 0: EOF => terminate cleanly
@@ -498,46 +2418,431 @@ int reportloop(nflogipac_counter *counter) {
 			if(1 > r)
 				return r < 0 ? 1 : 0;
 		}
-		if(!counter->writedata(std::cout))
+		/* A digit requests the protocol extensions up to that level.
+		 * The corresponding letter additionally marks the last
+		 * request, which must not leave traffic in a carry. */
+		unsigned int level(0u);
+		if('0' <= buf && buf <= '9')
+			level = std::min((unsigned int)(buf - '0'), PROTOCOL_LEVEL);
+		else if('a' <= buf && buf <= 'j') {
+			level = std::min((unsigned int)(buf - 'a'), PROTOCOL_LEVEL);
+			for(counter_list::const_iterator i(counters.begin());
+					i != counters.end(); ++i)
+				i->second->stop_carrying();
+		}
+		for(counter_list::const_iterator i(counters.begin());
+				i != counters.end(); ++i)
+			i->second->retire();
+		for(counter_list::const_iterator i(counters.begin());
+				i != counters.end(); ++i) {
+			if(level >= 3u && !write_group_message(out, i->first))
+				return 1;
+			if(!i->second->writedata(out, level))
+				return 1;
+		}
+		if(!write_end_message(out) || !out.flush())
 			return 1;
 	}
 }
 
-int main(int argc, char **argv) {
-	if(3 != argc) {
-		std::cerr << "takes precisely 2 arguments: group counter"
-			<< std::endl
-			<< "group is the netlink group number" << std::endl
-			<< "counter is one out of ipv[46]{src,dst} with an "
-			<< "optional netmask"
+#ifndef NFLOGIPAC_NO_MAIN
+void usage() {
+	std::cerr << "usage: nflogipacd [options] group counter "
+		<< "[[options] group counter ...]" << std::endl
+		<< "group is the netlink group number" << std::endl
+		<< "counter is one out of ipv[46]{src,dst} with an "
+		<< "optional netmask" << std::endl
+		<< "options apply to the group following them:" << std::endl
+		<< " -r bytes  receive buffer size of the netlink socket"
+		<< std::endl
+		<< " -b bytes  buffer size for a single netlink datagram"
+		<< std::endl
+		<< " -m count  maximum number of datagrams received with a "
+		<< "single system call" << std::endl
+		<< " -q count  number of packets the kernel queues before "
+		<< "sending a datagram" << std::endl
+		<< " -t time   time in 1/100s after which the kernel sends a "
+		<< "partial datagram" << std::endl
+		<< " -n bytes  size of the kernel buffer for a datagram"
+		<< std::endl
+		<< " -S group  additional netlink group counted as a shard of "
+		<< "the group by its" << std::endl
+		<< "           own receiving thread (repeatable)" << std::endl
+		<< " -c cpus   comma separated CPUs the receiving threads of "
+		<< "the group and its" << std::endl
+		<< "           shards are pinned to in turn" << std::endl
+		<< " -H count  maximum number of addresses per snapshot, only "
+		<< "the heaviest are" << std::endl
+		<< "           kept and the others are reported as remainder"
+		<< std::endl
+		<< " -T bytes  export only addresses with at least bytes per "
+		<< "snapshot" << std::endl
+		<< " -N count  export only the count addresses with the most "
+		<< "bytes per snapshot" << std::endl
+		<< " -C        carry the addresses omitted due to -T or -N into "
+		<< "the next" << std::endl
+		<< "           snapshot once instead of reporting them as "
+		<< "remainder; the last" << std::endl
+		<< "           request (see protocol.txt) reports the carried "
+		<< "ones as remainder" << std::endl
+		<< " -M path   maintain the running totals of the group in a "
+		<< "shared memory file" << std::endl
+		<< " -E count  maximum number of addresses listed in that file "
+		<< "(default: 65536)" << std::endl
+		<< " -k path   keep the running totals of the group not exported "
+		<< "yet in a" << std::endl
+		<< "           checkpoint file and recover them from it after a "
+		<< "restart" << std::endl
+		<< " -P msecs  interval between updates of shared memory and "
+		<< "checkpoint files" << std::endl
+		<< "           (default: 1000, the smallest one of all groups "
+		<< "applies)" << std::endl
+		<< " -R path   count the IPv4 or IPv6 packets of a pcap file "
+		<< "instead of" << std::endl
+		<< "           receiving from netlink, -S groups replay it too"
+		<< std::endl
+		<< " -G spec   count generated packets instead of receiving from "
+		<< "netlink, spec" << std::endl
+		<< "           is packets,addresses[,uniform|zipf|scan]"
+		<< std::endl
+		<< " -L times  replay the packets of -R or -G times (default: 1)"
+		<< std::endl;
+}
+
+/**
+ * Options of a group that do not concern the netlink socket.
+ */
+struct group_options {
+	/* netlink groups of the shards */
+	std::vector<unsigned int> shards;
+	/* CPUs to pin the receiving threads to */
+	std::vector<unsigned int> cpus;
+	/* maximum number of addresses per snapshot */
+	unsigned int entries;
+	/* minimum number of bytes of an exported address */
+	unsigned int minimum;
+	/* maximum number of exported addresses */
+	unsigned int count;
+	/* whether to carry omitted addresses into the next snapshot */
+	bool carry;
+	/* shared memory file of the running totals */
+	std::string shared;
+	/* maximum number of addresses in the shared memory file */
+	unsigned int capacity;
+	/* checkpoint file of the running totals */
+	std::string checkpoint;
+	/* interval between updates of the shared memory and checkpoint
+	 * files in ms */
+	unsigned int period;
+	/* pcap file to replay */
+	std::string replay;
+	/* specification of packets to generate and replay */
+	std::string generate;
+	/* number of times to replay */
+	unsigned int loops;
+	group_options() : entries(option_unset), minimum(0u), count(0u),
+		carry(false), capacity(65536u), period(1000u), loops(1u) {}
+};
+
+/**
+ * Parse the options of the next group starting at optind and leave optind at
+ * the group number.
+ * @returns whether the options are valid
+ */
+bool parse_options(int argc, char **argv, nflogipac_options &options,
+		group_options &groupoptions) {
+	for(int opt; -1 != (opt = getopt(argc, argv,
+					"+r:b:m:q:t:n:S:c:H:T:N:CM:E:k:P:R:G:L:"));) {
+		unsigned int *target;
+		switch(opt) {
+			case 'S':
+				groupoptions.shards.push_back(0u);
+				target = &groupoptions.shards.back();
+				break;
+			case 'H':
+				target = &groupoptions.entries;
+				break;
+			case 'T':
+				target = &groupoptions.minimum;
+				break;
+			case 'N':
+				target = &groupoptions.count;
+				break;
+			case 'C':
+				groupoptions.carry = true;
+				continue;
+			case 'M':
+				groupoptions.shared = optarg;
+				continue;
+			case 'E':
+				target = &groupoptions.capacity;
+				break;
+			case 'k':
+				groupoptions.checkpoint = optarg;
+				continue;
+			case 'R':
+				groupoptions.replay = optarg;
+				continue;
+			case 'G':
+				groupoptions.generate = optarg;
+				continue;
+			case 'L':
+				target = &groupoptions.loops;
+				break;
+			case 'P':
+				target = &groupoptions.period;
+				break;
+			case 'c':
+				try {
+					groupoptions.cpus =
+						str2intlist(optarg);
+				} catch(nflogipac_error) {
+					std::cerr << "option -c requires a "
+						<< "list of numbers"
+						<< std::endl;
+					return false;
+				}
+				continue;
+			case 'r':
+				target = &options.receive_buffer;
+				break;
+			case 'b':
+				target = &options.read_buffer;
+				break;
+			case 'm':
+				target = &options.read_batch;
+				break;
+			case 'q':
+				target = &options.qthreshold;
+				break;
+			case 't':
+				target = &options.flush_timeout;
+				break;
+			case 'n':
+				target = &options.nlbufsiz;
+				break;
+			default:
+				usage();
+				return false;
+		}
+		try {
+			*target = str2int(optarg);
+		} catch(nflogipac_error) {
+			std::cerr << "option -" << (char)opt
+				<< " requires a number" << std::endl;
+			return false;
+		}
+		if(0u == *target && 't' != opt && 'S' != opt) {
+			std::cerr << "option -" << (char)opt
+				<< " must be positive" << std::endl;
+			return false;
+		}
+	}
+	if(groupoptions.carry && 0u == groupoptions.minimum &&
+			0u == groupoptions.count) {
+		std::cerr << "option -C requires -T or -N" << std::endl;
+		return false;
+	}
+	if(!groupoptions.replay.empty() && !groupoptions.generate.empty()) {
+		std::cerr << "options -R and -G exclude each other"
 			<< std::endl;
-		return 1;
+		return false;
 	}
+	/* The read buffer must hold a complete datagram. */
+	if(option_unset != options.nlbufsiz)
+		options.read_buffer = std::max(options.read_buffer,
+				options.nlbufsiz);
+	return true;
+}
 
-	unsigned int group;
-	try {
-		group = str2int(argv[1]);
-	} catch(nflogipac_error) {
-		std::cerr << "first parameter must be a number" << std::endl;
-		return 1;
+/**
+ * Check that a netlink group is a valid group number not bound yet.
+ * @param bound contains the groups bound before and receives the group
+ */
+bool check_group(unsigned int group, std::vector<unsigned int> &bound) {
+	if(group > std::numeric_limits<uint16_t>::max()) {
+		std::cerr << "group must be at most "
+			<< std::numeric_limits<uint16_t>::max() << std::endl;
+		return false;
 	}
-
-	nflogipac_counter *counter(make_counter(argv[2]));
-	if(0 == counter) {
-		std::cerr << "second parameter must be one matching "
-			<< "ipv[46]{src,dst}(/[0-9]+)?" << std::endl;
-		return 1;
+	if(bound.end() != std::find(bound.begin(), bound.end(), group)) {
+		std::cerr << "group " << group << " given twice" << std::endl;
+		return false;
 	}
+	bound.push_back(group);
+	return true;
+}
 
-	nflogipac f(group, counter);
+/**
+ * Load the packets of a group given -R or -G.
+ * @param kind is the counter argument
+ * @param packets receives the number of packets to replay
+ * @throws nflogipac_error
+ */
+packet_trace *load_trace(const group_options &groupoptions,
+		const std::string &kind, size_t caplen, uint64_t &packets) {
+	const unsigned int version(0 == kind.compare(0u, 4u, "ipv6") ? 6u : 4u);
+	packet_trace *const trace(new packet_trace(caplen));
 	try {
-		f.open();
-	} catch(nflogipac_error &err) {
-		std::cerr << "error: " << err.message << std::endl;
+		if(!groupoptions.replay.empty()) {
+			read_pcap(groupoptions.replay, version, *trace);
+			packets = trace->size();
+		} else {
+			unsigned int generated, addresses;
+			address_distribution distribution;
+			parse_generator(groupoptions.generate, generated,
+					addresses, distribution);
+			generate_packets(version, std::min(generated,
+						std::max(addresses,
+							GENERATED_PACKETS)),
+					addresses, distribution, *trace);
+			packets = generated;
+		}
+	} catch(nflogipac_error &) {
+		delete trace;
+		throw;
+	}
+	packets *= groupoptions.loops;
+	return trace;
+}
+
+int main(int argc, char **argv) {
+	if(!seed_table_hash()) {
+		std::cerr << "cannot read /dev/urandom" << std::endl;
 		return 1;
 	}
+	counter_list counters;
+	/* receiving instances and the CPUs to pin them to */
+	std::vector<std::pair<packet_source*, unsigned int> > instances;
+	std::vector<unsigned int> bound;
+	/* interval between updates of shared memory and checkpoint files */
+	unsigned int period(option_unset);
+	do {
+		nflogipac_options options;
+		group_options groupoptions;
+		if(!parse_options(argc, argv, options, groupoptions))
+			return 1;
+		std::vector<unsigned int> &shards(groupoptions.shards);
+		const std::vector<unsigned int> &cpus(groupoptions.cpus);
+		if(2 > argc - optind) {
+			usage();
+			return 1;
+		}
 
-	boost::thread nflogthread(boost::bind(&nflogipac::run, &f));
+		unsigned int group;
+		try {
+			group = str2int(argv[optind]);
+		} catch(nflogipac_error) {
+			std::cerr << "group must be a number" << std::endl;
+			return 1;
+		}
+		if(!check_group(group, bound))
+			return 1;
+		shards.insert(shards.begin(), group);
 
-	std::exit(reportloop(counter));
+		nflogipac_counter *counter(0);
+		const bool replaying(!groupoptions.replay.empty() ||
+				!groupoptions.generate.empty());
+		/* packets replayed by all receiving threads of the group */
+		packet_trace *trace(0);
+		uint64_t replayed(0u);
+		for(std::vector<unsigned int>::const_iterator
+				i(shards.begin()); i != shards.end(); ++i) {
+			if(i != shards.begin() && !check_group(*i, bound))
+				return 1;
+			nflogipac_counter *shard(make_counter(argv[optind+1]));
+			if(0 == shard) {
+				std::cerr << "counter must be one matching "
+					<< "ipv[46]{src,dst}(/[0-9]+)?"
+					<< std::endl;
+				return 1;
+			}
+			if(option_unset != groupoptions.entries)
+				shard->limit_entries(groupoptions.entries);
+			if(0 == counter)
+				counter = shard;
+			else if(!counter->attach(shard)) {
+				std::cerr << "error: group " << *i << ": "
+					<< "shard of a different kind"
+					<< std::endl;
+				return 1;
+			}
+
+			packet_source *f;
+			try {
+				if(replaying) {
+					if(0 == trace)
+						trace = load_trace(groupoptions,
+								argv[optind+1],
+								shard->caplen,
+								replayed);
+					f = new replay_source(*i, shard,
+							*trace, replayed,
+							options.read_batch);
+				} else
+					f = new nflogipac(*i, shard, options);
+				f->open();
+			} catch(nflogipac_error &err) {
+				std::cerr << "error: group " << *i << ": "
+					<< err.message << std::endl;
+				return 1;
+			}
+			instances.push_back(std::make_pair(f, cpus.empty() ?
+						option_unset :
+						cpus[(i - shards.begin()) %
+						cpus.size()]));
+		}
+		counter->filter_entries(groupoptions.minimum, groupoptions.count,
+				groupoptions.carry);
+		if(!groupoptions.shared.empty()) {
+			try {
+				counter->share(groupoptions.shared, group,
+						groupoptions.capacity);
+			} catch(nflogipac_error &e) {
+				std::cerr << "error: group " << group << ": "
+					<< e.message << std::endl;
+				return 1;
+			}
+			period = std::min(period, groupoptions.period);
+		}
+		if(!groupoptions.checkpoint.empty()) {
+			try {
+				const uint64_t recovered(counter->checkpoint(
+							groupoptions.checkpoint,
+							group));
+				if(0u < recovered)
+					std::cerr << "group " << group
+						<< ": recovered "
+						<< recovered << " bytes "
+						<< "from checkpoint file"
+						<< std::endl;
+			} catch(nflogipac_error &e) {
+				std::cerr << "error: group " << group << ": "
+					<< e.message << std::endl;
+				return 1;
+			}
+			period = std::min(period, groupoptions.period);
+		}
+		counters.push_back(std::make_pair((uint16_t)group, counter));
+		optind += 2;
+	} while(optind < argc);
+
+	for(std::vector<std::pair<packet_source*, unsigned int> >::
+			const_iterator i(instances.begin());
+			i != instances.end(); ++i) {
+		boost::thread *thread(new boost::thread(
+					boost::bind(&packet_source::run,
+						i->first)));
+		if(option_unset != i->second)
+			try {
+				pin_thread(*thread, i->second);
+			} catch(nflogipac_error &err) {
+				std::cerr << "error: cpu " << i->second << ": "
+					<< err.message << std::endl;
+				return 1;
+			}
+	}
+
+	std::exit(reportloop(counters, period));
 }
+#endif
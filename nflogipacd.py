@@ -10,7 +10,6 @@ import socket
 import sys
 import collections
 import threading
-import Queue
 import configobj
 import imp
 import signal
@@ -20,6 +19,9 @@ import traceback
 import fcntl
 import errno
 from nflogipac.asynschedcore import asynschedcore, periodic
+from nflogipac.plugins import AccountBatch, new_value_array
+from nflogipac.statistics import GroupStatistics, MeasuredQueue, \
+	StatisticsServer
 from nflogipac.syslogging import SysloggingDebugLevel
 
 try:
@@ -34,6 +36,38 @@ except ImportError as exc:
 		raise exc
 
 
+message_header = struct.Struct("!HH")
+uint16 = struct.Struct("!H")
+uint64 = struct.Struct("!Q")
+# record count, address length and reserved field of a BULK_UPDATE message
+bulk_header = struct.Struct("!IHH")
+# lost packets, estimated lost bytes and overruns of a LOSS64 message
+loss64 = struct.Struct("!QQQ")
+# bytes, maximum error and threshold of a REMAINDER message
+remainder_fields = struct.Struct("!QQQ")
+# addresses, allocated memory and bytes of a TABLE message
+table_fields = struct.Struct("!QQQ")
+
+# errno values indicating that the counter closed its end of the socket
+disconnected_errnos = frozenset((errno.ECONNRESET, errno.ENOTCONN,
+								 errno.ESHUTDOWN, errno.ECONNABORTED,
+								 errno.EPIPE, errno.EBADF))
+
+
+def unpack_values(data):
+	"""Decode a sequence of 64bit unsigned integers in network byte order.
+	@type data: str
+	@rtype: array.array or list
+	"""
+	values = new_value_array()
+	if isinstance(values, list):
+		return list(struct.unpack("!%dQ" % (len(data) // 8), data))
+	values.fromstring(data)
+	if sys.byteorder == "little":
+		values.byteswap()
+	return values
+
+
 class FatalError(Exception):
 	"""Something very bad happend leading to program abort with a message."""
 
@@ -43,13 +77,69 @@ def set_close_on_exec(filedescriptor):
 	fcntl.fcntl(filedescriptor, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
 
 
-def create_counter(group, kind):
+# maps keys of a [groups] subsection to options of the counter process
+counter_options = (("receive_buffer", "-r"), ("read_buffer", "-b"),
+				   ("read_batch", "-m"), ("qthreshold", "-q"),
+				   ("flush_timeout", "-t"), ("nlbufsiz", "-n"), ("cpus", "-c"),
+				   ("heavy_hitters", "-H"), ("min_bytes", "-T"),
+				   ("top_addresses", "-N"), ("carry_remainder", "-C"),
+				   ("shared_file", "-M"), ("shared_capacity", "-E"),
+				   ("shared_period", "-P"), ("checkpoint_file", "-k"))
+# maps list keys of a [groups] subsection to options given once per element
+counter_repeated_options = (("shards", "-S"),)
+
+
+def counter_arguments(groupconfig):
+	"""Translate the optional tunables of a group to counter options.
+	@type groupconfig: configobj.Section
+	@rtype: [str]
+	"""
+	arguments = []
+	for key, option in counter_options:
+		value = groupconfig.get(key)
+		if isinstance(value, bool):
+			if value:
+				arguments.append(option)
+		elif isinstance(value, list):
+			arguments.extend((option, ",".join(map(str, value))))
+		elif value is not None:
+			arguments.extend((option, str(value)))
+	for key, option in counter_repeated_options:
+		for value in groupconfig.get(key) or ():
+			arguments.extend((option, str(value)))
+	return arguments
+
+
+def create_counter(group, kind, arguments=(), executable=None):
 	"""
 	@type group: int
 	@type kind: str
+	@type arguments: [str]
+	@param arguments: options passed to the counter process
+	@type executable: str or None
+	@param executable: is the counter program if not nflogipacd_path
+	@rtype: (int, socket)
+	@returns: (pid, stdin_and_stdout)
+	"""
+	return create_shared_counter([(group, kind, arguments)], executable)
+
+
+def create_shared_counter(groups, executable=None):
+	"""Start one counter process for several groups.
+	@type groups: [(int, str, [str])]
+	@param groups: (group, kind, arguments) triples with arguments being the
+			options of the group passed to the counter process
+	@type executable: str or None
+	@param executable: is the counter program if not nflogipacd_path
 	@rtype: (int, socket)
 	@returns: (pid, stdin_and_stdout)
 	"""
+	if executable is None:
+		executable = nflogipacd_path
+	argv = [executable]
+	for group, kind, arguments in groups:
+		argv.extend(arguments)
+		argv.extend(("%d" % group, kind))
 	parentsock, childsock = socket.socketpair()  # for communication
 	parentpipe, childpipe = os.pipe()  # for startup
 	pid = os.fork()
@@ -64,7 +154,7 @@ def create_counter(group, kind):
 			os.dup2(childsock.fileno(), 0)
 			os.dup2(childsock.fileno(), 1)
 			try:
-				os.execv(nflogipacd_path, [nflogipacd_path, "%d" % group, kind])
+				os.execv(executable, argv)
 			except OSError as err:
 				os.write(childpipe, "exec failed with OSError: %s" % str(err))
 				sys.exit(1)
@@ -86,27 +176,73 @@ def create_counter(group, kind):
 
 
 class Counter(asyncore.dispatcher, object):
-	def __init__(self, group, kind, mapping=None):
+	# maximum number of bytes to receive with a single recv_into call
+	recvsize = 0x40000
+	# protocol extension level requested from the counter (see protocol.txt)
+	protocol_level = 5
+
+	def __init__(self, group, kind, arguments=(), mapping=None,
+				 extra_groups=(), executable=None):
 		"""
 		@type group: int
 		@type kind: str
+		@type arguments: [str]
+		@param arguments: options passed to the counter process
+		@type extra_groups: [(int, str, [str])]
+		@param extra_groups: (group, kind, arguments) triples of further
+				groups counted by the same process
+		@type executable: str or None
+		@param executable: is the counter program if not nflogipacd_path
 		"""
 		self.group = group
 		self.kind = kind
-		self.pid, counter_sock = create_counter(group, kind)
+		self.arguments = arguments
+		self.extra_groups = extra_groups
+		self.executable = executable
+		# all groups in the order of the counter process
+		self.groups = [group] + [extra[0] for extra in extra_groups]
+		self.pid, counter_sock = self.spawn()
 		asyncore.dispatcher.__init__(self, sock=counter_sock, map=mapping)
 		self.requesting_data = False
+		self.requesting_last = False
 		self.lastrequest = 0
-		self.buf = ""
-
-	def request_data(self):
+		# Messages are parsed in place from a preallocated buffer. After each
+		# read the unparsed tail (less than one message) is moved to the front.
+		# The buffer is enlarged when a BULK_UPDATE message does not fit.
+		self.buf = bytearray(self.recvsize + 0x10000)
+		self.bufview = memoryview(self.buf)
+		self.buffill = 0
+
+	def spawn(self):
+		"""Start the counter process.
+		@rtype: (int, socket)
+		@returns: (pid, stdin_and_stdout)
+		"""
+		if self.extra_groups:
+			return create_shared_counter(
+				[(self.group, self.kind, self.arguments)] +
+				list(self.extra_groups), self.executable)
+		return create_counter(self.group, self.kind, self.arguments,
+							  self.executable)
+
+	def request_data(self, last=False):
+		"""
+		@type last: bool
+		@param last: marks the last request, after which the counter must not
+				keep any traffic for a next snapshot
+		"""
 		self.requesting_data = True
+		self.requesting_last = last
 
 	def writable(self):
 		return self.requesting_data
 
 	def handle_write(self):
-		if self.send("x"):
+		if self.requesting_last:
+			request = "abcdefghij"[self.protocol_level]
+		else:
+			request = str(self.protocol_level)
+		if self.send(request):
 			self.lastrequest = time.time()
 			self.requesting_data = False
 
@@ -117,33 +253,115 @@ class Counter(asyncore.dispatcher, object):
 		self.close()
 
 	def handle_read(self):
-		self.buf += self.recv(8192)
-		while len(self.buf) >= 4:
-			length, command = struct.unpack("!HH", self.buf[:4])
-			if len(self.buf) < length:
+		try:
+			received = self.socket.recv_into(self.bufview[self.buffill:],
+											 self.recvsize)
+		except socket.error as err:
+			if err.args[0] in disconnected_errnos:
+				self.handle_close()
+				return
+			raise
+		if not received:
+			self.handle_close()
+			return
+		buf = self.buf
+		end = self.buffill + received
+		offset = 0
+		pending = 0  # size of the incomplete message at offset
+		while end - offset >= 4:
+			length, command = message_header.unpack_from(buf, offset)
+			if length < 4:
+				self.close()
+				return
+			size = length
+			if command == 4 and length == 12:  # BULK_UPDATE carries a body
+				if end - offset < length:
+					pending = length
+					break
+				count, addrlen, _ = bulk_header.unpack_from(buf, offset + 4)
+				size += count * (8 + addrlen)
+			if end - offset < size:
+				pending = size
 				break
-			self.handle_packet(command, self.buf[4:length])
-			self.buf = self.buf[length:]
-
-	def handle_packet(self, command, content):
+			self.handle_packet(command, buf, offset + 4, offset + size)
+			if not self.connected:
+				return
+			offset += size
+		self.buffill = end - offset
+		if offset and self.buffill:
+			buf[:self.buffill] = buf[offset:end]
+		if len(buf) < pending + self.recvsize:
+			self.bufview = None  # a bytearray cannot be resized while viewed
+			buf.extend(bytearray(pending + self.recvsize - len(buf)))
+			self.bufview = memoryview(buf)
+
+	def handle_packet(self, command, data, start, end):
+		"""
+		@type command: int
+		@type data: bytearray
+		@param start: offset of the message content in data
+		@param end: offset of the first byte after the message content
+		"""
 		if command == 1:
-			if len(content) < 8:
+			if end - start < 8:
 				self.close()
 				return
-			value, = struct.unpack("!Q", content[:8])
-			addr = content[8:]
+			value, = uint64.unpack_from(data, start)
+			addr = str(data[start + 8:end])
 			self.handle_cmd_update(self.lastrequest, addr, value)
 		elif command == 2:
-			if content != "":
+			if end != start:
 				self.close()
 				return
 			self.handle_cmd_end()
 		elif command == 3:
-			if len(content) != 2:
+			if end - start != 2:
 				self.close()
 				return
-			losscount, = struct.unpack("!H", content)
+			losscount, = uint16.unpack_from(data, start)
 			self.handle_cmd_loss(self.lastrequest, losscount)
+		elif command == 4:
+			if end - start < 8:
+				self.close()
+				return
+			count, addrlen, reserved = bulk_header.unpack_from(data, start)
+			if reserved != 0 or end - start != 8 + count * (8 + addrlen):
+				self.close()
+				return
+			valuesend = start + 8 + 8 * count
+			values = memoryview(data)[start + 8:valuesend].tobytes()
+			values = unpack_values(values)
+			addresses = str(data[valuesend:end])
+			self.handle_cmd_bulk_update(self.lastrequest, addrlen, addresses,
+										values)
+		elif command == 5:
+			if end - start != loss64.size:
+				self.close()
+				return
+			packets, bytes, overruns = loss64.unpack_from(data, start)
+			self.handle_cmd_loss64(self.lastrequest, packets, bytes, overruns)
+		elif command == 6:
+			if end - start != 2:
+				self.close()
+				return
+			group, = uint16.unpack_from(data, start)
+			if group not in self.groups:
+				self.close()
+				return
+			self.handle_cmd_group(group)
+		elif command == 7:
+			if end - start != remainder_fields.size:
+				self.close()
+				return
+			bytes, error, threshold = remainder_fields.unpack_from(data, start)
+			self.handle_cmd_remainder(self.lastrequest, bytes, error,
+									  threshold)
+		elif command == 8:
+			if end - start != table_fields.size:
+				self.close()
+				return
+			entries, memory, bytes = table_fields.unpack_from(data, start)
+			self.handle_cmd_table(self.lastrequest, entries, memory, bytes)
 		else:
 			self.close()
 
@@ -155,15 +373,74 @@ class Counter(asyncore.dispatcher, object):
 		"""
 		raise NotImplementedError
 
+	def handle_cmd_bulk_update(self, timestamp, addrlen, addresses, values):
+		"""
+		@type timestamp: float
+		@type addrlen: int
+		@type addresses: str
+		@param addresses: is the concatenation of len(values) binary addresses
+				of length addrlen each
+		@type values: array.array or list
+		"""
+		start = 0
+		for value in values:
+			self.handle_cmd_update(timestamp, addresses[start:start + addrlen],
+								   value)
+			start += addrlen
+
 	def handle_cmd_end(self):
 		raise NotImplementedError
 
+	def handle_cmd_group(self, group):
+		"""The following messages up to the next GROUP or END message
+		belong to the given group.
+		@type group: int
+		"""
+		self.group = group
+
 	def handle_cmd_loss(self, timestamp, count):
 		"""
 		@type timestamp: float
 		"""
 		raise NotImplementedError
 
+	def handle_cmd_loss64(self, timestamp, packets, bytes, overruns):
+		"""
+		@type timestamp: float
+		@type packets: int or long
+		@param packets: is the number of lost packets
+		@type bytes: int or long
+		@param bytes: is the estimated size of the lost packets
+		@type overruns: int or long
+		@param overruns: is the number of receive buffer overruns
+		"""
+		self.handle_cmd_loss(timestamp, packets)
+
+	def handle_cmd_remainder(self, timestamp, bytes, error, threshold):
+		"""
+		@type timestamp: float
+		@type bytes: int or long
+		@param bytes: is the traffic not attributed to any reported address
+		@type error: int or long
+		@param error: is the largest amount by which the count of a reported
+				address may fall short
+		@type threshold: int or long
+		@param threshold: every address with more traffic was reported
+		"""
+		raise NotImplementedError
+
+	def handle_cmd_table(self, timestamp, entries, memory, bytes):
+		"""Statistics of the counter tables. They may be ignored.
+		@type timestamp: float
+		@type entries: int or long
+		@param entries: is the number of addresses counted
+		@type memory: int or long
+		@param memory: is the number of bytes allocated by the tables
+		@type bytes: int or long
+		@param bytes: is the number of bytes counted
+		"""
+		pass
+
 
 class DebugCounter(Counter):
 	def __init__(self, *args, **kwargs):
@@ -171,7 +448,7 @@ class DebugCounter(Counter):
 		self.pending = collections.defaultdict(long)
 
 	def handle_cmd_update(self, timestamp, addr, value):
-		self.pending[addr] += value
+		self.pending[(self.group, addr)] += value
 		print("received update for group %d addr %s value %d" %
 			  (self.group, addr.encode("hex"), value))
 
@@ -181,72 +458,295 @@ class DebugCounter(Counter):
 	def handle_cmd_loss(self, timestamp, count):
 		print("lost at least %d segments" % count)
 
+	def handle_cmd_loss64(self, timestamp, packets, bytes, overruns):
+		print("lost %d packets (about %d bytes) in %d overruns" %
+			  (packets, bytes, overruns))
+
+	def handle_cmd_remainder(self, timestamp, bytes, error, threshold):
+		print("%d bytes not attributed (error %d, threshold %d)" %
+			  (bytes, error, threshold))
+
+	def handle_cmd_table(self, timestamp, entries, memory, bytes):
+		print("counted %d bytes for %d addresses in %d bytes of tables" %
+			  (bytes, entries, memory))
+
 
 class ReportingCounter(Counter):
-	def __init__(self, group, kind, writefunc, endfunc, lossfunc, mapping=None):
+	def __init__(self, group, kind, arguments, batchfunc, endfunc, lossfunc,
+				 mapping=None, extra_groups=(), remainderfunc=None,
+				 executable=None, tablefunc=None):
 		"""
 		@type group: int
 		@type kind: str
-		@type writefunc: (float, int, str, int) -> None
-		@param writefunc: is a function taking a timestamp, a group, a binary
-				IP (4 or 6) address and a byte count. It must not block or fail.
+		@type arguments: [str]
+		@param arguments: options passed to the counter process
+		@type batchfunc: (float, int, AccountBatch) -> None
+		@param batchfunc: is a function taking a timestamp, a group and an
+				AccountBatch containing all binary IP (4 or 6) addresses and
+				byte counts of one snapshot. It must not block or fail.
 		@type endfunc: int -> None
 		@param endfunc takes a group
-		@type lossfunc: (float, int, int) -> None
-		@param lossfunc: takes a timestamp, a group and a count
+		@type lossfunc: (float, int, int, int or None) -> None
+		@param lossfunc: takes a timestamp, a group, a packet count and the
+				estimated size of the lost packets if known
+		@type extra_groups: [(int, str, [str])]
+		@param extra_groups: (group, kind, arguments) triples of further
+				groups counted by the same process. Each group is reported
+				separately.
+		@type remainderfunc: (float, int, int, int, int) -> None or None
+		@param remainderfunc: takes a timestamp, a group and the bytes, error
+				and threshold of a REMAINDER message. If it is None, the
+				remainder is dropped.
+		@type executable: str or None
+		@param executable: is the counter program if not nflogipacd_path
+		@type tablefunc: (float, int, int, int, int) -> None or None
+		@param tablefunc: takes a timestamp, a group and the addresses,
+				memory and bytes of a TABLE message. If it is None, the
+				message is dropped.
 		"""
-		Counter.__init__(self, group, kind, mapping)
-		self.writefunc = writefunc
+		Counter.__init__(self, group, kind, arguments, mapping, extra_groups,
+						 executable)
+		self.batchfunc = batchfunc
 		self.endfunc = endfunc
 		self.lossfunc = lossfunc
+		self.remainderfunc = remainderfunc
+		self.tablefunc = tablefunc
+		self.batch = None
+		self.batchtime = 0
 
 	def handle_cmd_update(self, timestamp, addr, value):
-		self.writefunc(timestamp, self.group, addr, value)
+		if self.batch is None:
+			self.batch = AccountBatch(len(addr))
+			self.batchtime = timestamp
+		self.batch.append(addr, value)
+
+	def handle_cmd_bulk_update(self, timestamp, addrlen, addresses, values):
+		if self.batch is None:
+			self.batch = AccountBatch(addrlen)
+			self.batchtime = timestamp
+		self.batch.extend(addresses, values)
+
+	def flush_batch(self):
+		if self.batch is not None:
+			batch, self.batch = self.batch, None
+			self.batchfunc(self.batchtime, self.group, batch)
+
+	def handle_cmd_group(self, group):
+		self.flush_batch()
+		Counter.handle_cmd_group(self, group)
 
 	def handle_cmd_end(self):
-		self.endfunc(self.group)
+		self.flush_batch()
+		self.group = self.groups[0]
+		for group in self.groups:
+			self.endfunc(group)
 
 	def handle_cmd_loss(self, timestamp, count):
-		self.lossfunc(timestamp, self.group, count)
+		self.lossfunc(timestamp, self.group, count, None)
+
+	def handle_cmd_loss64(self, timestamp, packets, bytes, overruns):
+		self.lossfunc(timestamp, self.group, packets, bytes)
+
+	def handle_cmd_remainder(self, timestamp, bytes, error, threshold):
+		if self.remainderfunc is not None:
+			self.remainderfunc(timestamp, self.group, bytes, error, threshold)
+
+	def handle_cmd_table(self, timestamp, entries, memory, bytes):
+		if self.tablefunc is not None:
+			self.tablefunc(timestamp, self.group, entries, memory, bytes)
+
+
+class SignalReceiver(asyncore.dispatcher):
+	"""Handle signals from the asyncore loop. The signal handlers only record
+	the signal, because the interrupted code may hold a lock or be in the
+	middle of a queue operation that handling the signal needs. Python writes
+	a byte to a socket of this dispatcher on every signal (see
+	signal.set_wakeup_fd), so the loop wakes up even if the signal arrives
+	right before it waits."""
+
+	def __init__(self, signums, handler, mapping=None):
+		"""
+		@type signums: [int]
+		@type handler: int -> None
+		@param handler: is called with every received signal
+		"""
+		self.handler = handler
+		self.pending = collections.deque()
+		receiver, self.sender = socket.socketpair()
+		set_close_on_exec(receiver)
+		set_close_on_exec(self.sender)
+		self.sender.setblocking(False)
+		asyncore.dispatcher.__init__(self, sock=receiver, map=mapping)
+		signal.set_wakeup_fd(self.sender.fileno())
+		for signum in signums:
+			signal.signal(signum, self.record)
+
+	def record(self, signum, _):
+		self.pending.append(signum)
+
+	def writable(self):
+		return False
+
+	def readable(self):
+		return True
+
+	def handle_read(self):
+		self.recv(4096)
+		while self.pending:
+			self.handler(self.pending.popleft())
+
+	def handle_close(self):
+		self.close()
+
+	def close(self):
+		signal.set_wakeup_fd(-1)
+		asyncore.dispatcher.close(self)
+		self.sender.close()
 
 
 class GatherThread(threading.Thread):
-	def __init__(self, pinginterval, wt, log):
+	def __init__(self, pinginterval, wt, log, counter_path=None):
 		"""
 		@type pinginterval: int
 		@type wt: WriteThread
+		@type counter_path: str or None
+		@param counter_path: is the counter program if not nflogipacd_path
 		"""
 		threading.Thread.__init__(self)
 		self.wt = wt
 		self.log = log
+		self.counter_path = counter_path
 		self.asc = asynschedcore({})
 		self.periodic = periodic(self.asc, pinginterval, 0, self.periodically)
 		self.counters = {}
 		self.counters_working = set()
 		self.terminating = False
+		self.last_requested = False
+		self.statistics = {}  # group -> GroupStatistics
+		self.statistics_server = None
+		self.signal_receiver = None
 
-	def add_counter(self, group, kind):
+	def add_counter(self, group, kind, arguments=(), extra_groups=()):
 		"""
 		@type group: int
 		@type kind: str
+		@type arguments: [str]
+		@param arguments: options passed to the counter process
+		@type extra_groups: [(int, str, [str])]
+		@param extra_groups: (group, kind, arguments) triples of further
+				groups counted by the same process
 		"""
-		assert group not in self.counters
-		self.counters[group] = ReportingCounter(group, kind, self.wt.account,
-												self.end_hook, self.wt.notice_loss, self.asc.asynmap)
+		counter = ReportingCounter(group, kind, arguments,
+								   self.account_batch, self.end_hook, self.notice_loss,
+								   self.asc.asynmap, extra_groups,
+								   self.notice_remainder, self.counter_path,
+								   self.notice_table)
+		for group in counter.groups:
+			assert group not in self.counters
+			self.counters[group] = counter
+			self.statistics[group] = GroupStatistics()
+
+	def serve_statistics(self, path):
+		"""Answer every connection to the UNIX socket at path with the
+		statistics as JSON.
+		@type path: str
+		@raises socket.error:
+		"""
+		self.statistics_server = StatisticsServer(path, self.collect_statistics,
+												  self.asc.asynmap)
+		set_close_on_exec(self.statistics_server.socket)
+
+	def catch_signals(self):
+		"""Handle SIGTERM, SIGHUP and SIGCHLD from the loop of run."""
+		self.signal_receiver = SignalReceiver(
+			(signal.SIGTERM, signal.SIGHUP, signal.SIGCHLD),
+			self.handle_signal, self.asc.asynmap)
 
-	def request_data(self):
+	def handle_signal(self, signum):
+		"""
+		@type signum: int
+		"""
+		if signum == signal.SIGTERM:
+			self.log.log_notice("received SIGTERM")
+			self.terminate()
+		elif signum == signal.SIGHUP:
+			self.log.log_notice("received SIGHUP")
+			self.ping_now()
+		elif signum == signal.SIGCHLD:
+			self.handle_sigchld()
+
+	def collect_statistics(self):
+		"""
+		@rtype: dict
+		"""
+		groups = {}
+		for group, statistics in self.statistics.items():
+			groups[str(group)] = statistics.as_dict()
+			counter = self.counters.get(group)
+			groups[str(group)]["pid"] = None if counter is None else counter.pid
+		return dict(time=time.time(), groups=groups,
+					queue=self.wt.queue.as_dict())
+
+	def account_batch(self, timestamp, group, batch):
+		self.statistics[group].account(len(batch))
+		self.wt.account_batch(timestamp, group, batch)
+
+	def notice_loss(self, timestamp, group, count, bytes=None):
+		self.statistics[group].loss(count, bytes)
+		self.wt.notice_loss(timestamp, group, count, bytes)
+
+	def notice_remainder(self, timestamp, group, bytes, error, threshold):
+		self.statistics[group].remainder(bytes)
+		self.wt.notice_remainder(timestamp, group, bytes, error, threshold)
+
+	def notice_table(self, timestamp, group, entries, memory, bytes):
+		self.statistics[group].table(entries, memory, bytes)
+
+	def request_data(self, last=False):
+		"""
+		@type last: bool
+		@param last: requests the last snapshot before closing the counters
+		"""
+		self.last_requested = last
 		self.wt.start_write()
 		self.counters_working = set(self.counters.keys())
-		for counter in self.counters.values():
-			counter.request_data()
+		now = time.time()
+		for group in self.counters_working:
+			self.statistics[group].start(now)
+		for counter in set(self.counters.values()):
+			counter.request_data(last)
+
+	def remove_group(self, group):
+		"""Forget about a group and close its counter once it serves no
+		other group."""
+		counter = self.counters.pop(group)
+		if counter not in self.counters.values():
+			counter.close()
+		if self.counters:
+			return
+		# let asc.run return
+		if self.statistics_server is not None:
+			self.statistics_server.close()
+			self.statistics_server = None
+		if self.signal_receiver is not None:
+			self.signal_receiver.close()
+			self.signal_receiver = None
 
 	def end_hook(self, group):
+		self.statistics[group].end(time.time())
 		self.counters_working.remove(group)
+		last = self.last_requested
 		if not self.counters_working:
 			self.log.log_debug("received end packet from all counters", 1)
-			self.wt.end_write()
-		if self.terminating:
-			self.counters.pop(group).close()
+			self.snapshot_complete()
+		if last:
+			self.remove_group(group)
+
+	def snapshot_complete(self):
+		"""Called once every counter answered the running request."""
+		self.wt.end_write()
+		if self.terminating and not self.last_requested and self.counters:
+			self.request_data(True)
 
 	def periodically(self):
 		self.log.log_debug("querying counters", 2)
@@ -263,10 +763,13 @@ class GatherThread(threading.Thread):
 		self.periodic.call_now()
 
 	def terminate(self):
+		"""Request the last snapshot, after the running one if any, and close
+		the counters once it arrived."""
 		self.periodic.stop()
 		if not self.terminating:
-			self.request_data()
 			self.terminating = True
+			if not self.counters_working:
+				self.request_data(True)
 
 	def handle_child_death(self, pid):
 		"""
@@ -274,26 +777,25 @@ class GatherThread(threading.Thread):
 		@rtype: bool
 		@returns: whether the child was a counter
 		"""
-		for group, counter in self.counters.items():
-			if counter.pid != pid:
-				continue
-			if self.terminating:
-				self.log.log_notice("child pid:%d group:%d terminated" %
-									(pid, group))
-			else:
-				self.log.log_err("child pid:%d group:%d unexpectedly died" %
-								 (pid, group))
-			try:
-				self.counters_working.remove(group)
-			except KeyError:
-				pass
-			else:
-				# only executed if group was actually removed
-				if not self.counters_working:
-					self.wt.end_write()
-			self.counters.pop(group).close()
-			return True
-		return False
+		groups = sorted(group for group, counter in self.counters.items()
+						if counter.pid == pid)
+		if not groups:
+			return False
+		grouplist = ",".join(map(str, groups))
+		if self.terminating:
+			self.log.log_notice("child pid:%d group:%s terminated" %
+								(pid, grouplist))
+		else:
+			self.log.log_err("child pid:%d group:%s unexpectedly died" %
+							 (pid, grouplist))
+		working = bool(self.counters_working)
+		self.counters_working.difference_update(groups)
+		for group in groups:
+			self.remove_group(group)
+		# only if a group was actually removed
+		if working and not self.counters_working:
+			self.snapshot_complete()
+		return True
 
 	def handle_sigchld(self):
 		while True:
@@ -312,9 +814,15 @@ class GatherThread(threading.Thread):
 class WriteThread(threading.Thread):
 	def __init__(self, writeplugin, log):
 		threading.Thread.__init__(self)
-		self.queue = Queue.Queue()
+		self.queue = MeasuredQueue()
 		self.writeplugin = writeplugin
 		self.log = log
+		self.accepts_account_batch = getattr(writeplugin,
+											 "accepts_account_batch", False)
+		self.accepts_loss_bytes = getattr(writeplugin, "accepts_loss_bytes",
+										  False)
+		self.accepts_remainder = getattr(writeplugin, "accepts_remainder",
+										 False)
 
 	def start_write(self):
 		self.queue.put(("start_write",))
@@ -325,8 +833,41 @@ class WriteThread(threading.Thread):
 	def account(self, timestamp, group, addr, value):
 		self.queue.put(("account", timestamp, group, addr, value))
 
-	def notice_loss(self, timestamp, group, count):
+	def account_batch(self, timestamp, group, batch):
+		"""Pass all entries of a batch either as one account_batch event or
+		as individual account events if the plugin does not accept batches.
+		@type batch: AccountBatch
+		"""
+		if self.accepts_account_batch:
+			self.queue.put(("account_batch", timestamp, group, batch))
+		else:
+			for addr, value in batch:
+				self.account(timestamp, group, addr, value)
+
+	def notice_loss(self, timestamp, group, count, bytes=None):
+		"""
+		@type count: int or long
+		@param count: is the number of lost packets
+		@type bytes: int or long or None
+		@param bytes: is the estimated size of the lost packets if known
+		"""
 		self.queue.put(("loss", timestamp, group, count))
+		if bytes is not None and self.accepts_loss_bytes:
+			self.queue.put(("loss_bytes", timestamp, group, bytes))
+
+	def notice_remainder(self, timestamp, group, bytes, error, threshold):
+		"""
+		@type bytes: int or long
+		@param bytes: is the traffic not attributed to any address
+		@type error: int or long
+		@param error: is the largest amount by which the count of a reported
+				address may fall short
+		@type threshold: int or long
+		@param threshold: every address with more traffic was reported
+		"""
+		if self.accepts_remainder:
+			self.queue.put(("remainder", timestamp, group, bytes, error,
+							threshold))
 
 	def terminate(self):
 		self.queue.put(("terminate",))
@@ -338,9 +879,11 @@ class WriteThread(threading.Thread):
 			self.log.log_err("Caught %s from plugin: %s" % (type(e).__name__, str(e)))
 			for line in traceback.format_exc(sys.exc_info()[2]).splitlines():
 				self.log.log_err(line)
+			self.log.close()
 			os._exit(1)
 		# The plugin is now finished or it died. There is no point in keeping
 		# things going, so we terminate *all* threads now.
+		self.log.close()
 		os._exit(0)
 
 
@@ -359,17 +902,41 @@ plugin = string(min=1)
 interval = integer(min=1)
 syslog_facility = option(%(syslog_facilities)s, default='daemon')
 log_level = integer(min=0, max=10, default=3)
+log_location = boolean(default=True)
+log_thread = boolean(default=False)
+log_burst = integer(min=1, default=None)
+log_burst_interval = integer(min=1, default=60)
 daemonize = boolean()
 pidfile = string(min=0)
+shared_counter = boolean(default=False)
+counter_path = string(min=1, default=None)
+stats_socket = string(min=1, default=None)
 [groups]
 [[__many__]]
 kind = string(min=1)
+receive_buffer = integer(min=1, default=None)
+read_buffer = integer(min=1, default=None)
+read_batch = integer(min=1, default=None)
+qthreshold = integer(min=1, default=None)
+flush_timeout = integer(min=0, default=None)
+nlbufsiz = integer(min=1, default=None)
+shards = int_list(min=1, default=None)
+cpus = int_list(min=1, default=None)
+heavy_hitters = integer(min=1, default=None)
+min_bytes = integer(min=1, default=None)
+top_addresses = integer(min=1, default=None)
+carry_remainder = boolean(default=False)
+shared_file = string(min=1, default=None)
+shared_capacity = integer(min=1, default=None)
+shared_period = integer(min=1, default=None)
+checkpoint_file = string(min=1, default=None)
 """ % dict(syslog_facilities=", ".join(map(repr, syslog_facilities.keys()))
 )).splitlines(), interpolation=False, list_values=False)
 
 
 def die(log, message):
 	log.log_err(message)
+	log.close()
 	sys.stderr.write(message + "\n")
 	sys.exit(1)
 
@@ -418,12 +985,18 @@ def main():
 
 	log = SysloggingDebugLevel("nflogipacd",
 							   facility=syslog_facilities[config["main"]["syslog_facility"]],
-							   log_level=config["main"]["log_level"])
+							   log_level=config["main"]["log_level"],
+							   location=config["main"]["log_location"])
+	if config["main"]["log_burst"]:
+		log.enable_rate_limit(config["main"]["log_burst"],
+							  config["main"]["log_burst_interval"])
 
 	if config["main"]["daemonize"]:
 		old_stderr = sys.stderr
 		sys.stderr = daemonize(log)
 
+	if config["main"]["log_thread"]:
+		log.start_thread()  # after forking
 	log.log_notice("started")
 	log.log_debug("Loading plugin %s" % config["main"]["plugin"], 0)
 	try:
@@ -433,6 +1006,7 @@ def main():
 		log.log_err(msg)
 		for line in traceback.format_exc(sys.exc_info()[2]).splitlines():
 			log.log_err(line)
+		log.close()
 		sys.stderr.write(msg + "\n")
 		sys.exit(1)
 
@@ -443,21 +1017,23 @@ def main():
 			die(log, "setproctitle python module is not available")
 
 	wt = WriteThread(plugin, log)
-	gt = GatherThread(int(config["main"]["interval"]), wt, log)
-	for group, cfg in config["groups"].items():
-		gt.add_counter(int(group), cfg["kind"])
-
-	def handle_sigterm(*_):
-		log.log_notice("received SIGTERM")
-		gt.terminate()
-
-	def handle_sighup(*_):
-		log.log_notice("received SIGHUP")
-		gt.ping_now()
+	gt = GatherThread(int(config["main"]["interval"]), wt, log,
+					  config["main"]["counter_path"])
+	groups = [(int(group), cfg["kind"], counter_arguments(cfg))
+			  for group, cfg in config["groups"].items()]
+	if config["main"]["shared_counter"] and groups:
+		gt.add_counter(*groups[0], extra_groups=groups[1:])
+	else:
+		for group, kind, arguments in groups:
+			gt.add_counter(group, kind, arguments)
+	if config["main"]["stats_socket"] and groups:
+		try:
+			gt.serve_statistics(config["main"]["stats_socket"])
+		except socket.error as err:
+			die(log, "failed to create statistics socket: %s" % err)
 
-	signal.signal(signal.SIGTERM, handle_sigterm)
-	signal.signal(signal.SIGHUP, handle_sighup)
-	signal.signal(signal.SIGCHLD, lambda *_: gt.handle_sigchld())
+	if groups:
+		gt.catch_signals()
 
 	if config["main"]["pidfile"]:
 		try: